@@ -5,6 +5,6 @@
 # SPDX-License-Identifier: MIT
 """Main module file."""
 
-from pusimp.prevent_user_site_imports import prevent_user_site_imports
+from pusimp.prevent_user_site_imports import clear_verdicts, Guard, prevent_user_site_imports
 
-__all__ = ["prevent_user_site_imports"]
+__all__ = ["Guard", "clear_verdicts", "prevent_user_site_imports"]
@@ -0,0 +1,207 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Audit a fleet of python interpreters for user-site imports of a specific set of dependencies.
+
+The audit can be run from the command line as
+```
+python3 -m pusimp.audit --prefix /usr/lib/python3/dist-packages --dependency petsc4py --dependency mpi4py \
+    --interpreter /usr/bin/python3.11 --discover /opt/venvs
+```
+and streams one JSON object per line (NDJSON) on the standard output as soon as each interpreter is done.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import subprocess
+import sys
+import typing
+
+# Script executed by each audited interpreter. The file containing pusimp.prevent_user_site_imports is loaded
+# by path, rather than through import pusimp, so that the audited interpreter does not need pusimp installed
+# and a different copy of pusimp in its environment cannot interfere with the audit.
+_AUDIT_SCRIPT = """
+import importlib.util
+import json
+import sys
+
+if len(sys.path) > 0 and sys.path[0] == "":
+    del sys.path[0]
+spec = importlib.util.spec_from_file_location("_pusimp_audit", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+request = json.loads(sys.argv[2])
+(missing, broken, user_site, _) = module._classify_dependencies(
+    request["dependencies_expected_prefix"], request["dependencies_import_name"], request["dependencies_optional"])
+names = request["dependencies_import_name"]
+result = {
+    "version": ".".join(str(part) for part in sys.version_info[:3]),
+    "missing": {name: info for (name, info) in zip(names, missing) if info is not None},
+    "broken": {name: info["error"] for (name, info) in zip(names, broken) if info is not None},
+    "user_site": {name: info["actual"] for (name, info) in zip(names, user_site) if info is not None}
+}
+print(json.dumps(result))
+"""
+
+_INTERPRETER_NAME = re.compile(r"^python3(\.\d+)?$")
+
+
+def discover_interpreters(roots: typing.List[str], max_depth: int = 4) -> typing.List[str]:
+    """
+    Discover python interpreters installed under a list of root directories.
+
+    Parameters
+    ----------
+    roots
+        The directories to be searched, e.g. /usr, a directory containing several virtual environments,
+        or the envs directory of a conda installation.
+    max_depth
+        The maximum depth, relative to each root, of the bin directories to be searched.
+
+    Returns
+    -------
+    :
+        The path of every python3 or python3.x executable found in a bin directory. Executables in the same bin
+        directory which resolve to the same file are only reported once.
+    """
+    interpreters = []
+    for root in roots:
+        root_depth = root.rstrip(os.sep).count(os.sep)
+        for (directory, subdirectories, files) in os.walk(root):
+            if directory.count(os.sep) - root_depth >= max_depth:
+                subdirectories.clear()
+            if os.path.basename(directory) != "bin":
+                continue
+            subdirectories.clear()
+            resolved = set()
+            for name in sorted(files, reverse=True):  # python3.x first, python3 last
+                executable = os.path.join(directory, name)
+                if _INTERPRETER_NAME.match(name) and os.access(executable, os.X_OK):
+                    resolved_executable = os.path.realpath(executable)
+                    if resolved_executable not in resolved:
+                        resolved.add(resolved_executable)
+                        interpreters.append(executable)
+    return interpreters
+
+
+def audit_interpreter(
+    executable: str, dependencies_expected_prefix: str, dependencies_import_name: typing.List[str],
+    dependencies_optional: typing.List[bool], timeout: typing.Optional[float] = None
+) -> typing.Dict[str, typing.Any]:
+    """
+    Classify the dependencies of a package as seen by a python interpreter.
+
+    Parameters
+    ----------
+    executable
+        The python interpreter to be audited.
+    dependencies_expected_prefix, dependencies_import_name, dependencies_optional
+        See the documentation of pusimp.prevent_user_site_imports.
+    timeout
+        The maximum time, in seconds, allowed to the interpreter to complete the audit.
+
+    Returns
+    -------
+    :
+        A JSON-serializable dictionary with the executable, its version, and dictionaries of missing, broken
+        and user-site dependencies, keyed by their import name. The status entry is either "ok", "problems",
+        or "error" if the audit itself could not be carried out, in which case the error entry reports why.
+    """
+    assert len(dependencies_import_name) == len(dependencies_optional), "Incorrect input lengths"
+    request = {
+        "dependencies_expected_prefix": dependencies_expected_prefix,
+        "dependencies_import_name": dependencies_import_name,
+        "dependencies_optional": dependencies_optional
+    }
+    module_file = os.path.join(os.path.dirname(__file__), "prevent_user_site_imports.py")
+    try:
+        run_audit = subprocess.run(
+            [executable, "-c", _AUDIT_SCRIPT, module_file, json.dumps(request)], capture_output=True,
+            timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as audit_error:
+        return {"executable": executable, "status": "error", "error": str(audit_error)}
+    stdout_lines = run_audit.stdout.decode().strip().splitlines()
+    if run_audit.returncode != 0 or len(stdout_lines) == 0:
+        return {"executable": executable, "status": "error", "error": run_audit.stderr.decode().strip()}
+    result: typing.Dict[str, typing.Any] = {"executable": executable}
+    result.update(json.loads(stdout_lines[-1]))  # dependencies may print to stdout while being imported
+    if any(len(result[category]) > 0 for category in ("missing", "broken", "user_site")):
+        result["status"] = "problems"
+    else:
+        result["status"] = "ok"
+    return result
+
+
+def audit_interpreters(
+    executables: typing.List[str], dependencies_expected_prefix: str, dependencies_import_name: typing.List[str],
+    dependencies_optional: typing.List[bool], max_workers: typing.Optional[int] = None,
+    timeout: typing.Optional[float] = None
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """
+    Audit several python interpreters concurrently.
+
+    Each interpreter runs in its own process, and at most max_workers of them run at the same time.
+    Results are yielded as soon as each interpreter is done, hence not necessarily in the order of executables.
+    See the documentation of audit_interpreter for the description of parameters and of each result.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(
+                audit_interpreter, executable, dependencies_expected_prefix, dependencies_import_name,
+                dependencies_optional, timeout)
+            for executable in executables
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    """
+    Run the audit from the command line.
+
+    Returns
+    -------
+    :
+        The exit code, which is zero if and only if every interpreter was audited without problems.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python3 -m pusimp.audit", description="Audit python interpreters for user-site imports.")
+    parser.add_argument(
+        "--prefix", required=True, help="Expected prefix of import locations managed by the system manager.")
+    parser.add_argument(
+        "--dependency", action="append", default=[], help="Import name of a mandatory dependency.")
+    parser.add_argument(
+        "--optional-dependency", action="append", default=[], help="Import name of an optional dependency.")
+    parser.add_argument(
+        "--interpreter", action="append", default=[], help="Python interpreter to be audited.")
+    parser.add_argument(
+        "--discover", action="append", default=[], help="Root directory under which to discover interpreters.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of interpreters audited concurrently.")
+    parser.add_argument("--timeout", type=float, default=None, help="Timeout, in seconds, for each interpreter.")
+    arguments = parser.parse_args(argv)
+    executables = arguments.interpreter + [
+        executable for executable in discover_interpreters(arguments.discover)
+        if executable not in arguments.interpreter
+    ]
+    if len(executables) == 0:
+        parser.error("no interpreter to audit: use --interpreter or --discover")
+    dependencies_import_name = arguments.dependency + arguments.optional_dependency
+    dependencies_optional = [False] * len(arguments.dependency) + [True] * len(arguments.optional_dependency)
+    exit_code = 0
+    for result in audit_interpreters(
+        executables, arguments.prefix, dependencies_import_name, dependencies_optional, arguments.jobs,
+        arguments.timeout
+    ):
+        print(json.dumps(result), flush=True)
+        if result["status"] != "ok":
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
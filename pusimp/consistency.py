@@ -0,0 +1,220 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Check versions and wheel tags of dependencies against declared constraints, reading only their metadata."""
+
+import importlib.metadata
+import re
+import sys
+import typing
+
+_VERSION = re.compile(
+    r"^v?(?:(?P<epoch>\d+)!)?(?P<release>\d+(?:\.\d+)*)"
+    r"(?:[-_.]?(?P<pre_kind>a|alpha|b|beta|c|rc|pre|preview)[-_.]?(?P<pre>\d*))?"
+    r"(?:-(?P<implicit_post>\d+)|[-_.]?(?:post|rev|r)[-_.]?(?P<post>\d*))?"
+    r"(?:[-_.]?dev[-_.]?(?P<dev>\d*))?"
+    r"(?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?$",
+    re.IGNORECASE
+)
+
+_SPECIFIER = re.compile(r"^\s*(?P<operator>~=|===|==|!=|<=|>=|<|>)\s*(?P<version>[^\s,;]+)\s*$")
+
+_PRE_KINDS = {"a": 0, "alpha": 0, "b": 1, "beta": 1, "c": 2, "rc": 2, "pre": 2, "preview": 2}
+
+_VersionKey = typing.Tuple[int, typing.Tuple[int, ...], typing.Tuple[int, int], int, typing.Tuple[int, int]]
+
+
+def check_dependencies_consistency(
+    dependencies_pypi_name: typing.List[str], dependencies_version_constraint: typing.List[typing.Optional[str]],
+    check_wheel_tags: bool = False
+) -> typing.List[typing.Optional[typing.Dict[str, str]]]:
+    """
+    Check the distribution which would be imported for each dependency, without importing it.
+
+    Parameters
+    ----------
+    dependencies_pypi_name
+        The pypi name of the dependencies. The distribution of each dependency is looked up in the entries
+        of sys.path, in order, hence the same copy which would be imported is checked.
+    dependencies_version_constraint
+        A version specifier, corresponding to each dependency, e.g. ">=0.8,<0.9" or "==2019.1.*", or None
+        if the version of the dependency must not be checked.
+    check_wheel_tags
+        If True, also check that the tags in the WHEEL file of each distribution, if available,
+        are compatible with the running interpreter.
+
+    Returns
+    -------
+    :
+        A list of the same length as dependencies_pypi_name, which stores at each position either None,
+        if the dependency is consistent or its distribution could not be found, or a dictionary containing
+        the location of the distribution and a description of the problem.
+    """
+    assert len(dependencies_pypi_name) == len(dependencies_version_constraint), "Incorrect input lengths"
+    inconsistent_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]] = []
+    for (dependency_pypi_name, dependency_version_constraint) in zip(
+            dependencies_pypi_name, dependencies_version_constraint):
+        try:
+            distribution = importlib.metadata.distribution(dependency_pypi_name)
+        except importlib.metadata.PackageNotFoundError:
+            inconsistent_dependencies.append(None)
+            continue
+        location = str(distribution.locate_file(""))
+        problem = None
+        if dependency_version_constraint is not None and not version_satisfies(
+                distribution.version, dependency_version_constraint):
+            problem = (
+                f"has version {distribution.version} in {location}, "
+                f"which does not satisfy {dependency_version_constraint}"
+            )
+        elif check_wheel_tags:
+            wheel_tags = _read_wheel_tags(distribution)
+            if len(wheel_tags) > 0 and not any(_compatible_wheel_tag(wheel_tag) for wheel_tag in wheel_tags):
+                problem = (
+                    f"has wheel tags {', '.join(wheel_tags)} in {location}, which are not compatible with "
+                    f"{_interpreter_tag()}"
+                )
+        inconsistent_dependencies.append({"location": location, "problem": problem} if problem is not None else None)
+    return inconsistent_dependencies
+
+
+def version_satisfies(version: str, specifiers: str) -> bool:
+    """
+    Check whether a version satisfies a comma separated list of PEP 440 version specifiers.
+
+    Versions which cannot be parsed only satisfy === specifiers, and == specifiers with the same text.
+    Local version labels are ignored when comparing versions, unless the version of an == or != specifier has one.
+    """
+    for specifier in specifiers.split(","):
+        specifier_match = _SPECIFIER.match(specifier)
+        assert specifier_match is not None, f"Invalid version specifier {specifier}"
+        operator = specifier_match.group("operator")
+        specifier_version = specifier_match.group("version")
+        if operator == "===" or _version_key(version) is None:
+            if not (operator in ("===", "==") and version == specifier_version):
+                return False
+        elif not _version_satisfies_specifier(version, operator, specifier_version):
+            return False
+    return True
+
+
+def _version_satisfies_specifier(version: str, operator: str, specifier_version: str) -> bool:
+    """Check whether a parsable version satisfies a single specifier other than ===."""
+    version_key = _version_key(version)
+    assert version_key is not None
+    if operator in ("==", "!=") and specifier_version.endswith(".*"):
+        specifier_key = _version_key(specifier_version[:-2])
+        assert specifier_key is not None, f"Invalid version {specifier_version}"
+        specifier_release = _release(specifier_version[:-2])
+        matches = (
+            version_key[0] == specifier_key[0]
+            and (_release(version) + (0, ) * len(specifier_release))[:len(specifier_release)] == specifier_release
+        )
+        return matches if operator == "==" else not matches
+    specifier_key = _version_key(specifier_version)
+    assert specifier_key is not None, f"Invalid version {specifier_version}"
+    if operator in ("==", "!=") and _local_label(specifier_version) is not None:
+        matches = version_key == specifier_key and _local_label(version) == _local_label(specifier_version)
+        return matches if operator == "==" else not matches
+    if operator == "~=":
+        specifier_release = _release(specifier_version)
+        assert len(specifier_release) >= 2, f"Invalid compatible release specifier {specifier_version}"
+        prefix = f"{specifier_key[0]}!" + ".".join(str(part) for part in specifier_release[:-1])
+        return version_key >= specifier_key and _version_satisfies_specifier(version, "==", f"{prefix}.*")
+    # Exclusive comparisons do not match pre-releases and post-releases of the specified version, respectively,
+    # unless the specified version is itself a pre-release or a post-release: <V is thus <V.dev0, while >V also
+    # excludes every version with the same release and pre-release segments of V, as in the packaging library
+    if _is_prerelease(specifier_key):
+        less_than_key = specifier_key
+    else:
+        less_than_key = (*specifier_key[:2], (3, 0) if specifier_key[3] >= 0 else (-1, 0), specifier_key[3], (0, 0))
+    return {
+        "==": version_key == specifier_key, "!=": version_key != specifier_key,
+        "<=": version_key <= specifier_key, ">=": version_key >= specifier_key,
+        "<": version_key < less_than_key,
+        ">": version_key > specifier_key and not (
+            version_key[:3] == specifier_key[:3] and specifier_key[3] < 0 and specifier_key[4][0] != 0)
+    }[operator]
+
+
+def _is_prerelease(version_key: _VersionKey) -> bool:
+    """Check whether a version key corresponds to a pre-release or a development release."""
+    return version_key[2][0] != 3 or version_key[4][0] == 0
+
+
+def _version_key(version: str) -> typing.Optional[_VersionKey]:
+    """Return a key which sorts versions as in PEP 440, or None if the version cannot be parsed."""
+    version_match = _VERSION.match(version.strip())
+    if version_match is None:
+        return None
+    release = list(_release(version))
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    (pre_kind, pre, post, dev) = version_match.group("pre_kind", "pre", "post", "dev")
+    if version_match.group("implicit_post") is not None:
+        post = version_match.group("implicit_post")
+    if pre_kind is not None:
+        pre_key = (_PRE_KINDS[pre_kind.lower()], int(pre or 0))
+    elif dev is not None and post is None:
+        pre_key = (-1, 0)  # dev releases sort before pre-releases
+    else:
+        pre_key = (3, 0)
+    post_key = int(post or 0) if post is not None else -1
+    dev_key = (0, int(dev or 0)) if dev is not None else (1, 0)
+    return (int(version_match.group("epoch") or 0), tuple(release), pre_key, post_key, dev_key)
+
+
+def _local_label(version: str) -> typing.Optional[typing.Tuple[typing.Union[int, str], ...]]:
+    """Return the normalized local version label of a parsable version, or None if it has none."""
+    version_match = _VERSION.match(version.strip())
+    assert version_match is not None
+    local = version_match.group("local")
+    if local is None:
+        return None
+    return tuple(
+        int(segment) if segment.isdigit() else segment.lower() for segment in re.split(r"[-_.]", local))
+
+
+def _release(version: str) -> typing.Tuple[int, ...]:
+    """Return the release segment of a parsable version."""
+    version_match = _VERSION.match(version.strip())
+    assert version_match is not None
+    return tuple(int(part) for part in version_match.group("release").split("."))
+
+
+def _read_wheel_tags(distribution: importlib.metadata.Distribution) -> typing.List[str]:
+    """Read the tags in the WHEEL file of a distribution, if available."""
+    wheel = distribution.read_text("WHEEL")
+    if wheel is None:
+        return []
+    return [line.split(":", 1)[1].strip() for line in wheel.splitlines() if line.startswith("Tag:")]
+
+
+def _interpreter_tag() -> str:
+    """Return the interpreter tag of the running interpreter, e.g. cp312."""
+    interpreter_abbreviation = "cp" if sys.implementation.name == "cpython" else sys.implementation.name[:2]
+    return f"{interpreter_abbreviation}{sys.version_info.major}{sys.version_info.minor}"
+
+
+def _compatible_wheel_tag(wheel_tag: str) -> bool:
+    """Check whether the python and ABI parts of a (possibly compressed) wheel tag match the running interpreter."""
+    tag_parts = wheel_tag.split("-")
+    if len(tag_parts) != 3:
+        return False
+    interpreter_tag = _interpreter_tag()
+    (major, minor) = sys.version_info[:2]
+    for python_tag in tag_parts[0].split("."):
+        for abi_tag in tag_parts[1].split("."):
+            if abi_tag == "none" and python_tag in (
+                interpreter_tag, f"py{major}", *[f"py{major}{older_minor}" for older_minor in range(minor + 1)]
+            ):
+                return True
+            if abi_tag == "abi3" and python_tag in [
+                f"{interpreter_tag[:2]}{major}{older_minor}" for older_minor in range(minor + 1)
+            ]:
+                return True
+            if python_tag == interpreter_tag and abi_tag == f"{interpreter_tag}{getattr(sys, 'abiflags', '')}":
+                return True
+    return False
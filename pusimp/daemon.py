@@ -0,0 +1,365 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Serve the verdicts of guards to the short-lived interpreters of a node from a long-running daemon.
+
+Pipelines which start thousands of tiny python processes a minute, each importing a guarded package, pay for an
+environment fingerprint in every process even when verdicts are shared through files (see pusimp.node), since
+the fingerprint lists the expected prefix and the user site. The daemon keeps verdicts in memory instead, and
+invalidates them on inotify events, so that clients only identify their check by a digest of the check
+configuration, of the interpreter, of sys.path and of the location of dependencies which were already imported.
+
+The daemon can be run from the command line as
+```
+python3 -m pusimp.daemon --socket /run/user/1000/pusimp.sock
+```
+and listens on a Unix domain socket, which only the user running the daemon can connect to. Clients send one JSON
+request per line over the same connection:
+* a lookup {"key": ..., "directories": [...]} listing the directories from which the dependencies may be imported,
+  which the daemon starts watching. The reply is either {"import_error": ...} with the verdict, or {"epoch": ...}
+  if the verdict is not known;
+* after a miss, a publication {"key": ..., "directories": [...], "epoch": ..., "import_error": ...} of the verdict
+  computed by the client, which the daemon stores unless one of the directories changed since the lookup.
+A verdict is dropped as soon as any of its directories (or, for missing directories, their closest existing
+ancestor) changes. Clients fall back to the usual check when the daemon is not running, when the socket is not
+owned by the current user, or when the daemon does not reply within a timeout. Checks with the integrity tier are
+never served by the daemon, since files may be modified in place without any change to their directory.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import selectors
+import signal
+import site
+import socket
+import sys
+import threading
+import typing
+
+from pusimp.node import node_runtime_directory
+from pusimp.prevent_user_site_imports import _report_problems, Guard
+from pusimp.watcher import _EVENT_HEADER, _IN_IGNORED, _IN_Q_OVERFLOW, _inotify, _WATCH_MASK
+
+
+class VerdictDaemon:
+    """
+    In-memory index of the verdicts of guards, served over a Unix domain socket and invalidated by inotify events.
+
+    Parameters
+    ----------
+    socket_path
+        The path of the Unix domain socket. If not provided, see daemon_socket_path.
+    """
+
+    def __init__(self, socket_path: typing.Optional[str] = None) -> None:
+        self.socket_path = socket_path or daemon_socket_path()
+        self._server_socket: typing.Optional[socket.socket] = None
+        self._inotify_fd = -1
+        self._stop_fds = (-1, -1)
+        self._thread: typing.Optional[threading.Thread] = None
+        self._connections: typing.Dict[socket.socket, bytearray] = {}
+        # Verdicts together with the watch descriptors of their directories, the watch descriptor of each watched
+        # directory, the verdicts which depend on each watch descriptor, and the epoch of the last change
+        # to each watch descriptor. The epoch is incremented on every inotify event.
+        self._verdicts: typing.Dict[str, typing.Tuple[typing.Optional[str], typing.FrozenSet[int]]] = {}
+        self._watch_descriptors: typing.Dict[str, int] = {}
+        self._watched_verdicts: typing.Dict[int, typing.Set[str]] = {}
+        self._changed_epoch: typing.Dict[int, int] = {}
+        self._epoch = 0
+
+    def __enter__(self) -> "VerdictDaemon":
+        """Start serving."""
+        self.start()
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:  # noqa: ANN401
+        """Stop serving."""
+        self.stop()
+
+    def start(self) -> None:
+        """Listen on the socket, subscribe to inotify events, and start the background thread which serves clients."""
+        assert self._thread is None, "The daemon was already started"
+        (self._inotify_fd, self._add_watch) = _inotify()
+        self._server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.socket_path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe_socket:
+                    probe_socket.connect(self.socket_path)
+            except ConnectionRefusedError:
+                # A stale socket left behind by a daemon which died.
+                os.unlink(self.socket_path)
+            else:
+                self._server_socket.close()
+                os.close(self._inotify_fd)
+                raise OSError(f"Another daemon is already listening on {self.socket_path}")
+        # The socket is created with restrictive permissions, so that only the current user can connect.
+        previous_umask = os.umask(0o177)
+        try:
+            self._server_socket.bind(self.socket_path)
+        finally:
+            os.umask(previous_umask)
+        self._server_socket.listen()
+        self._stop_fds = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="pusimp-daemon", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread, close every connection and remove the socket."""
+        if self._thread is not None:
+            os.write(self._stop_fds[1], b"\0")
+            self._thread.join()
+            self._thread = None
+            assert self._server_socket is not None
+            self._server_socket.close()
+            os.unlink(self.socket_path)
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+            for fd in (self._inotify_fd, *self._stop_fds):
+                os.close(fd)
+            self._verdicts.clear()
+            self._watch_descriptors.clear()
+            self._watched_verdicts.clear()
+            self._changed_epoch.clear()
+
+    def _run(self) -> None:
+        """Serve clients and handle inotify events, until stopped."""
+        assert self._server_socket is not None
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._server_socket, selectors.EVENT_READ)
+            selector.register(self._inotify_fd, selectors.EVENT_READ)
+            selector.register(self._stop_fds[0], selectors.EVENT_READ)
+            while True:
+                for (selector_key, _) in selector.select():
+                    if selector_key.fileobj == self._stop_fds[0]:
+                        return
+                    elif selector_key.fileobj == self._inotify_fd:
+                        self._read_events()
+                    elif selector_key.fileobj is self._server_socket:
+                        (connection, _) = self._server_socket.accept()
+                        connection.settimeout(1.0)
+                        self._connections[connection] = bytearray()
+                        selector.register(connection, selectors.EVENT_READ)
+                    else:
+                        connection = typing.cast(socket.socket, selector_key.fileobj)
+                        if not self._serve(connection):
+                            selector.unregister(connection)
+                            del self._connections[connection]
+                            connection.close()
+
+    def _serve(self, connection: socket.socket) -> bool:
+        """Reply to the complete requests received on a connection, and return False once it should be closed."""
+        try:
+            data = connection.recv(65536)
+        except OSError:
+            return False
+        if len(data) == 0:
+            return False
+        buffer = self._connections[connection]
+        buffer.extend(data)
+        while b"\n" in buffer:
+            (line, _, remainder) = bytes(buffer).partition(b"\n")
+            buffer[:] = remainder
+            try:
+                reply = self._reply(json.loads(line))
+            except (ValueError, TypeError, KeyError):
+                return False
+            try:
+                connection.sendall(json.dumps(reply).encode() + b"\n")
+            except OSError:
+                return False
+        return True
+
+    def _reply(self, request: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        """Look up or store a verdict."""
+        key = request["key"]
+        directories = request["directories"]
+        if not isinstance(key, str) or not isinstance(directories, list) or not all(
+                isinstance(directory, str) for directory in directories):
+            raise TypeError("Invalid request")
+        if "epoch" not in request:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                return {"import_error": verdict[0]}
+            self._watch(directories)
+            return {"epoch": self._epoch}
+        (epoch, import_error) = (request["epoch"], request["import_error"])
+        if not isinstance(epoch, int) or not isinstance(import_error, (str, type(None))):
+            raise TypeError("Invalid request")
+        watch_descriptors = self._watch(directories)
+        if watch_descriptors is not None and all(
+                self._changed_epoch.get(watch_descriptor, 0) <= epoch for watch_descriptor in watch_descriptors):
+            self._verdicts[key] = (import_error, watch_descriptors)
+            for watch_descriptor in watch_descriptors:
+                self._watched_verdicts.setdefault(watch_descriptor, set()).add(key)
+        return {}
+
+    def _watch(self, directories: typing.List[str]) -> typing.Optional[typing.FrozenSet[int]]:
+        """
+        Watch a list of directories, or the closest existing ancestor of the missing ones.
+
+        Returns the watch descriptors, or None if a directory cannot be watched.
+        """
+        watch_descriptors = set()
+        for directory in directories:
+            while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+                directory = os.path.dirname(directory)
+            watch_descriptor = self._watch_descriptors.get(directory)
+            if watch_descriptor is None:
+                watch_descriptor = self._add_watch(self._inotify_fd, os.fsencode(directory), _WATCH_MASK)
+                if watch_descriptor < 0:
+                    return None
+                self._watch_descriptors[directory] = watch_descriptor
+            watch_descriptors.add(watch_descriptor)
+        return frozenset(watch_descriptors)
+
+    def _read_events(self) -> None:
+        """Read the pending inotify events, and drop the verdicts which depend on the changed directories."""
+        events = os.read(self._inotify_fd, 65536)
+        offset = 0
+        while offset < len(events):
+            (watch_descriptor, mask, _, name_length) = _EVENT_HEADER.unpack_from(events, offset)
+            offset += _EVENT_HEADER.size + name_length
+            self._handle_event(watch_descriptor, mask)
+
+    def _handle_event(self, watch_descriptor: int, mask: int) -> None:
+        """Drop the verdicts which depend on the directory which changed, or on every directory on overflow."""
+        self._epoch += 1
+        if mask & _IN_Q_OVERFLOW:
+            changed_watch_descriptors = list(self._watch_descriptors.values())
+            self._verdicts.clear()
+        else:
+            changed_watch_descriptors = [watch_descriptor]
+        for changed_watch_descriptor in changed_watch_descriptors:
+            self._changed_epoch[changed_watch_descriptor] = self._epoch
+            for key in self._watched_verdicts.pop(changed_watch_descriptor, set()):
+                self._verdicts.pop(key, None)
+        if mask & _IN_IGNORED:
+            # The directory was removed: watch it again, or its ancestor, on the next request.
+            for (directory, directory_watch_descriptor) in list(self._watch_descriptors.items()):
+                if directory_watch_descriptor == watch_descriptor:
+                    del self._watch_descriptors[directory]
+
+
+def daemon_socket_path() -> str:
+    """Return the default path of the socket of the daemon of the current user, in the node runtime directory."""
+    return os.path.join(node_runtime_directory(), f"pusimp-{os.getuid()}.sock")
+
+
+def check_with_daemon(guard: Guard, socket_path: typing.Optional[str] = None, timeout: float = 0.1) -> None:
+    """
+    Check the dependencies of a guard, reusing the verdict served by the daemon if available.
+
+    Parameters
+    ----------
+    guard
+        The guard to be checked.
+    socket_path
+        The path of the socket of the daemon. If not provided, see daemon_socket_path.
+    timeout
+        The number of seconds after which the daemon is considered unresponsive, and the dependencies are probed
+        by the current process.
+
+    Raises
+    ------
+    ImportError
+        See prevent_user_site_imports.
+    """
+    (import_error, failure_policy) = _diagnose_with_daemon(guard, socket_path or daemon_socket_path(), timeout)
+    if import_error is not None:
+        _report_problems(guard.package_name, failure_policy, import_error, 3)
+    if guard.monitor_imports:
+        guard._start_import_monitor(failure_policy)
+
+
+def _diagnose_with_daemon(
+    guard: Guard, socket_path: str, timeout: float
+) -> typing.Tuple[typing.Optional[str], str]:
+    """Ask the daemon for the verdict of a guard, or probe the dependencies and publish the verdict to the daemon."""
+    if os.getenv(guard._allow_user_site_imports_env_name) is not None:
+        return None, guard.failure_policy
+    (check_tier, escalation_tier, failure_policy) = guard._check_arguments()
+    if "integrity" in (check_tier, escalation_tier):
+        return guard._diagnose()
+
+    key = hashlib.sha256(json.dumps([
+        guard._configuration_key, check_tier, escalation_tier, failure_policy, sys.executable, sys.path,
+        getattr(site, "USER_SITE", None), [
+            getattr(sys.modules.get(dependency_import_name), "__file__", None)
+            for dependency_import_name in guard.dependencies_import_name]
+    ]).encode()).hexdigest()[:32]
+    directories = [guard.dependencies_expected_prefix]
+    user_site = getattr(site, "USER_SITE", None)
+    if user_site is not None:
+        directories.append(user_site)
+    directories.extend(os.path.abspath(sys_path_entry or os.getcwd()) for sys_path_entry in sys.path)
+    try:
+        if os.stat(socket_path).st_uid != os.getuid():
+            return guard._diagnose()
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except OSError:
+        return guard._diagnose()
+    with client_socket, client_socket.makefile("rwb") as client_file:
+        try:
+            client_socket.settimeout(timeout)
+            client_socket.connect(socket_path)
+            reply = _request(client_file, {"key": key, "directories": directories})
+            if "import_error" in reply and isinstance(reply["import_error"], (str, type(None))):
+                return reply["import_error"], failure_policy
+            epoch = reply["epoch"]
+            if not isinstance(epoch, int):
+                raise TypeError("Invalid reply")
+        except (OSError, ValueError, KeyError, TypeError):
+            # The daemon is not running, not responsive, or its reply is not valid.
+            return guard._diagnose()
+        (import_error, failure_policy) = guard._diagnose()
+        try:
+            _request(client_file, {
+                "key": key, "directories": directories, "epoch": epoch, "import_error": import_error})
+        except (OSError, ValueError, TypeError):
+            pass
+        return import_error, failure_policy
+
+
+def _request(client_file: io.BufferedIOBase, request: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Send a request to the daemon, and return its reply."""
+    client_file.write(json.dumps(request).encode() + b"\n")
+    client_file.flush()
+    reply = json.loads(client_file.readline())
+    if not isinstance(reply, dict):
+        raise TypeError("Invalid reply")
+    return reply
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    """
+    Run the daemon from the command line, until it receives SIGINT or SIGTERM.
+
+    Returns
+    -------
+    :
+        The exit code.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python3 -m pusimp.daemon", description="Serve the verdicts of pusimp guards to the processes of a node.")
+    parser.add_argument("--socket", default=None, help="Path of the Unix domain socket to listen on.")
+    arguments = parser.parse_args(argv)
+    # Signals are blocked before the background thread is started, so that they are only received by sigwait.
+    stop_signals = {signal.SIGINT, signal.SIGTERM}
+    previous_mask = signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+    try:
+        with VerdictDaemon(arguments.socket) as daemon:
+            print(f"Serving verdicts on {daemon.socket_path}", flush=True)
+            signal.sigwait(stop_signals)
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous_mask)
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
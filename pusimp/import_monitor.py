@@ -0,0 +1,93 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Monitor the imports of guarded dependencies, and of their submodules, which happen after the check."""
+
+import importlib.abc
+import importlib.machinery
+import os
+import sys
+import types
+import typing
+
+# Monitors which are currently installed in sys.meta_path, keyed by the name of the package which requested them.
+_import_monitors: typing.Dict[str, "ImportMonitor"] = {}
+
+
+class ImportMonitor(importlib.abc.MetaPathFinder):
+    """
+    Meta path finder which checks the location of every later import of guarded dependencies.
+
+    The monitor does not find modules by itself: it asks the finders which follow it in sys.meta_path,
+    checks the location of the resulting spec against the expected prefix, and then returns the spec
+    so that the import is not looked up twice. Imports of modules whose top-level name is not guarded
+    only pay for a lookup in a frozen set.
+
+    Parameters
+    ----------
+    guarded_import_names
+        The import name of the guarded dependencies. Submodules of guarded dependencies are monitored as well.
+    expected_prefix
+        The expected prefix of import locations managed by the system manager.
+    report_violation
+        A callable which is called with the name and the location of every module imported from outside
+        of expected_prefix. Raising an ImportError from it makes the import fail.
+    """
+
+    def __init__(
+        self, guarded_import_names: typing.Iterable[str], expected_prefix: str,
+        report_violation: typing.Callable[[str, str], None]
+    ) -> None:
+        self._guarded_import_names = frozenset(guarded_import_names)
+        self._expected_prefix = os.path.join(_normalize_location(expected_prefix), "")
+        self._report_violation = report_violation
+
+    def find_spec(
+        self, fullname: str, path: typing.Optional[typing.Sequence[str]],
+        target: typing.Optional[types.ModuleType] = None
+    ) -> typing.Optional[importlib.machinery.ModuleSpec]:
+        """Find the spec of a module with the following finders, and check its location if the module is guarded."""
+        if fullname.partition(".")[0] not in self._guarded_import_names:
+            return None
+        meta_path = list(sys.meta_path)
+        for finder in meta_path[meta_path.index(self) + 1:] if self in meta_path else meta_path:
+            find_spec: typing.Optional[typing.Callable[..., typing.Optional[importlib.machinery.ModuleSpec]]] = getattr(
+                finder, "find_spec", None)
+            spec = find_spec(fullname, path, target) if find_spec is not None else None
+            if spec is not None:
+                break
+        else:
+            return None
+        for location in _spec_locations(spec):
+            if not _normalize_location(location).startswith(self._expected_prefix):
+                self._report_violation(fullname, location)
+                break
+        return spec
+
+
+def start_import_monitor(package_name: str, monitor: ImportMonitor) -> None:
+    """Install a monitor at the beginning of sys.meta_path, replacing the one previously installed by a package."""
+    stop_import_monitor(package_name)
+    sys.meta_path.insert(0, monitor)
+    _import_monitors[package_name] = monitor
+
+
+def stop_import_monitor(package_name: str) -> None:
+    """Remove the monitor installed by a package from sys.meta_path, if any."""
+    monitor = _import_monitors.pop(package_name, None)
+    if monitor is not None and monitor in sys.meta_path:
+        sys.meta_path.remove(monitor)
+
+
+def _spec_locations(spec: importlib.machinery.ModuleSpec) -> typing.List[str]:
+    """Return the file of a module, or the directories of a namespace package."""
+    if spec.has_location and spec.origin is not None:
+        return [spec.origin]
+    return list(spec.submodule_search_locations or [])
+
+
+def _normalize_location(location: str) -> str:
+    """Normalize a location, since zipimport reports locations relative to archives which may be relative paths."""
+    return os.path.normcase(os.path.abspath(location))
@@ -0,0 +1,197 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Verify that the files of dependencies provided by the system manager were not modified after installation."""
+
+import base64
+import concurrent.futures
+import csv
+import hashlib
+import importlib.metadata
+import json
+import mmap
+import os
+import threading
+import typing
+
+# Cache of file digests: for each path and hash algorithm, the cache stores the size, modification time and inode
+# of the file at the time the digest was computed, and the digest itself.
+_digests_cache: typing.Dict[typing.Tuple[str, str], typing.Tuple[int, int, int, str]] = {}
+_digests_cache_lock = threading.Lock()
+_digests_cache_updates = 0
+_digests_cache_loaded_paths: typing.Set[str] = set()
+
+
+def verify_dependencies_integrity(
+    dependencies_expected_prefix: str, dependencies_pypi_name: typing.List[str],
+    dependencies_manifest: typing.Optional[typing.List[typing.Optional[str]]] = None,
+    cache_path: typing.Optional[str] = None, max_workers: typing.Optional[int] = None
+) -> typing.List[typing.Optional[typing.List[str]]]:
+    """
+    Verify the files of each dependency against the hashes recorded at installation time.
+
+    Parameters
+    ----------
+    dependencies_expected_prefix
+        The expected prefix of import locations managed by the system manager. Only distributions installed
+        in this prefix are verified.
+    dependencies_pypi_name
+        The pypi name of the dependencies, employed to locate the RECORD file of their distribution.
+    dependencies_manifest
+        An optional manifest file, corresponding to each dependency, which is employed when the distribution
+        does not ship a RECORD file (e.g., because the system manager removed it). The manifest has the same
+        format of a RECORD file, i.e. one line per file containing its path relative to
+        dependencies_expected_prefix, a hash in the form algorithm=urlsafe-base64-digest, and the file size.
+    cache_path
+        An optional JSON file in which digests are persisted across runs. Digests are also cached in memory,
+        and in both cases they are recomputed only when the path, size, modification time or inode of a file
+        change.
+    max_workers
+        The maximum number of threads employed to compute digests.
+
+    Returns
+    -------
+    :
+        A list of the same length as dependencies_pypi_name, which stores at each position either None,
+        if the dependency could be verified successfully or could not be verified at all for lack of both
+        RECORD and manifest, or the list of files which were either modified or deleted. Files whose digest
+        cannot be computed (e.g., because they cannot be read, or because their hash algorithm is not
+        supported) are reported as modified, and so is the manifest itself when it cannot be read.
+    """
+    if dependencies_manifest is None:
+        dependencies_manifest = [None] * len(dependencies_pypi_name)
+    assert len(dependencies_pypi_name) == len(dependencies_manifest), "Incorrect input lengths"
+
+    if cache_path is not None:
+        _load_digests_cache(cache_path)
+    digests_cache_updates = _digests_cache_updates
+
+    dependencies_files: typing.List[typing.List[typing.Tuple[str, str, str]]] = []
+    unreadable_manifests: typing.List[typing.Optional[str]] = []
+    for (dependency_pypi_name, dependency_manifest) in zip(dependencies_pypi_name, dependencies_manifest):
+        dependency_files = _read_record(dependencies_expected_prefix, dependency_pypi_name)
+        unreadable_manifest = None
+        if dependency_files is None and dependency_manifest is not None:
+            try:
+                dependency_files = _read_manifest(dependencies_expected_prefix, dependency_manifest)
+            except OSError:
+                unreadable_manifest = dependency_manifest
+        dependencies_files.append(dependency_files if dependency_files is not None else [])
+        unreadable_manifests.append(unreadable_manifest)
+
+    all_files = [dependency_file for dependency_files in dependencies_files for dependency_file in dependency_files]
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        all_digests = list(executor.map(lambda dependency_file: _cached_file_digest(*dependency_file[:2]), all_files))
+    digests = dict(zip([dependency_file[:2] for dependency_file in all_files], all_digests))
+
+    if cache_path is not None and _digests_cache_updates != digests_cache_updates:
+        _save_digests_cache(cache_path)
+
+    modified_dependencies: typing.List[typing.Optional[typing.List[str]]] = []
+    for (dependency_files, unreadable_manifest) in zip(dependencies_files, unreadable_manifests):
+        modified_files = [
+            path for (path, algorithm, expected_digest) in dependency_files
+            if digests[(path, algorithm)] != expected_digest
+        ]
+        if unreadable_manifest is not None:
+            modified_files.append(unreadable_manifest)
+        modified_dependencies.append(modified_files if len(modified_files) > 0 else None)
+    return modified_dependencies
+
+
+def _read_record(
+    dependencies_expected_prefix: str, dependency_pypi_name: str
+) -> typing.Optional[typing.List[typing.Tuple[str, str, str]]]:
+    """Read path, hash algorithm and expected digest of every hashed file in the RECORD of a distribution."""
+    distributions = importlib.metadata.distributions(name=dependency_pypi_name, path=[dependencies_expected_prefix])
+    for distribution in distributions:
+        distribution_files = distribution.files
+        if distribution_files is None:
+            return None
+        return [
+            (os.path.normpath(str(distribution.locate_file(path))), path.hash.mode, path.hash.value)
+            for path in distribution_files if path.hash is not None
+        ]
+    return None
+
+
+def _read_manifest(
+    dependencies_expected_prefix: str, dependency_manifest: str
+) -> typing.List[typing.Tuple[str, str, str]]:
+    """Read path, hash algorithm and expected digest of every hashed file in a manifest."""
+    manifest_files = []
+    with open(dependency_manifest, newline="") as manifest:
+        for row in csv.reader(manifest):
+            if len(row) >= 2 and "=" in row[1]:
+                (algorithm, expected_digest) = row[1].split("=", 1)
+                manifest_files.append(
+                    (os.path.normpath(os.path.join(dependencies_expected_prefix, row[0])), algorithm, expected_digest))
+    return manifest_files
+
+
+def _cached_file_digest(path: str, algorithm: str) -> str:
+    """Compute the digest of a file, unless it is already available in cache.
+
+    The digest is returned with the same encoding employed by RECORD files. An empty string, which is never
+    cached, is returned if the file does not exist or cannot be read, or if the hash algorithm is not supported.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    cache_key = (path, algorithm)
+    cache_value = _digests_cache.get(cache_key)
+    if cache_value is not None and cache_value[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+        return cache_value[3]
+    global _digests_cache_updates
+    try:
+        digest = _file_digest(path, algorithm, stat.st_size)
+    except (OSError, ValueError):
+        return ""
+    with _digests_cache_lock:
+        _digests_cache[cache_key] = (stat.st_size, stat.st_mtime_ns, stat.st_ino, digest)
+        _digests_cache_updates += 1
+    return digest
+
+
+def _file_digest(path: str, algorithm: str, size: int) -> str:
+    """Compute the digest of a file by a memory-mapped read."""
+    file_hash = hashlib.new(algorithm)
+    if size > 0:
+        with open(path, "rb") as file_, mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ) as file_map:
+            file_hash.update(file_map)
+    return base64.urlsafe_b64encode(file_hash.digest()).rstrip(b"=").decode()
+
+
+def _load_digests_cache(cache_path: str) -> None:
+    """Load persisted digests into the in-memory cache, only once per cache file."""
+    if cache_path in _digests_cache_loaded_paths:
+        return
+    _digests_cache_loaded_paths.add(cache_path)
+    try:
+        with open(cache_path) as cache_file:
+            cache_entries = json.load(cache_file)
+        loaded_cache = {
+            (str(path), str(algorithm)): (int(size), int(mtime), int(inode), str(digest))
+            for (path, algorithm, size, mtime, inode, digest) in cache_entries
+        }
+    except (OSError, TypeError, ValueError):
+        # A corrupted cache, or a cache written with a different layout, is ignored altogether.
+        return
+    with _digests_cache_lock:
+        for (cache_key, cache_value) in loaded_cache.items():
+            _digests_cache.setdefault(cache_key, cache_value)
+
+
+def _save_digests_cache(cache_path: str) -> None:
+    """Persist the in-memory cache, atomically replacing the previous content of the cache file."""
+    with _digests_cache_lock:
+        cache_entries = [[*cache_key, *cache_value] for (cache_key, cache_value) in _digests_cache.items()]
+    cache_directory = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(cache_directory, exist_ok=True)
+    temporary_cache_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}"
+    with open(temporary_cache_path, "w") as cache_file:
+        json.dump(cache_entries, cache_file)
+    os.replace(temporary_cache_path, cache_path)
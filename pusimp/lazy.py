@@ -0,0 +1,80 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Check the dependencies of a guard, and return lazy modules which are executed only on first attribute access.
+
+Heavy dependencies which are only used in some code paths slow down the import of the guarded package, even when
+their location is checked without importing them. Lazy imports check the dependencies with the tiers of the guard,
+which should be either static or spec, then verify that the spec of each dependency which is not imported yet points
+to its expected location, and finally create a module with importlib.util.LazyLoader, which is added to sys.modules
+so that later imports of the dependency return it. The body of the dependency is executed on first attribute access.
+Note that an import statement reads attributes of the module it finds in sys.modules on some python versions:
+the guarded package should rather store the returned modules, and import the dependency only where it is used.
+"""
+
+import importlib.util
+import os
+import sys
+import types
+import typing
+
+from pusimp.prevent_user_site_imports import _format_problems, _matches_expected_location, _report_problems, Guard
+
+
+def lazy_import(guard: Guard) -> typing.Dict[str, types.ModuleType]:
+    """
+    Check the dependencies of a guard, and import them lazily.
+
+    Parameters
+    ----------
+    guard
+        The guard to be checked. Its check tier should be either static or spec, since the import tier imports
+        every dependency eagerly while checking it.
+
+    Returns
+    -------
+    :
+        A dictionary from the import name of each dependency to its module. Dependencies which were already imported
+        are returned as they are, while the others are returned as lazy modules. Optional dependencies which are
+        not found, and dependencies which are not at their expected location but were allowed by the failure policy,
+        are not returned.
+
+    Raises
+    ------
+    ImportError
+        See prevent_user_site_imports.
+    """
+    guard._check(4)
+    lazy_modules: typing.Dict[str, types.ModuleType] = {}
+    allow_user_site_imports = os.getenv(guard._allow_user_site_imports_env_name) is not None
+    (_, _, failure_policy) = guard._check_arguments()
+    for (dependency_id, dependency_import_name) in enumerate(guard.dependencies_import_name):
+        dependency_module = sys.modules.get(dependency_import_name)
+        if dependency_module is None:
+            dependency_spec = importlib.util.find_spec(dependency_import_name)
+            if dependency_spec is None:
+                continue
+            dependency_expected_path = guard.dependencies_expected_path[dependency_id]
+            if (
+                dependency_spec.origin is None
+                or not _matches_expected_location(dependency_spec.origin, dependency_expected_path)
+            ) and not allow_user_site_imports:
+                import_error = _format_problems(
+                    guard, [dependency_import_name], [guard.dependencies_pypi_name[dependency_id]],
+                    [guard.dependencies_extra_error_message[dependency_id]], [None], [None], [{
+                        "expected": dependency_expected_path, "actual": str(dependency_spec.origin)
+                    }], [None], [None]
+                )
+                assert import_error is not None
+                _report_problems(guard.package_name, failure_policy, import_error, 3)
+                continue
+            assert dependency_spec.loader is not None
+            dependency_loader = importlib.util.LazyLoader(dependency_spec.loader)
+            dependency_spec.loader = dependency_loader
+            dependency_module = importlib.util.module_from_spec(dependency_spec)
+            sys.modules[dependency_import_name] = dependency_module
+            dependency_loader.exec_module(dependency_module)
+        lazy_modules[dependency_import_name] = dependency_module
+    return lazy_modules
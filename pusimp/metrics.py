@@ -0,0 +1,235 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Export the outcomes and the duration of guard checks to a Prometheus node-exporter textfile.
+
+The textfile collector of node-exporter exposes every *.prom file of a directory, so that operators can see which
+hosts keep hitting user-site conflicts and how much startup time the guard costs without grepping ImportErrors out
+of job logs. Every process which checks a guard with check_with_metrics adds its own samples to the counters and
+histograms which are already stored in the textfile:
+* pusimp_guard_runs_total, by package and outcome (ok or problems);
+* pusimp_guard_violations_total, by package, category (missing, broken, user_site, modified or inconsistent)
+  and dependency;
+* pusimp_guard_duration_seconds, a histogram of the duration of checks by package.
+Updates are carried out in a background thread, while holding an flock on a sidecar lock file, and the textfile
+is replaced atomically, so that node-exporter never reads a partially written file. The textfile should be
+dedicated to pusimp, since lines which are not samples are dropped when it is rewritten.
+"""
+
+import fcntl
+import os
+import re
+import tempfile
+import threading
+import time
+import typing
+
+from pusimp.prevent_user_site_imports import _report_problems, Guard
+
+# Upper bounds, in seconds, of the buckets of the duration histogram.
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Help text and type of each metric family.
+_METRIC_FAMILIES = {
+    "pusimp_guard_runs_total": ("Number of guard checks, by outcome.", "counter"),
+    "pusimp_guard_violations_total": ("Number of problems found by guard checks, by category and dependency.",
+                                      "counter"),
+    "pusimp_guard_duration_seconds": ("Duration of guard checks.", "histogram")
+}
+
+# Headers of the categories of problems in the error message prepared by _format_problems.
+_CATEGORY_HEADERS = (
+    ("Missing dependencies:", "missing"),
+    ("Broken dependencies:", "broken"),
+    ("Dependencies imported from a local path ", "user_site"),
+    ("Dependencies with files which differ ", "modified"),
+    ("Dependencies which are inconsistent ", "inconsistent")
+)
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$")
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)",?')
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+Samples = typing.Dict[typing.Tuple[str, Labels], float]
+
+# Background threads which are still updating textfiles.
+_pending_writers: typing.Set[threading.Thread] = set()
+_pending_writers_lock = threading.Lock()
+
+
+def check_with_metrics(guard: Guard, textfile_path: str) -> None:
+    """
+    Check the dependencies of a guard, and add the outcome and duration of the check to a textfile.
+
+    Parameters
+    ----------
+    guard
+        The guard to be checked.
+    textfile_path
+        The textfile to be updated, which should have the .prom extension and be stored in the directory of the
+        textfile collector of node-exporter. The textfile is updated in a background thread, so that the check
+        does not wait for other processes which are updating it.
+
+    Raises
+    ------
+    ImportError
+        See prevent_user_site_imports.
+    """
+    start = time.perf_counter()
+    (import_error, failure_policy) = guard._diagnose()
+    duration = time.perf_counter() - start
+    writer = threading.Thread(
+        target=_update_textfile, args=(textfile_path, _guard_samples(guard.package_name, import_error, duration)),
+        name=f"pusimp-metrics-{guard.package_name}")
+    with _pending_writers_lock:
+        _pending_writers.add(writer)
+    writer.start()
+    if import_error is not None:
+        _report_problems(guard.package_name, failure_policy, import_error, 3)
+    if guard.monitor_imports:
+        guard._start_import_monitor(failure_policy)
+
+
+def flush_metrics(timeout: typing.Optional[float] = None) -> None:
+    """Wait until the textfiles have been updated with the outcome of every check carried out so far."""
+    with _pending_writers_lock:
+        pending_writers = list(_pending_writers)
+    for writer in pending_writers:
+        writer.join(timeout)
+
+
+def problems_by_category(import_error: typing.Optional[str]) -> typing.Dict[str, typing.List[str]]:
+    """
+    Return the import names of the dependencies listed in each category of an error message.
+
+    Parameters
+    ----------
+    import_error
+        The error message of a guard, or None if no problem was found.
+
+    Returns
+    -------
+    :
+        A dictionary from the categories with at least a problem (among missing, broken, user_site, modified
+        and inconsistent) to the import names of the dependencies in that category.
+    """
+    problems: typing.Dict[str, typing.List[str]] = {}
+    if import_error is None:
+        return problems
+    category = None
+    for line in import_error.splitlines()[1:]:
+        if line == "pusimp suggests to apply all of the following fixes:":
+            break
+        header = line.partition(") ")[2]
+        if line.startswith("* ") and category is not None:
+            problems[category].append(line.split(" ", 2)[1])
+        elif any(header.startswith(category_header) for (category_header, _) in _CATEGORY_HEADERS):
+            category = next(
+                category_name for (category_header, category_name) in _CATEGORY_HEADERS
+                if header.startswith(category_header))
+            problems[category] = []
+    return problems
+
+
+def _guard_samples(package_name: str, import_error: typing.Optional[str], duration: float) -> Samples:
+    """Return the increments of the samples of a guard check."""
+    package_label = ("package", package_name)
+    increments: Samples = {
+        ("pusimp_guard_runs_total", (("outcome", "ok" if import_error is None else "problems"), package_label)): 1,
+        ("pusimp_guard_duration_seconds_sum", (package_label, )): duration,
+        ("pusimp_guard_duration_seconds_count", (package_label, )): 1
+    }
+    for bucket in (*(repr(bucket) for bucket in DURATION_BUCKETS), "+Inf"):
+        increments[("pusimp_guard_duration_seconds_bucket", (("le", bucket), package_label))] = int(
+            duration <= float(bucket))
+    for (category, dependencies_import_name) in problems_by_category(import_error).items():
+        for dependency_import_name in dependencies_import_name:
+            sample_key = ("pusimp_guard_violations_total", (
+                ("category", category), ("dependency", dependency_import_name), package_label))
+            increments[sample_key] = increments.get(sample_key, 0) + 1
+    return increments
+
+
+def _update_textfile(textfile_path: str, increments: Samples) -> None:
+    """Add increments to the samples stored in a textfile, while holding the lock of the textfile."""
+    try:
+        lock_fd = os.open(f"{textfile_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            samples = _read_samples(textfile_path)
+            for (sample_key, increment) in increments.items():
+                samples[sample_key] = samples.get(sample_key, 0) + increment
+            textfile_fd, textfile_temporary_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(textfile_path)), prefix=os.path.basename(textfile_path),
+                suffix=".tmp")
+            with os.fdopen(textfile_fd, "w") as textfile:
+                textfile.write(_format_samples(samples))
+            os.chmod(textfile_temporary_path, 0o644)
+            os.replace(textfile_temporary_path, textfile_path)
+        finally:
+            os.close(lock_fd)
+    except OSError:
+        # Metrics are best effort, and must never break the guarded package.
+        pass
+    finally:
+        with _pending_writers_lock:
+            _pending_writers.discard(threading.current_thread())
+
+
+def _read_samples(textfile_path: str) -> Samples:
+    """Read the samples stored in a textfile, ignoring comments and lines which are not valid samples."""
+    samples: Samples = {}
+    try:
+        with open(textfile_path) as textfile:
+            lines = textfile.read().splitlines()
+    except FileNotFoundError:
+        return samples
+    for line in lines:
+        sample_match = _SAMPLE.match(line)
+        if sample_match is None:
+            continue
+        (name, labels_text, value) = sample_match.groups()
+        labels = tuple(sorted(
+            (label_name, _unescape(label_value)) for (label_name, label_value) in _LABEL.findall(labels_text or "")))
+        try:
+            samples[(name, labels)] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+def _format_samples(samples: Samples) -> str:
+    """Format samples in the Prometheus text exposition format, grouped by metric family."""
+    def sort_key(sample_key: typing.Tuple[str, Labels]) -> typing.Tuple[typing.Any, ...]:
+        (name, labels) = sample_key
+        return (name, tuple(
+            (label_name, float(label_value) if label_name == "le" else 0.0, label_value)
+            for (label_name, label_value) in labels))
+
+    lines = []
+    for (family_name, (family_help, family_type)) in _METRIC_FAMILIES.items():
+        family_samples = sorted(
+            (sample_key for sample_key in samples if sample_key[0].startswith(family_name)), key=sort_key)
+        if len(family_samples) == 0:
+            continue
+        lines.append(f"# HELP {family_name} {family_help}")
+        lines.append(f"# TYPE {family_name} {family_type}")
+        for sample_key in family_samples:
+            (name, labels) = sample_key
+            labels_text = ",".join(f'{label_name}="{_escape(label_value)}"' for (label_name, label_value) in labels)
+            value = float(samples[sample_key])
+            value_text = str(int(value)) if value.is_integer() else repr(value)
+            lines.append(f"{name}{{{labels_text}}} {value_text}")
+    return "".join(f"{line}\n" for line in lines)
+
+
+def _escape(label_value: str) -> str:
+    """Escape a label value for the text exposition format."""
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _unescape(label_value: str) -> str:
+    """Unescape a label value of the text exposition format."""
+    return re.sub(r"\\(.)", lambda escape: "\n" if escape.group(1) == "n" else escape.group(1), label_value)
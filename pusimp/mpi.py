@@ -0,0 +1,144 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Aggregate the diagnostics of a guard across the ranks of an MPI job.
+
+When the environment differs across nodes (e.g., because a single node has a stale installation in its user site),
+every failing rank would report the full error message. Checking collectively instead gathers a compact report
+from every rank, namely its hostname and a digest of its error message, so that only one rank per distinct problem
+sends the full text. The root rank then reports a single summary, which lists each distinct problem once together
+with the ranks and hosts on which it was found, and every rank aborts consistently according to the failure policy
+of the root rank. mpi4py is only required when no communicator is provided.
+"""
+
+import hashlib
+import socket
+import typing
+
+from pusimp.prevent_user_site_imports import _report_problems, Guard
+
+T = typing.TypeVar("T")
+
+
+class Communicator(typing.Protocol):
+    """The subset of the interface of a mpi4py communicator which is employed to aggregate diagnostics."""
+
+    def Get_rank(self) -> int:  # noqa: N802
+        """Return the rank of the current process."""
+
+    def Get_size(self) -> int:  # noqa: N802
+        """Return the number of processes."""
+
+    def gather(self, sendobj: T, root: int = 0) -> typing.Optional[typing.List[T]]:
+        """Gather an object from every process on the root process."""
+
+    def bcast(self, obj: T, root: int = 0) -> T:
+        """Broadcast an object from the root process to every process."""
+
+
+def check_across_ranks(guard: Guard, comm: typing.Optional[Communicator] = None, root: int = 0) -> None:
+    """
+    Check the dependencies of a guard collectively on every rank of a communicator.
+
+    This is a collective call, which must be made by every rank of the communicator.
+
+    Parameters
+    ----------
+    guard
+        The guard to be checked. Every rank is expected to provide a guard with the same arguments.
+    comm
+        The communicator. If not provided, the world communicator of mpi4py is used.
+    root
+        The rank which reports the summary of the diagnostics.
+
+    Raises
+    ------
+    ImportError
+        On every rank, if a problem is found on at least a rank and the failure policy of the root rank is not
+        warn_once. Only the root rank raises the summary of the diagnostics, while the other ranks raise a short
+        message pointing to it. With the warn_once failure policy, only the root rank emits a warning.
+    """
+    if comm is None:
+        from mpi4py import MPI
+
+        comm = typing.cast(Communicator, MPI.COMM_WORLD)
+    rank = comm.Get_rank()
+
+    (import_error, failure_policy) = guard._diagnose()
+    rank_report = (
+        socket.gethostname(), hashlib.sha256(import_error.encode()).hexdigest() if import_error is not None else None)
+    rank_reports = comm.gather(rank_report, root)
+    representative_ranks: typing.Optional[typing.Set[int]] = None
+    if rank == root:
+        assert rank_reports is not None
+        representative_ranks = {ranks[0] for ranks in _group_ranks(rank_reports).values()}
+    representative_ranks = comm.bcast(representative_ranks, root)
+    assert representative_ranks is not None
+    representative_errors = comm.gather(import_error if rank in representative_ranks else None, root)
+
+    summary: typing.Optional[typing.Tuple[typing.Optional[str], str]] = None
+    if rank == root:
+        assert rank_reports is not None
+        assert representative_errors is not None
+        summary = (
+            _summarize(guard.package_name, rank_reports, representative_errors, comm.Get_size()), failure_policy)
+    summary = comm.bcast(summary, root)
+    assert summary is not None
+    (summary_import_error, failure_policy) = summary
+
+    if summary_import_error is not None:
+        if rank == root:
+            _report_problems(guard.package_name, failure_policy, summary_import_error, 3)
+        elif failure_policy != "warn_once":
+            raise ImportError(
+                f"{guard.package_name} found problems with its dependencies. "
+                f"See the error reported by rank {root} for more details.")
+    if guard.monitor_imports:
+        guard._start_import_monitor(failure_policy)
+
+
+def _group_ranks(
+    rank_reports: typing.List[typing.Tuple[str, typing.Optional[str]]]
+) -> typing.Dict[str, typing.List[int]]:
+    """Group failing ranks by the digest of their error message, in order of first occurrence."""
+    grouped_ranks: typing.Dict[str, typing.List[int]] = {}
+    for (rank, (_, digest)) in enumerate(rank_reports):
+        if digest is not None:
+            grouped_ranks.setdefault(digest, []).append(rank)
+    return grouped_ranks
+
+
+def _summarize(
+    package_name: str, rank_reports: typing.List[typing.Tuple[str, typing.Optional[str]]],
+    representative_errors: typing.List[typing.Optional[str]], size: int
+) -> typing.Optional[str]:
+    """Prepare the summary of the diagnostics of every rank, or return None if no rank found a problem."""
+    grouped_ranks = _group_ranks(rank_reports)
+    if len(grouped_ranks) == 0:
+        return None
+    failing_ranks_count = sum(len(ranks) for ranks in grouped_ranks.values())
+    summary = (
+        f"{package_name} found problems with its dependencies on {failing_ranks_count} out of {size} ranks, "
+        f"with {len(grouped_ranks)} distinct error message{'s' if len(grouped_ranks) > 1 else ''}.\n"
+    )
+    for (problem_id, ranks) in enumerate(grouped_ranks.values()):
+        hostnames = sorted({rank_reports[rank][0] for rank in ranks})
+        summary += (
+            f"\nProblem {problem_id + 1} was found on {len(ranks)} rank{'s' if len(ranks) > 1 else ''} "
+            f"({_format_ranks(ranks)}) on host{'s' if len(hostnames) > 1 else ''} {', '.join(hostnames)}:\n"
+            f"{representative_errors[ranks[0]]}\n"
+        )
+    return summary
+
+
+def _format_ranks(ranks: typing.List[int]) -> str:
+    """Format a sorted list of ranks, compressing consecutive ranks into ranges (e.g., 0-3, 7)."""
+    ranges: typing.List[typing.List[int]] = []
+    for rank in ranks:
+        if len(ranges) > 0 and ranges[-1][1] == rank - 1:
+            ranges[-1][1] = rank
+        else:
+            ranges.append([rank, rank])
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for (first, last) in ranges)
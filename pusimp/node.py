@@ -0,0 +1,150 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Share the verdict of a guard among the processes which are started at once on the same node.
+
+Process swarms (e.g., Dask workers, job arrays or parallel fan-outs) start many python processes on the same node
+at once, each of them checking the same dependencies. Checking on the node instead lets the first process probe the
+dependencies while holding a lock file in a node-local runtime directory, and publish the error message (or the lack
+thereof) in a result file. Concurrent peers block on the lock and then reuse the published result.
+
+Lock files are locked with flock, so that a lock held by a process which died is released by the kernel. A peer
+which does not obtain the lock within a timeout (e.g., because the holder hangs) probes the dependencies by itself.
+The names of lock and result files contain a digest of the check configuration and of the environment fingerprint
+on which the verdict depends, and results are only trusted if they are owned by the current user and store the same
+digest, so that a result is never reused after the environment changed. Checks with the integrity tier are never
+shared, since files may be modified in place without changing the environment fingerprint.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import typing
+
+from pusimp.prevent_user_site_imports import _environment_fingerprint, _report_problems, Guard
+
+
+def check_on_node(
+    guard: Guard, runtime_directory: typing.Optional[str] = None, timeout: float = 30.0, poll_interval: float = 0.01
+) -> None:
+    """
+    Check the dependencies of a guard, sharing the verdict with the other processes of the same node.
+
+    Parameters
+    ----------
+    guard
+        The guard to be checked.
+    runtime_directory
+        The node-local directory in which lock and result files are stored. If not provided, the first existing
+        directory among $XDG_RUNTIME_DIR, /dev/shm and the temporary directory is used.
+    timeout
+        The number of seconds after which a process which is waiting for the lock probes the dependencies by itself.
+    poll_interval
+        The number of seconds between two attempts to obtain the lock.
+
+    Raises
+    ------
+    ImportError
+        See prevent_user_site_imports.
+    """
+    (import_error, failure_policy) = _diagnose_on_node(guard, runtime_directory, timeout, poll_interval)
+    if import_error is not None:
+        _report_problems(guard.package_name, failure_policy, import_error, 3)
+    if guard.monitor_imports:
+        guard._start_import_monitor(failure_policy)
+
+
+def node_runtime_directory() -> str:
+    """Return the first existing directory among $XDG_RUNTIME_DIR, /dev/shm and the temporary directory."""
+    for runtime_directory in (os.getenv("XDG_RUNTIME_DIR"), "/dev/shm"):
+        if runtime_directory and os.path.isdir(runtime_directory):
+            return runtime_directory
+    return tempfile.gettempdir()
+
+
+def _diagnose_on_node(
+    guard: Guard, runtime_directory: typing.Optional[str], timeout: float, poll_interval: float
+) -> typing.Tuple[typing.Optional[str], str]:
+    """Probe the dependencies of a guard, or reuse the result published by another process of the same node."""
+    if os.getenv(guard._allow_user_site_imports_env_name) is not None:
+        return None, guard.failure_policy
+    (check_tier, escalation_tier, failure_policy) = guard._check_arguments()
+    if "integrity" in (check_tier, escalation_tier):
+        return guard._diagnose()
+
+    key = hashlib.sha256(json.dumps([
+        guard._configuration_key, check_tier, escalation_tier, failure_policy, sys.executable,
+        _environment_fingerprint(guard.dependencies_expected_prefix, guard.dependencies_import_name)
+    ]).encode()).hexdigest()[:32]
+    file_prefix = os.path.join(
+        runtime_directory or node_runtime_directory(), f"pusimp-{guard.package_name}-{os.getuid()}-{key}")
+    result_path = f"{file_prefix}.json"
+
+    result = _read_result(result_path, key)
+    if result is not None:
+        return result[0], failure_policy
+    lock_fd = os.open(f"{file_prefix}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        _lock(lock_fd, timeout, poll_interval)
+        # A peer may have published its result while this process was waiting for the lock.
+        result = _read_result(result_path, key)
+        if result is not None:
+            return result[0], failure_policy
+        (import_error, failure_policy) = guard._diagnose()
+        _write_result(result_path, key, import_error)
+        return import_error, failure_policy
+    finally:
+        os.close(lock_fd)
+
+
+def _lock(lock_fd: int, timeout: float, poll_interval: float) -> None:
+    """Lock a file, giving up without the lock after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except OSError as lock_error:
+            if lock_error.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+        if time.monotonic() >= deadline:
+            return
+        time.sleep(poll_interval)
+
+
+def _read_result(result_path: str, key: str) -> typing.Optional[typing.Tuple[typing.Optional[str]]]:
+    """
+    Read the result published by another process.
+
+    Returns None if there is no valid result, otherwise a tuple containing the published error message,
+    which is None if no problem was found.
+    """
+    try:
+        with open(result_path) as result_file:
+            if os.fstat(result_file.fileno()).st_uid != os.getuid():
+                return None
+            result = json.load(result_file)
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(result, dict) or result.get("key") != key
+        or not isinstance(result.get("import_error"), (str, type(None)))
+    ):
+        return None
+    return (result["import_error"], )
+
+
+def _write_result(result_path: str, key: str, import_error: typing.Optional[str]) -> None:
+    """Publish a result atomically, so that peers never read a partially written file."""
+    result_fd, result_temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(result_path), prefix=os.path.basename(result_path), suffix=".tmp")
+    with os.fdopen(result_fd, "w") as result_file:
+        json.dump({"key": key, "import_error": import_error}, result_file)
+    os.replace(result_temporary_path, result_path)
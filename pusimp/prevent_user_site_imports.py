@@ -5,10 +5,43 @@
 # SPDX-License-Identifier: MIT
 """Prevent user-site imports on a specific set of dependencies."""
 
+import copy
 import importlib
+import importlib.machinery
+import importlib.util
+import json
 import os
+import site
+import stat
 import sys
+import threading
 import typing
+import warnings
+
+# Available check tiers, sorted from the cheapest to the most thorough one.
+CHECK_TIERS = ("static", "spec", "import", "integrity")
+
+# Available failure policies.
+FAILURE_POLICIES = ("raise", "warn_once", "fail_fast")
+
+# Suffixes of the files of modules, in the order in which the path based finder looks for them.
+_MODULE_SUFFIXES = (
+    *importlib.machinery.EXTENSION_SUFFIXES, *importlib.machinery.SOURCE_SUFFIXES,
+    *importlib.machinery.BYTECODE_SUFFIXES)
+
+# Messages which have already been reported with the warn_once failure policy.
+_warned_messages: typing.Set[typing.Tuple[str, str]] = set()
+
+# Guard evaluations in progress, and verdicts of completed evaluations together with the environment fingerprint
+# at the time they were completed, both keyed by package and configuration. A single lock protects their lookup.
+_flights: typing.Dict[str, "_Flight"] = {}
+_verdicts: typing.Dict[str, typing.Tuple[int, typing.Optional[str]]] = {}
+_flights_lock = threading.Lock()
+
+# Names of the members of the zip archives which contain expected locations, keyed by archive path, together with
+# the state of the archive when its central directory was read. Files which are not zip archives map to None.
+_archive_members: typing.Dict[
+    str, typing.Tuple[typing.Tuple[int, int, int], typing.Optional[typing.FrozenSet[str]]]] = {}
 
 
 def prevent_user_site_imports(
@@ -20,11 +53,26 @@ def prevent_user_site_imports(
     dependencies_pypi_name: typing.List[str],
     dependencies_optional: typing.List[bool],
     dependencies_extra_error_message: typing.List[str],
-    pip_uninstall_call: typing.Callable[[str, str, str], str]
+    pip_uninstall_call: typing.Callable[[str, str, str], str],
+    *,
+    check_tier: str = "import",
+    escalation_tier: typing.Optional[str] = None,
+    failure_policy: str = "raise",
+    dependencies_integrity_manifest: typing.Optional[typing.List[typing.Optional[str]]] = None,
+    integrity_cache_path: typing.Optional[str] = None,
+    inherit_verdict: bool = False,
+    guard_transitive_dependencies: bool = False,
+    dependencies_version_constraint: typing.Optional[typing.List[typing.Optional[str]]] = None,
+    check_wheel_tags: bool = False,
+    monitor_imports: bool = False,
+    prove_sys_path_safety: bool = False
 ) -> None:
     """
     Prevent user-site imports on a specific set of dependencies.
 
+    This function validates its arguments on every call: packages which check their dependencies several times
+    should rather create a Guard once, and call its check method.
+
     Parameters
     ----------
     package_name
@@ -39,7 +87,10 @@ def prevent_user_site_imports(
     dependencies_expected_prefix
         The expected prefix of import locations managed by the system manager.
         This information is employed while determining the import location of each dependency
-        and to prepare the text of error messages.
+        and to prepare the text of error messages. Each dependency is expected in the prefix either as a package,
+        possibly without sources, or as a single-file module, possibly a compiled extension module. The prefix
+        may point into a zip archive (e.g., /opt/tool.pyz/lib), in which case dependencies are expected to be
+        imported by zipimport.
     dependencies_import_name
         The import name of the dependencies of the package.
         This information is employed while determining the import location of each dependency
@@ -58,132 +109,987 @@ def prevent_user_site_imports(
         A function that, given the python exectuable, the pypi name of a dependency of the package,
         and the path it has actually been imported from, returns the string to be reported to
         the user on how to uninstall it with pip.
+    check_tier
+        The depth of the check carried out on each dependency, among the ones listed in CHECK_TIERS:
+        * "static" only looks for the dependency in the entries of sys.path, in order, without going through
+          the import system. Broken dependencies are not detected.
+        * "spec" determines where the dependency would be imported from by the import system,
+          without actually importing it. Broken dependencies are only detected if their spec cannot be found.
+        * "import" imports the dependency, which is the default.
+        * "integrity" imports the dependency and, if it is correctly imported from dependencies_expected_prefix,
+          verifies that its files match the hashes recorded when the system manager installed them.
+          Dependencies for which neither a RECORD file nor a manifest is available are not verified.
+        The value can be overridden by the {PACKAGE_NAME}_USER_SITE_IMPORTS_CHECK_TIER environment variable.
+    escalation_tier
+        If provided, each dependency which is flagged as problematic by check_tier is checked again with
+        this tier, which must be more thorough than check_tier, and only the result of the second check
+        is reported. The value can be overridden by the {PACKAGE_NAME}_USER_SITE_IMPORTS_ESCALATION_TIER
+        environment variable, where an empty value disables escalation.
+    failure_policy
+        The action taken when problems are detected, among the ones listed in FAILURE_POLICIES:
+        * "raise" checks every dependency, and then raises an ImportError, which is the default.
+        * "warn_once" checks every dependency, and then emits a warning rather than raising an ImportError.
+          The same warning is emitted only once.
+        * "fail_fast" stops checking at the first problem involving a mandatory dependency, or a user-site
+          import, and then raises an ImportError.
+        The value can be overridden by the {PACKAGE_NAME}_USER_SITE_IMPORTS_FAILURE_POLICY environment variable.
+    dependencies_integrity_manifest
+        An optional manifest, corresponding to each dependency, to be used for the integrity verification
+        when the distribution does not ship a RECORD file. See pusimp.integrity.verify_dependencies_integrity.
+    integrity_cache_path
+        An optional file in which the digests computed by the integrity verification are cached across runs.
+    inherit_verdict
+        If True, a successful check publishes a verdict token in the {PACKAGE_NAME}_USER_SITE_IMPORTS_VERDICT
+        environment variable, and the check is skipped when a valid token is inherited from the parent process,
+        e.g. by multiprocessing workers. The token is invalidated by any change of the check arguments,
+        of the interpreter, of sys.path or of the state of the user site. See pusimp.verdict.
+    guard_transitive_dependencies
+        If True, the Requires-Dist metadata of the dependencies is walked, and every transitive dependency
+        installed in dependencies_expected_prefix is checked as well, as if it were an optional dependency.
+        The requirement graph is cached across calls until the content of dependencies_expected_prefix changes.
+        See pusimp.requirement_graph.
+    dependencies_version_constraint
+        An optional version specifier, corresponding to each dependency, e.g. ">=0.8,<0.9" or "==2019.1.*".
+        The version of the distribution which would be imported is read from its metadata, without importing it,
+        and dependencies which do not satisfy their constraint are reported. Transitive dependencies are not
+        constrained. See pusimp.consistency.check_dependencies_consistency.
+    check_wheel_tags
+        If True, dependencies whose distribution ships a WHEEL file are reported when none of its tags
+        is compatible with the python version and ABI of the running interpreter.
+    monitor_imports
+        If True, once the check is done every later import of the dependencies, and of their submodules, is
+        monitored, and modules imported from outside of dependencies_expected_prefix (e.g., because sys.path was
+        modified after the check) are reported according to failure_policy. A previous monitor of the same
+        package is replaced. See pusimp.import_monitor.
+    prove_sys_path_safety
+        If True, PYTHONPATH, sys.meta_path and the entries of sys.path which come before
+        dependencies_expected_prefix are inspected first, and the dependencies are not probed at all when
+        the inspection proves that each of them is imported from its expected path and cannot be shadowed
+        by the user site. Broken dependencies are not detected when the proof succeeds. The proof is not
+        attempted with the integrity check tier, nor when version constraints, wheel tags or transitive
+        dependencies are checked. See pusimp.sys_path_safety.
 
     Raises
     ------
     ImportError
         If at least a dependency is imported from user-site, or if at least a mandatory dependency
-        is broken or missing.
-    """
-    assert len(dependencies_import_name) == len(dependencies_pypi_name), "Incorrect input lengths"
-    assert len(dependencies_import_name) == len(dependencies_optional), "Incorrect input lengths"
-    assert len(dependencies_import_name) == len(dependencies_extra_error_message), "Incorrect input lengths"
-
-    allow_user_site_imports_env_name = f"{package_name}_allow_user_site_imports".upper()
-    allow_user_site_imports_env_value = os.getenv(allow_user_site_imports_env_name) is not None
-
-    if not allow_user_site_imports_env_value:
-        missing_dependencies: typing.List[typing.Optional[str]] = [None] * len(dependencies_import_name)
-        broken_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]] = [
-            None] * len(dependencies_import_name)
-        user_site_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]] = [
-            None] * len(dependencies_import_name)
-        for (dependency_id, dependency_import_name) in enumerate(dependencies_import_name):
-            dependency_module_expected_path = f"{dependencies_expected_prefix}/{dependency_import_name}/__init__.py"
-            if not os.path.exists(dependency_module_expected_path) and not dependencies_optional[dependency_id]:
-                missing_dependencies[dependency_id] = dependency_module_expected_path
-            else:
-                try:
-                    dependency_module = importlib.import_module(dependency_import_name)
-                except BaseException as dependency_module_import_error:
-                    if not dependencies_optional[dependency_id]:
-                        broken_dependencies[dependency_id] = {
-                            "expected": dependency_module_expected_path,
-                            "error": str(dependency_module_import_error)
-                        }
-                else:
-                    if dependency_module.__file__ != dependency_module_expected_path:
-                        assert dependency_module.__file__ is not None, f"Unable to find location of {dependency_module}"
-                        user_site_dependencies[dependency_id] = {
-                            "expected": dependency_module_expected_path,
-                            "actual": dependency_module.__file__
-                        }
-
-        counter_error_categories = 1
-
-        missing_dependencies_error = ""
-        missing_dependencies_fix = ""
-        if any([isinstance(dependency_expected_path, str) for dependency_expected_path in missing_dependencies]):
-            missing_dependencies_error += f"{counter_error_categories}) Missing dependencies:\n"
-            for (dependency_id, dependency_expected_path) in enumerate(missing_dependencies):
-                if isinstance(dependency_expected_path, str):
-                    missing_dependencies_error += (
-                        f"* {dependencies_import_name[dependency_id]} is missing. "
-                        f"Its expected path was {dependency_expected_path}.\n"
-                    )
-            missing_dependencies_fix += f"{counter_error_categories}) To install missing dependencies:\n"
-            for (dependency_id, dependency_expected_path) in enumerate(missing_dependencies):
-                if isinstance(dependency_expected_path, str):
-                    missing_dependencies_fix += (
-                        f"* check how to install {dependencies_import_name[dependency_id]} "
-                        f"with {system_manager}.\n"
-                    )
-            counter_error_categories += 1
-
-        broken_dependencies_error = ""
-        broken_dependencies_fix = ""
-        if any([isinstance(dependency_info, dict) for dependency_info in broken_dependencies]):
-            broken_dependencies_error += f"{counter_error_categories}) Broken dependencies:\n"
-            for (dependency_id, dependency_info) in enumerate(broken_dependencies):
-                if isinstance(dependency_info, dict):
-                    broken_dependencies_error += (
-                        f"* {dependencies_import_name[dependency_id]} is broken. "
-                        f"Error on import was '{dependency_info['error']}'.\n"
-                    )
-            broken_dependencies_fix += f"{counter_error_categories}) To fix broken dependencies:\n"
-            for (dependency_id, dependency_info) in enumerate(broken_dependencies):
-                if isinstance(dependency_info, dict):
-                    broken_dependencies_fix += (
-                        f"* run '{sys.executable} -m pip show {dependencies_pypi_name[dependency_id]}' in a terminal: "
-                        f"if the location field is not {os.path.dirname(os.path.dirname(dependency_info['expected']))} "
-                        f"consider running "
-                        f"'{pip_uninstall_call(sys.executable, dependencies_pypi_name[dependency_id], 'unknown')}' "
-                        "in a terminal, because the broken dependency is probably being imported from a local path "
-                        f"rather than from the path provided by {system_manager}. "
-                        f"{dependencies_extra_error_message[dependency_id]}\n"
-                    )
-            counter_error_categories += 1
-
-        user_site_dependencies_error = ""
-        user_site_dependencies_fix = ""
-        if any([isinstance(dependency_info, dict) for dependency_info in user_site_dependencies]):
-            user_site_dependencies_error += (
-                f"{counter_error_categories}) Dependencies imported from a local path rather than from "
-                f"the path provided by {system_manager}:\n"
-            )
-            for (dependency_id, dependency_info) in enumerate(user_site_dependencies):
-                if isinstance(dependency_info, dict):
-                    user_site_dependencies_error += (
-                        f"* {dependencies_import_name[dependency_id]} was imported from a local path: "
-                        f"expected in {dependency_info['expected']}, but imported from {dependency_info['actual']}.\n"
-                    )
-            user_site_dependencies_fix += f"{counter_error_categories}) To uninstall local dependencies:\n"
-            for (dependency_id, dependency_info) in enumerate(user_site_dependencies):
-                if isinstance(dependency_info, dict):
-                    user_site_dependencies_fix += (
-                        "* run "
-                        f"""'{pip_uninstall_call(
-                            sys.executable, dependencies_pypi_name[dependency_id], dependency_info['actual'])}' """
-                        "in a terminal, and verify that you are prompted to confirm removal of files in "
-                        f"{os.path.dirname(dependency_info['actual'])}. "
-                        f"{dependencies_extra_error_message[dependency_id]}\n"
-                    )
-            counter_error_categories += 1
-
-        if counter_error_categories > 1:
-            import_error = (
-                f"pusimp has detected the following problems with {package_name} dependencies:\n"
-                f"{missing_dependencies_error}"
-                f"{broken_dependencies_error}"
-                f"{user_site_dependencies_error}"
-                "\n"
-                "pusimp suggests to apply all of the following fixes:\n"
-                f"{missing_dependencies_fix}"
-                f"{broken_dependencies_fix}"
-                f"{user_site_dependencies_fix}"
-                "\n"
-                f"You can disable this check by exporting the {allow_user_site_imports_env_name} environment "
-                f"variable. Note, however, that this may break the installation provided by {system_manager}.\n"
-                f"If you believe that this message appears incorrectly, report this at {contact_url} ."
+        is broken or missing, or if the integrity verification is requested and fails for at least a dependency,
+        or if at least a dependency does not satisfy its version constraint or wheel tags check.
+        No error is raised with the warn_once failure policy.
+    """
+    Guard(
+        package_name, system_manager, contact_url, dependencies_expected_prefix, dependencies_import_name,
+        dependencies_pypi_name, dependencies_optional, dependencies_extra_error_message, pip_uninstall_call,
+        check_tier=check_tier, escalation_tier=escalation_tier, failure_policy=failure_policy,
+        dependencies_integrity_manifest=dependencies_integrity_manifest, integrity_cache_path=integrity_cache_path,
+        inherit_verdict=inherit_verdict, guard_transitive_dependencies=guard_transitive_dependencies,
+        dependencies_version_constraint=dependencies_version_constraint, check_wheel_tags=check_wheel_tags,
+        monitor_imports=monitor_imports, prove_sys_path_safety=prove_sys_path_safety
+    )._check(4)
+
+
+class Guard:
+    """
+    Guard of a package against user-site imports on a specific set of dependencies.
+
+    The arguments are the same of prevent_user_site_imports, and are validated only once, when the guard is
+    created. Everything which does not depend on the environment (e.g., the expected path of each dependency
+    and the names of environment variables) is precomputed as well, so that check() can be called several times
+    cheaply. Guards are immutable, and can be pickled to be checked again in worker processes, provided that
+    pip_uninstall_call can be pickled as well (e.g., because it is a module-level function rather than a lambda).
+    """
+
+    __slots__ = (
+        "_allow_user_site_imports_env_name", "_check_tier_env_name", "_configuration_key",
+        "_escalation_tier_env_name", "_failure_policy_env_name", "check_tier", "check_wheel_tags", "contact_url",
+        "dependencies_expected_path", "dependencies_expected_prefix", "dependencies_extra_error_message",
+        "dependencies_import_name", "dependencies_integrity_manifest", "dependencies_optional",
+        "dependencies_pypi_name", "dependencies_version_constraint", "escalation_tier", "failure_policy",
+        "guard_transitive_dependencies", "inherit_verdict", "integrity_cache_path", "monitor_imports",
+        "package_name", "pip_uninstall_call", "prove_sys_path_safety", "system_manager"
+    )
+
+    _allow_user_site_imports_env_name: str
+    _check_tier_env_name: str
+    _configuration_key: str
+    _escalation_tier_env_name: str
+    _failure_policy_env_name: str
+    check_tier: str
+    check_wheel_tags: bool
+    contact_url: str
+    dependencies_expected_path: typing.Tuple[str, ...]
+    dependencies_expected_prefix: str
+    dependencies_extra_error_message: typing.Tuple[str, ...]
+    dependencies_import_name: typing.Tuple[str, ...]
+    dependencies_integrity_manifest: typing.Optional[typing.Tuple[typing.Optional[str], ...]]
+    dependencies_optional: typing.Tuple[bool, ...]
+    dependencies_pypi_name: typing.Tuple[str, ...]
+    dependencies_version_constraint: typing.Optional[typing.Tuple[typing.Optional[str], ...]]
+    escalation_tier: typing.Optional[str]
+    failure_policy: str
+    guard_transitive_dependencies: bool
+    inherit_verdict: bool
+    integrity_cache_path: typing.Optional[str]
+    monitor_imports: bool
+    package_name: str
+    pip_uninstall_call: typing.Callable[[str, str, str], str]
+    prove_sys_path_safety: bool
+    system_manager: str
+
+    def __init__(
+        self,
+        package_name: str,
+        system_manager: str,
+        contact_url: str,
+        dependencies_expected_prefix: str,
+        dependencies_import_name: typing.Sequence[str],
+        dependencies_pypi_name: typing.Sequence[str],
+        dependencies_optional: typing.Sequence[bool],
+        dependencies_extra_error_message: typing.Sequence[str],
+        pip_uninstall_call: typing.Callable[[str, str, str], str],
+        *,
+        check_tier: str = "import",
+        escalation_tier: typing.Optional[str] = None,
+        failure_policy: str = "raise",
+        dependencies_integrity_manifest: typing.Optional[typing.Sequence[typing.Optional[str]]] = None,
+        integrity_cache_path: typing.Optional[str] = None,
+        inherit_verdict: bool = False,
+        guard_transitive_dependencies: bool = False,
+        dependencies_version_constraint: typing.Optional[typing.Sequence[typing.Optional[str]]] = None,
+        check_wheel_tags: bool = False,
+        monitor_imports: bool = False,
+        prove_sys_path_safety: bool = False
+    ) -> None:
+        assert len(dependencies_import_name) == len(dependencies_pypi_name), "Incorrect input lengths"
+        assert len(dependencies_import_name) == len(dependencies_optional), "Incorrect input lengths"
+        assert len(dependencies_import_name) == len(dependencies_extra_error_message), "Incorrect input lengths"
+        assert dependencies_integrity_manifest is None or len(dependencies_import_name) == len(
+            dependencies_integrity_manifest), "Incorrect input lengths"
+        assert dependencies_version_constraint is None or len(dependencies_import_name) == len(
+            dependencies_version_constraint), "Incorrect input lengths"
+        # The combination of tiers is validated on every check, since environment variables may override either of them.
+        assert check_tier in CHECK_TIERS, f"Invalid check tier {check_tier}"
+        assert escalation_tier is None or escalation_tier in CHECK_TIERS, f"Invalid escalation tier {escalation_tier}"
+        assert failure_policy in FAILURE_POLICIES, f"Invalid failure policy {failure_policy}"
+
+        set_attribute = object.__setattr__
+        set_attribute(self, "package_name", package_name)
+        set_attribute(self, "system_manager", system_manager)
+        set_attribute(self, "contact_url", contact_url)
+        set_attribute(self, "dependencies_expected_prefix", dependencies_expected_prefix)
+        set_attribute(self, "dependencies_import_name", tuple(dependencies_import_name))
+        set_attribute(self, "dependencies_pypi_name", tuple(dependencies_pypi_name))
+        set_attribute(self, "dependencies_optional", tuple(bool(optional) for optional in dependencies_optional))
+        set_attribute(self, "dependencies_extra_error_message", tuple(dependencies_extra_error_message))
+        set_attribute(self, "pip_uninstall_call", pip_uninstall_call)
+        set_attribute(self, "check_tier", check_tier)
+        set_attribute(self, "escalation_tier", escalation_tier)
+        set_attribute(self, "failure_policy", failure_policy)
+        set_attribute(
+            self, "dependencies_integrity_manifest",
+            tuple(dependencies_integrity_manifest) if dependencies_integrity_manifest is not None else None)
+        set_attribute(self, "integrity_cache_path", integrity_cache_path)
+        set_attribute(self, "inherit_verdict", inherit_verdict)
+        set_attribute(self, "guard_transitive_dependencies", guard_transitive_dependencies)
+        set_attribute(
+            self, "dependencies_version_constraint",
+            tuple(dependencies_version_constraint) if dependencies_version_constraint is not None else None)
+        set_attribute(self, "check_wheel_tags", check_wheel_tags)
+        set_attribute(self, "monitor_imports", monitor_imports)
+        set_attribute(self, "prove_sys_path_safety", prove_sys_path_safety)
+        set_attribute(self, "dependencies_expected_path", tuple(
+            f"{dependencies_expected_prefix}/{dependency_import_name}/__init__.py"
+            for dependency_import_name in dependencies_import_name))
+        set_attribute(
+            self, "_allow_user_site_imports_env_name", f"{package_name}_allow_user_site_imports".upper())
+        set_attribute(self, "_check_tier_env_name", f"{package_name}_user_site_imports_check_tier".upper())
+        set_attribute(self, "_escalation_tier_env_name", f"{package_name}_user_site_imports_escalation_tier".upper())
+        set_attribute(self, "_failure_policy_env_name", f"{package_name}_user_site_imports_failure_policy".upper())
+        set_attribute(self, "_configuration_key", json.dumps([
+            package_name, system_manager, contact_url, dependencies_expected_prefix, self.dependencies_import_name,
+            self.dependencies_pypi_name, self.dependencies_optional, self.dependencies_extra_error_message,
+            self.dependencies_integrity_manifest, integrity_cache_path, guard_transitive_dependencies,
+            self.dependencies_version_constraint, check_wheel_tags
+        ]))
+
+    def __setattr__(self, name: str, value: typing.Any) -> None:  # noqa: ANN401
+        """Prevent changes to the guard."""
+        raise AttributeError(f"Cannot set {name}: guards are immutable")
+
+    def __delattr__(self, name: str) -> None:
+        """Prevent changes to the guard."""
+        raise AttributeError(f"Cannot delete {name}: guards are immutable")
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        """Return the state of the guard, for pickling."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        """Restore the state of the guard, when unpickling."""
+        for (name, value) in state.items():
+            object.__setattr__(self, name, value)
+
+    def check(self) -> None:
+        """
+        Check the dependencies.
+
+        The check tier, the escalation tier and the failure policy can still be overridden by environment variables,
+        which are read on every call. See prevent_user_site_imports for the errors which are raised.
+        """
+        self._check(4)
+
+    def _check(self, stacklevel: int) -> None:
+        """Check the dependencies, emitting warnings stacklevel frames above the one of _report_problems."""
+        if os.getenv(self._allow_user_site_imports_env_name) is not None:
+            return
+        (import_error, failure_policy) = self._diagnose()
+        if import_error is not None:
+            _report_problems(self.package_name, failure_policy, import_error, stacklevel)
+        if self.monitor_imports:
+            self._start_import_monitor(failure_policy)
+
+    def _diagnose(self) -> typing.Tuple[typing.Optional[str], str]:
+        """
+        Probe the dependencies, without reporting problems.
+
+        Returns the text of the error message, or None if no problem is found, and the failure policy
+        with which problems must be reported.
+        """
+        if os.getenv(self._allow_user_site_imports_env_name) is not None:
+            return None, self.failure_policy
+
+        (check_tier, escalation_tier, failure_policy) = self._check_arguments()
+        if (
+            self.prove_sys_path_safety and check_tier != "integrity" and self.dependencies_version_constraint is None
+            and not self.check_wheel_tags and not self.guard_transitive_dependencies
+        ):
+            # Imported here rather than at the top of the file, for the same reasons as pusimp.integrity below.
+            from pusimp.sys_path_safety import prove_sys_path_safety
+
+            if prove_sys_path_safety(
+                    self.dependencies_expected_prefix, self.dependencies_import_name, self.dependencies_expected_path):
+                return None, failure_policy
+        if self.inherit_verdict:
+            # Imported here rather than at the top of the file, for the same reasons as pusimp.integrity below.
+            from pusimp.verdict import compute_verdict_token, verdict_environment_variable
+
+            verdict_env_name = verdict_environment_variable(self.package_name)
+            verdict_token = compute_verdict_token([
+                self.dependencies_expected_prefix, self.dependencies_import_name, self.dependencies_optional,
+                check_tier, escalation_tier, self.dependencies_integrity_manifest,
+                self.guard_transitive_dependencies, self.dependencies_version_constraint, self.check_wheel_tags
+            ])
+            if os.getenv(verdict_env_name) == verdict_token:
+                return None, failure_policy
+
+        flight_key = json.dumps([check_tier, escalation_tier, failure_policy, self._configuration_key])
+        if "integrity" in (check_tier, escalation_tier):
+            # Files may be modified in place without changing any state in the fingerprint, and their digests
+            # are already cached by pusimp.integrity: do not memoize the verdict.
+            fingerprint = None
+        else:
+            def fingerprint() -> typing.Tuple[typing.Any, ...]:
+                return _environment_fingerprint(self.dependencies_expected_prefix, self.dependencies_import_name)
+        import_error = _single_flight(
+            flight_key, fingerprint, lambda: _find_problems(self, check_tier, escalation_tier, failure_policy))
+        if import_error is None and self.inherit_verdict:
+            os.environ[verdict_env_name] = verdict_token
+        return import_error, failure_policy
+
+    def _check_arguments(self) -> typing.Tuple[str, typing.Optional[str], str]:
+        """Return check tier, escalation tier and failure policy, as possibly overridden by environment variables."""
+        check_tier = os.getenv(self._check_tier_env_name, self.check_tier)
+        escalation_tier = os.getenv(self._escalation_tier_env_name, self.escalation_tier)
+        if escalation_tier == "":
+            escalation_tier = None
+        failure_policy = os.getenv(self._failure_policy_env_name, self.failure_policy)
+        assert check_tier in CHECK_TIERS, f"Invalid check tier {check_tier}"
+        assert escalation_tier is None or escalation_tier in CHECK_TIERS, f"Invalid escalation tier {escalation_tier}"
+        assert escalation_tier is None or CHECK_TIERS.index(escalation_tier) > CHECK_TIERS.index(check_tier), (
+            f"Escalation tier {escalation_tier} is not more thorough than check tier {check_tier}")
+        assert failure_policy in FAILURE_POLICIES, f"Invalid failure policy {failure_policy}"
+        return check_tier, escalation_tier, failure_policy
+
+    def _start_import_monitor(self, failure_policy: str) -> None:
+        """Monitor later imports of the dependencies, reporting violations according to failure_policy."""
+        from pusimp.import_monitor import ImportMonitor, start_import_monitor
+
+        def report_violation(module_name: str, module_location: str) -> None:
+            dependency_id = self.dependencies_import_name.index(module_name.partition(".")[0])
+            import_error = _format_problems(
+                self, [module_name], [self.dependencies_pypi_name[dependency_id]],
+                [self.dependencies_extra_error_message[dependency_id]], [None], [None], [{
+                    "expected": f"{self.dependencies_expected_prefix}/{module_name.replace('.', '/')}",
+                    "actual": module_location
+                }], [None], [None]
             )
-            raise ImportError(import_error)
+            assert import_error is not None
+            _report_problems(self.package_name, failure_policy, import_error, 2)
+
+        start_import_monitor(
+            self.package_name,
+            ImportMonitor(self.dependencies_import_name, self.dependencies_expected_prefix, report_violation))
+
+
+def _report_problems(package_name: str, failure_policy: str, import_error: str, stacklevel: int) -> None:
+    """Raise an ImportError, or warn only once about the same problems, depending on the failure policy."""
+    if failure_policy == "warn_once":
+        with _flights_lock:
+            first_warning = (package_name, import_error) not in _warned_messages
+            _warned_messages.add((package_name, import_error))
+        if first_warning:
+            warnings.warn(import_error, stacklevel=stacklevel)
+    else:
+        raise ImportError(import_error)
+
+
+def clear_verdicts() -> None:
+    """Forget the memoized verdicts, so that the next call of every guard probes its dependencies again."""
+    with _flights_lock:
+        _verdicts.clear()
+
+
+def _single_flight(
+    flight_key: str, fingerprint: typing.Optional[typing.Callable[[], typing.Tuple[typing.Any, ...]]],
+    evaluate: typing.Callable[[], typing.Optional[str]]
+) -> typing.Optional[str]:
+    """
+    Evaluate a guard, unless its verdict is memoized or an evaluation of the same guard is already in progress.
+
+    The first caller evaluates the guard, while concurrent callers with the same flight key wait for its outcome
+    instead of repeating the probes, and later callers get the memoized outcome for as long as the environment
+    fingerprint does not change. Passing None as fingerprint disables memoization. The lock only protects the
+    lookup of verdicts and flights in progress, so that guards with different configurations never wait on each
+    other. A thread which requests again the flight it is running (e.g., because the guarded dependencies import
+    the package itself) evaluates the guard rather than waiting on itself.
+    """
+    # Only the hash of the fingerprint is memoized, since the fingerprint lists the entries of the expected prefix
+    # and of the user site, which would otherwise be retained for as long as the verdict.
+    environment = hash(fingerprint()) if fingerprint is not None else None
+    with _flights_lock:
+        verdict = _verdicts.get(flight_key)
+        if verdict is not None and verdict[0] == environment:
+            return verdict[1]
+        flight = _flights.get(flight_key)
+        leader = flight is None or flight.owner == threading.get_ident()
+        if leader:
+            flight = _Flight()
+            _flights[flight_key] = flight
+        else:
+            assert flight is not None
+            flight.waiters += 1
+    assert flight is not None
+    if not leader:
+        flight.done.wait()
+        if flight.exception is not None:
+            # Raise a copy, since raising the same object in several threads would mix up their tracebacks
+            raise copy.copy(flight.exception) from flight.exception
+        return flight.import_error
+    try:
+        flight.import_error = evaluate()
+        if fingerprint is not None:
+            environment = hash(fingerprint())
+            with _flights_lock:
+                _verdicts[flight_key] = (environment, flight.import_error)
+    except BaseException as exception:
+        flight.exception = exception
+        raise
+    finally:
+        with _flights_lock:
+            if _flights.get(flight_key) is flight:
+                del _flights[flight_key]
+        flight.done.set()
+    return flight.import_error
+
+
+class _Flight:
+    """A guard evaluation in progress, and its outcome once done."""
+
+    __slots__ = ("done", "exception", "import_error", "owner", "waiters")
+
+    def __init__(self) -> None:
+        self.owner = threading.get_ident()
+        self.done = threading.Event()
+        self.waiters = 0
+        self.import_error: typing.Optional[str] = None
+        self.exception: typing.Optional[BaseException] = None
+
+
+def _environment_fingerprint(
+    dependencies_expected_prefix: str, dependencies_import_name: typing.Sequence[str]
+) -> typing.Tuple[typing.Any, ...]:
+    """
+    Return the state of the environment on which the verdict of a guard depends.
+
+    The state consists of sys.path, of the modification time and entries of the expected prefix and of the user
+    site, and of the location of dependencies which were already imported. Entries are listed as well,
+    since modification times of directories may not change on filesystems with coarse timestamps. When the
+    expected prefix points into a zip archive, the state of the archive is used instead.
+    """
+    directories_state = [
+        _path_state(directory) if directory is not None else None
+        for directory in (dependencies_expected_prefix, site.USER_SITE)]
+    if directories_state[0] is None:
+        archive_location = _split_archive_location(dependencies_expected_prefix)
+        if archive_location is not None:
+            directories_state[0] = _path_state(archive_location[0])
+    return (
+        tuple(sys.path), tuple(directories_state),
+        tuple(getattr(sys.modules.get(dependency_import_name), "__file__", None)
+              for dependency_import_name in dependencies_import_name)
+    )
+
+
+def _path_state(path: str) -> typing.Optional[typing.Tuple[int, int, int, typing.Tuple[str, ...]]]:
+    """Return the inode, size, modification time and, for directories, entries of a path, or None if unreadable."""
+    try:
+        path_stat = os.stat(path)
+        return (
+            path_stat.st_ino, path_stat.st_size, path_stat.st_mtime_ns,
+            tuple(sorted(os.listdir(path))) if stat.S_ISDIR(path_stat.st_mode) else ())
+    except OSError:
+        return None
+
+
+def _find_problems(
+    guard: Guard, check_tier: str, escalation_tier: typing.Optional[str], failure_policy: str
+) -> typing.Optional[str]:
+    """
+    Probe the dependencies of a guard, and prepare the text of the error message.
+
+    Returns None if no problem is found.
+    """
+    dependencies_expected_prefix = guard.dependencies_expected_prefix
+    dependencies_import_name: typing.Sequence[str] = guard.dependencies_import_name
+    dependencies_pypi_name: typing.Sequence[str] = guard.dependencies_pypi_name
+    dependencies_optional: typing.Sequence[bool] = guard.dependencies_optional
+    dependencies_extra_error_message: typing.Sequence[str] = guard.dependencies_extra_error_message
+    dependencies_expected_path: typing.Sequence[str] = guard.dependencies_expected_path
+    dependencies_integrity_manifest: typing.Optional[typing.Sequence[typing.Optional[str]]] = (
+        guard.dependencies_integrity_manifest)
+    dependencies_version_constraint: typing.Optional[typing.Sequence[typing.Optional[str]]] = (
+        guard.dependencies_version_constraint)
+    if guard.guard_transitive_dependencies:
+        from pusimp.requirement_graph import transitive_dependencies
+
+        (
+            dependencies_import_name, dependencies_pypi_name, dependencies_optional,
+            dependencies_extra_error_message, dependencies_expected_path
+        ) = (
+            list(dependencies_import_name), list(dependencies_pypi_name), list(dependencies_optional),
+            list(dependencies_extra_error_message), list(dependencies_expected_path)
+        )
+        if dependencies_integrity_manifest is not None:
+            dependencies_integrity_manifest = list(dependencies_integrity_manifest)
+        if dependencies_version_constraint is not None:
+            dependencies_version_constraint = list(dependencies_version_constraint)
+        for (dependency_import_name, dependency_pypi_name, dependency_required_by) in transitive_dependencies(
+                dependencies_expected_prefix, list(dependencies_pypi_name)):
+            if dependency_import_name not in dependencies_import_name:
+                dependencies_import_name.append(dependency_import_name)
+                dependencies_pypi_name.append(dependency_pypi_name)
+                dependencies_optional.append(True)
+                dependencies_extra_error_message.append(
+                    f"Note that {dependency_pypi_name} is required by {dependency_required_by}.")
+                dependencies_expected_path.append(
+                    f"{dependencies_expected_prefix}/{dependency_import_name}/__init__.py")
+                if dependencies_integrity_manifest is not None:
+                    dependencies_integrity_manifest.append(None)
+                if dependencies_version_constraint is not None:
+                    dependencies_version_constraint.append(None)
+
+    (
+        missing_dependencies, broken_dependencies, user_site_dependencies, dependencies_checked_tier
+    ) = _classify_dependencies(
+        dependencies_expected_prefix, dependencies_import_name, dependencies_optional, check_tier,
+        escalation_tier, failure_policy == "fail_fast", dependencies_expected_path)
+
+    modified_dependencies: typing.List[typing.Optional[typing.List[str]]] = [None] * len(dependencies_import_name)
+    if "integrity" in dependencies_checked_tier:
+        # Imported here rather than at the top of the file, since this file must be importable on its own
+        # (see pusimp.audit) and the default check should not pay for the integrity machinery.
+        from pusimp.integrity import verify_dependencies_integrity
+
+        if dependencies_integrity_manifest is None:
+            dependencies_integrity_manifest = [None] * len(dependencies_import_name)
+        assert len(dependencies_import_name) == len(dependencies_integrity_manifest), "Incorrect input lengths"
+        verified_dependencies = [
+            dependency_id for dependency_id in range(len(dependencies_import_name))
+            if dependencies_checked_tier[dependency_id] == "integrity"
+            and missing_dependencies[dependency_id] is None and broken_dependencies[dependency_id] is None
+            and user_site_dependencies[dependency_id] is None
+        ]
+        verified_dependencies_modified_files = verify_dependencies_integrity(
+            dependencies_expected_prefix,
+            [dependencies_pypi_name[dependency_id] for dependency_id in verified_dependencies],
+            [dependencies_integrity_manifest[dependency_id] for dependency_id in verified_dependencies],
+            guard.integrity_cache_path
+        )
+        for (dependency_id, dependency_modified_files) in zip(
+                verified_dependencies, verified_dependencies_modified_files):
+            modified_dependencies[dependency_id] = dependency_modified_files
+
+    inconsistent_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]] = [
+        None] * len(dependencies_import_name)
+    if dependencies_version_constraint is not None or guard.check_wheel_tags:
+        from pusimp.consistency import check_dependencies_consistency
+
+        if dependencies_version_constraint is None:
+            dependencies_version_constraint = [None] * len(dependencies_import_name)
+        assert len(dependencies_import_name) == len(dependencies_version_constraint), "Incorrect input lengths"
+        checked_dependencies = [
+            dependency_id for dependency_id in range(len(dependencies_import_name))
+            if dependencies_checked_tier[dependency_id] is not None
+            and missing_dependencies[dependency_id] is None and broken_dependencies[dependency_id] is None
+            and user_site_dependencies[dependency_id] is None
+        ]
+        checked_dependencies_inconsistency = check_dependencies_consistency(
+            [dependencies_pypi_name[dependency_id] for dependency_id in checked_dependencies],
+            [dependencies_version_constraint[dependency_id] for dependency_id in checked_dependencies],
+            guard.check_wheel_tags
+        )
+        for (dependency_id, dependency_inconsistency) in zip(
+                checked_dependencies, checked_dependencies_inconsistency):
+            inconsistent_dependencies[dependency_id] = dependency_inconsistency
+
+    return _format_problems(
+        guard, dependencies_import_name, dependencies_pypi_name, dependencies_extra_error_message,
+        missing_dependencies, broken_dependencies, user_site_dependencies, modified_dependencies,
+        inconsistent_dependencies
+    )
+
+
+def _format_problems(
+    guard: Guard, dependencies_import_name: typing.Sequence[str], dependencies_pypi_name: typing.Sequence[str],
+    dependencies_extra_error_message: typing.Sequence[str], missing_dependencies: typing.List[typing.Optional[str]],
+    broken_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]],
+    user_site_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]],
+    modified_dependencies: typing.List[typing.Optional[typing.List[str]]],
+    inconsistent_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]]
+) -> typing.Optional[str]:
+    """
+    Prepare the text of the error message of a guard, listing problems by category.
+
+    The dependencies may differ from the ones of the guard, e.g. because of transitive dependencies.
+    See _classify_dependencies for the format of missing, broken and user-site dependencies, while modified and
+    inconsistent dependencies are reported by the list of modified files and by a dictionary containing
+    the description of the problem, respectively. Returns None if no problem is listed.
+    """
+    package_name = guard.package_name
+    system_manager = guard.system_manager
+    dependencies_expected_prefix = guard.dependencies_expected_prefix
+    pip_uninstall_call = guard.pip_uninstall_call
+    counter_error_categories = 1
+
+    missing_dependencies_error = ""
+    missing_dependencies_fix = ""
+    if any([isinstance(dependency_expected_path, str) for dependency_expected_path in missing_dependencies]):
+        missing_dependencies_error += f"{counter_error_categories}) Missing dependencies:\n"
+        for (dependency_id, dependency_expected_path) in enumerate(missing_dependencies):
+            if isinstance(dependency_expected_path, str):
+                missing_dependencies_error += (
+                    f"* {dependencies_import_name[dependency_id]} is missing. "
+                    f"Its expected path was {dependency_expected_path}.\n"
+                )
+        missing_dependencies_fix += f"{counter_error_categories}) To install missing dependencies:\n"
+        for (dependency_id, dependency_expected_path) in enumerate(missing_dependencies):
+            if isinstance(dependency_expected_path, str):
+                missing_dependencies_fix += (
+                    f"* check how to install {dependencies_import_name[dependency_id]} "
+                    f"with {system_manager}.\n"
+                )
+        counter_error_categories += 1
+
+    broken_dependencies_error = ""
+    broken_dependencies_fix = ""
+    if any([isinstance(dependency_info, dict) for dependency_info in broken_dependencies]):
+        broken_dependencies_error += f"{counter_error_categories}) Broken dependencies:\n"
+        for (dependency_id, dependency_info) in enumerate(broken_dependencies):
+            if isinstance(dependency_info, dict):
+                broken_dependencies_error += (
+                    f"* {dependencies_import_name[dependency_id]} is broken. "
+                    f"Error on import was '{dependency_info['error']}'.\n"
+                )
+        broken_dependencies_fix += f"{counter_error_categories}) To fix broken dependencies:\n"
+        for (dependency_id, dependency_info) in enumerate(broken_dependencies):
+            if isinstance(dependency_info, dict):
+                broken_dependencies_fix += (
+                    f"* run '{sys.executable} -m pip show {dependencies_pypi_name[dependency_id]}' in a terminal: "
+                    f"if the location field is not {dependencies_expected_prefix} "
+                    f"consider running "
+                    f"'{pip_uninstall_call(sys.executable, dependencies_pypi_name[dependency_id], 'unknown')}' "
+                    "in a terminal, because the broken dependency is probably being imported from a local path "
+                    f"rather than from the path provided by {system_manager}. "
+                    f"{dependencies_extra_error_message[dependency_id]}\n"
+                )
+        counter_error_categories += 1
+
+    user_site_dependencies_error = ""
+    user_site_dependencies_fix = ""
+    if any([isinstance(dependency_info, dict) for dependency_info in user_site_dependencies]):
+        user_site_dependencies_error += (
+            f"{counter_error_categories}) Dependencies imported from a local path rather than from "
+            f"the path provided by {system_manager}:\n"
+        )
+        for (dependency_id, dependency_info) in enumerate(user_site_dependencies):
+            if isinstance(dependency_info, dict):
+                user_site_dependencies_error += (
+                    f"* {dependencies_import_name[dependency_id]} was imported from a local path: "
+                    f"expected in {dependency_info['expected']}, but imported from {dependency_info['actual']}.\n"
+                )
+        user_site_dependencies_fix += f"{counter_error_categories}) To uninstall local dependencies:\n"
+        for (dependency_id, dependency_info) in enumerate(user_site_dependencies):
+            if isinstance(dependency_info, dict):
+                user_site_dependencies_fix += (
+                    "* run "
+                    f"""'{pip_uninstall_call(
+                        sys.executable, dependencies_pypi_name[dependency_id], dependency_info['actual'])}' """
+                    "in a terminal, and verify that you are prompted to confirm removal of files in "
+                    f"{os.path.dirname(dependency_info['actual'])}. "
+                    f"{dependencies_extra_error_message[dependency_id]}\n"
+                )
+        counter_error_categories += 1
+
+    modified_dependencies_error = ""
+    modified_dependencies_fix = ""
+    if any([isinstance(dependency_modified_files, list) for dependency_modified_files in modified_dependencies]):
+        modified_dependencies_error += (
+            f"{counter_error_categories}) Dependencies with files which differ from the ones installed by "
+            f"{system_manager}:\n"
+        )
+        for (dependency_id, dependency_modified_files) in enumerate(modified_dependencies):
+            if isinstance(dependency_modified_files, list):
+                modified_dependencies_error += (
+                    f"* {dependencies_import_name[dependency_id]} has modified or deleted files: "
+                    f"{', '.join(dependency_modified_files)}.\n"
+                )
+        modified_dependencies_fix += f"{counter_error_categories}) To restore modified dependencies:\n"
+        for (dependency_id, dependency_modified_files) in enumerate(modified_dependencies):
+            if isinstance(dependency_modified_files, list):
+                modified_dependencies_fix += (
+                    f"* check how to reinstall {dependencies_import_name[dependency_id]} with {system_manager}, "
+                    f"because its files in {dependencies_expected_prefix} were probably overwritten by a local "
+                    "installation. "
+                    f"{dependencies_extra_error_message[dependency_id]}\n"
+                )
+        counter_error_categories += 1
+
+    inconsistent_dependencies_error = ""
+    inconsistent_dependencies_fix = ""
+    if any([isinstance(dependency_info, dict) for dependency_info in inconsistent_dependencies]):
+        inconsistent_dependencies_error += (
+            f"{counter_error_categories}) Dependencies which are inconsistent with the requirements of "
+            f"{package_name}:\n"
+        )
+        for (dependency_id, dependency_info) in enumerate(inconsistent_dependencies):
+            if isinstance(dependency_info, dict):
+                inconsistent_dependencies_error += (
+                    f"* {dependencies_import_name[dependency_id]} {dependency_info['problem']}.\n"
+                )
+        inconsistent_dependencies_fix += f"{counter_error_categories}) To fix inconsistent dependencies:\n"
+        for (dependency_id, dependency_info) in enumerate(inconsistent_dependencies):
+            if isinstance(dependency_info, dict):
+                inconsistent_dependencies_fix += (
+                    f"* check how to install a version of {dependencies_import_name[dependency_id]} "
+                    f"consistent with {package_name} with {system_manager}. "
+                    f"{dependencies_extra_error_message[dependency_id]}\n"
+                )
+        counter_error_categories += 1
+
+    if counter_error_categories == 1:
+        return None
+    return (
+        f"pusimp has detected the following problems with {package_name} dependencies:\n"
+        f"{missing_dependencies_error}"
+        f"{broken_dependencies_error}"
+        f"{user_site_dependencies_error}"
+        f"{modified_dependencies_error}"
+        f"{inconsistent_dependencies_error}"
+        "\n"
+        "pusimp suggests to apply all of the following fixes:\n"
+        f"{missing_dependencies_fix}"
+        f"{broken_dependencies_fix}"
+        f"{user_site_dependencies_fix}"
+        f"{modified_dependencies_fix}"
+        f"{inconsistent_dependencies_fix}"
+        "\n"
+        f"You can disable this check by exporting the {guard._allow_user_site_imports_env_name} environment "
+        f"variable. Note, however, that this may break the installation provided by {system_manager}.\n"
+        f"If you believe that this message appears incorrectly, report this at {guard.contact_url} ."
+    )
+
+
+def _classify_dependencies(
+    dependencies_expected_prefix: str, dependencies_import_name: typing.Sequence[str],
+    dependencies_optional: typing.Sequence[bool], check_tier: str = "import",
+    escalation_tier: typing.Optional[str] = None, fail_fast: bool = False,
+    dependencies_expected_path: typing.Optional[typing.Sequence[str]] = None
+) -> typing.Tuple[
+    typing.List[typing.Optional[str]], typing.List[typing.Optional[typing.Dict[str, str]]],
+    typing.List[typing.Optional[typing.Dict[str, str]]], typing.List[typing.Optional[str]]
+]:
+    """
+    Classify each dependency as missing, broken, imported from user-site, or correctly installed.
+
+    Parameters
+    ----------
+    dependencies_expected_prefix, dependencies_import_name, dependencies_optional, check_tier, escalation_tier
+        See the documentation of prevent_user_site_imports.
+    fail_fast
+        If True, stop at the first problem involving a mandatory dependency, or a user-site import.
+    dependencies_expected_path
+        The expected location of the module of each dependency, as precomputed by Guard. If not provided,
+        it is computed from dependencies_expected_prefix.
+
+    Returns
+    -------
+    :
+        A quadruplet of lists, each of the same length as dependencies_import_name. The first three lists store
+        at each position either None or the information about the corresponding missing, broken or user-site
+        dependency. Missing dependencies are reported by their expected path, while broken and user-site
+        dependencies are reported by a dictionary containing the expected path and either the error raised
+        on import or the actual path. The last list stores the tier with which each dependency was checked,
+        or None if the dependency was not checked because of fail_fast.
+    """
+    missing_dependencies: typing.List[typing.Optional[str]] = [None] * len(dependencies_import_name)
+    broken_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]] = [
+        None] * len(dependencies_import_name)
+    user_site_dependencies: typing.List[typing.Optional[typing.Dict[str, str]]] = [
+        None] * len(dependencies_import_name)
+    dependencies_checked_tier: typing.List[typing.Optional[str]] = [None] * len(dependencies_import_name)
+    if dependencies_expected_path is None:
+        dependencies_expected_path = [
+            f"{dependencies_expected_prefix}/{dependency_import_name}/__init__.py"
+            for dependency_import_name in dependencies_import_name]
+    for (dependency_id, dependency_import_name) in enumerate(dependencies_import_name):
+        dependency_checked_tier = check_tier
+        dependency_classification = _classify_dependency(
+            dependencies_expected_path[dependency_id], dependency_import_name, dependencies_optional[dependency_id],
+            dependency_checked_tier)
+        if escalation_tier is not None and any(info is not None for info in dependency_classification):
+            dependency_checked_tier = escalation_tier
+            dependency_classification = _classify_dependency(
+                dependencies_expected_path[dependency_id], dependency_import_name,
+                dependencies_optional[dependency_id], dependency_checked_tier)
+        (
+            missing_dependencies[dependency_id], broken_dependencies[dependency_id],
+            user_site_dependencies[dependency_id]
+        ) = dependency_classification
+        dependencies_checked_tier[dependency_id] = dependency_checked_tier
+        if fail_fast and any(info is not None for info in dependency_classification):
+            break
+    return missing_dependencies, broken_dependencies, user_site_dependencies, dependencies_checked_tier
+
+
+def _classify_dependency(
+    dependency_module_expected_path: str, dependency_import_name: str, dependency_optional: bool, check_tier: str
+) -> typing.Tuple[
+    typing.Optional[str], typing.Optional[typing.Dict[str, str]], typing.Optional[typing.Dict[str, str]]
+]:
+    """
+    Classify a single dependency with the requested tier. See _classify_dependencies for the returned values.
+
+    The dependency is expected to be either a package in the directory of its expected path, or a module next
+    to that directory, stored as source, as sourceless bytecode or as an extension module. Missing dependencies
+    are still reported by their expected path, while the other problems report the actual expected location.
+    """
+    dependency_module_expected_location = _find_expected_location(dependency_module_expected_path)
+    if dependency_module_expected_location is None:
+        if not dependency_optional:
+            return dependency_module_expected_path, None, None
+        dependency_module_expected_location = dependency_module_expected_path
+    dependency_module_actual_path: typing.Optional[str]
+    try:
+        if check_tier == "static":
+            dependency_module_actual_path = _find_static_location(dependency_import_name)
+        elif check_tier == "spec":
+            dependency_module_actual_path = _find_spec_location(dependency_import_name)
+        else:
+            dependency_module = importlib.import_module(dependency_import_name)
+            dependency_module_actual_path = dependency_module.__file__
+    except BaseException as dependency_module_import_error:
+        if not dependency_optional:
+            return None, {
+                "expected": dependency_module_expected_location,
+                "error": str(dependency_module_import_error)
+            }, None
+    else:
+        assert dependency_module_actual_path is not None, f"Unable to find location of {dependency_import_name}"
+        if not _matches_expected_location(dependency_module_actual_path, dependency_module_expected_path):
+            return None, None, {
+                "expected": dependency_module_expected_location,
+                "actual": dependency_module_actual_path
+            }
+    return None, None, None
+
+
+def _find_static_location(dependency_import_name: str) -> typing.Optional[str]:
+    """
+    Find the location of a dependency by looking for it in the entries of sys.path.
+
+    None is returned for a module which was already imported, but has no location (e.g., a namespace package).
+    """
+    dependency_module = sys.modules.get(dependency_import_name)
+    if dependency_module is not None:
+        return getattr(dependency_module, "__file__", None)
+    for sys_path_entry in sys.path:
+        dependency_module_path = _find_module_location(sys_path_entry or os.getcwd(), dependency_import_name)
+        if dependency_module_path is not None:
+            return dependency_module_path
+    raise ModuleNotFoundError(f"No module named '{dependency_import_name}'")
+
+
+def _find_spec_location(dependency_import_name: str) -> typing.Optional[str]:
+    """
+    Find the location of a dependency by asking the import system for its spec, without importing it.
+
+    None is returned for a module whose spec has no origin (e.g., a namespace package).
+    """
+    dependency_module_spec = importlib.util.find_spec(dependency_import_name)
+    if dependency_module_spec is None:
+        raise ModuleNotFoundError(f"No module named '{dependency_import_name}'")
+    return dependency_module_spec.origin
+
+
+def _same_location(actual_location: str, expected_location: str) -> bool:
+    """
+    Check whether a module was imported from its expected location.
+
+    Locations are compared after normalization, since zipimport reports the location of a module by joining
+    the path of the archive, as it appears in sys.path (and thus possibly relative), with the name of the member.
+    """
+    return actual_location == expected_location or (
+        os.path.normcase(os.path.abspath(actual_location)) == os.path.normcase(os.path.abspath(expected_location)))
+
+
+def _matches_expected_location(actual_location: str, expected_path: str) -> bool:
+    """
+    Check whether a module was imported from the expected location of a dependency.
+
+    The expected path is the one of the __init__.py file of a package: the module matches if it is the __init__
+    file of that package with any module suffix, or a module named after the package in the same directory.
+    """
+    if _same_location(actual_location, expected_path):
+        return True
+    expected_package_path = os.path.dirname(expected_path)
+    (actual_directory, actual_file_name) = os.path.split(actual_location)
+    if _same_location(actual_directory, expected_package_path):
+        return actual_file_name in {f"__init__{module_suffix}" for module_suffix in _MODULE_SUFFIXES}
+    if _same_location(actual_directory, os.path.dirname(expected_package_path)):
+        return actual_file_name in {
+            f"{os.path.basename(expected_package_path)}{module_suffix}" for module_suffix in _MODULE_SUFFIXES}
+    return False
+
+
+def _find_expected_location(expected_path: str) -> typing.Optional[str]:
+    """
+    Find the location of a dependency at its expected path, or next to it. See _matches_expected_location.
+
+    Returns None if the dependency is missing.
+    """
+    if os.path.exists(expected_path):
+        return expected_path
+    expected_package_path = os.path.dirname(expected_path)
+    return _find_module_location(os.path.dirname(expected_package_path), os.path.basename(expected_package_path))
+
+
+def _find_module_location(directory: str, module_name: str) -> typing.Optional[str]:
+    """
+    Find the file from which the path based finder would import a top-level module in a directory.
+
+    The directory may be in a zip archive. As in the path based finder, packages come before modules, and
+    extension modules come before sources, which come before sourceless bytecode. Namespace packages are
+    not looked for. Returns None if the module is not in the directory.
+    """
+    directory_names = set(_list_location(directory) or ())
+    if module_name in directory_names:
+        package_path = os.path.join(directory, module_name)
+        package_names = set(_list_location(package_path) or ())
+        for module_suffix in _MODULE_SUFFIXES:
+            if f"__init__{module_suffix}" in package_names:
+                return os.path.join(package_path, f"__init__{module_suffix}")
+    for module_suffix in _MODULE_SUFFIXES:
+        if f"{module_name}{module_suffix}" in directory_names:
+            return os.path.join(directory, f"{module_name}{module_suffix}")
+    return None
+
+
+def _list_location(location: str) -> typing.Optional[typing.List[str]]:
+    """
+    List the names in a directory, either on the filesystem or in a zip archive on it.
+
+    Returns an empty list if the directory does not exist, and None if it cannot be listed (e.g., because it is
+    a file which is not a zip archive).
+    """
+    try:
+        return os.listdir(location)
+    except (FileNotFoundError, NotADirectoryError):
+        archive_location = (location, "") if os.path.isfile(location) else _split_archive_location(location)
+    except OSError:
+        return None
+    if archive_location is None:
+        return []
+    (archive_path, member_prefix) = archive_location
+    archive_members = _read_archive_members(archive_path)
+    if archive_members is None:
+        return None
+    member_prefix = f"{member_prefix}/" if member_prefix != "" else ""
+    return sorted({
+        member_name[len(member_prefix):].split("/", 1)[0] for member_name in archive_members
+        if member_name.startswith(member_prefix)})
+
+
+def _split_archive_location(location: str) -> typing.Optional[typing.Tuple[str, str]]:
+    """
+    Split a location which does not exist on the filesystem into the path of a file and a member name within it.
+
+    Returns None if the closest existing ancestor of the location is not a regular file.
+    """
+    (archive_path, member_part) = os.path.split(location)
+    member_parts = [member_part]
+    while True:
+        if member_part == "":
+            return None
+        try:
+            archive_stat = os.stat(archive_path)
+        except OSError:
+            (archive_path, member_part) = os.path.split(archive_path)
+            member_parts.append(member_part)
+        else:
+            break
+    if not stat.S_ISREG(archive_stat.st_mode):
+        return None
+    return archive_path, "/".join(reversed(member_parts))
+
+
+def _read_archive_members(archive_path: str) -> typing.Optional[typing.FrozenSet[str]]:
+    """
+    Return the names of the files and directories in a zip archive, or None if the file is not a zip archive.
+
+    Only the central directory of the archive is read, and its content is cached until the archive changes.
+    """
+    try:
+        archive_stat = os.stat(archive_path)
+    except OSError:
+        return None
+    archive_state = (archive_stat.st_ino, archive_stat.st_size, archive_stat.st_mtime_ns)
+    cached_archive_members = _archive_members.get(archive_path)
+    if cached_archive_members is not None and cached_archive_members[0] == archive_state:
+        return cached_archive_members[1]
+    # Imported here rather than at the top of the file, since most guards never look into an archive.
+    import zipfile
+
+    archive_members: typing.Optional[typing.FrozenSet[str]]
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            member_names = archive.namelist()
+    except (OSError, zipfile.BadZipFile):
+        archive_members = None
+    else:
+        # Archives do not necessarily store entries for directories, which are then implied by their members.
+        archive_members = frozenset(
+            "/".join(member_parts[:member_part_id])
+            for member_parts in (member_name.rstrip("/").split("/") for member_name in member_names)
+            for member_part_id in range(1, len(member_parts) + 1))
+    _archive_members[archive_path] = (archive_state, archive_members)
+    return archive_members
@@ -0,0 +1,138 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Find the transitive dependencies installed by the system manager, walking the Requires-Dist metadata."""
+
+import importlib.metadata
+import os
+import pathlib
+import re
+import typing
+
+from pusimp.prevent_user_site_imports import _find_expected_location, _MODULE_SUFFIXES
+from pusimp.verdict import _distribution_entries
+
+_REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+# Requirement graphs, keyed by the expected prefix. Each graph is stored together with the modification time
+# of the prefix and the names of its distributions at the time it was created, since installing or removing a
+# distribution changes them. The names are required on filesystems with coarse timestamps (e.g., NFS), on which
+# the modification time may not change when a distribution is installed within the same tick.
+_requirement_graphs: typing.Dict[str, typing.Tuple[typing.Tuple[int, typing.List[str]], "_RequirementGraph"]] = {}
+
+
+def transitive_dependencies(
+    dependencies_expected_prefix: str, dependencies_pypi_name: typing.List[str]
+) -> typing.List[typing.Tuple[str, str, str]]:
+    """
+    Find the transitive dependencies, installed in the expected prefix, of a set of dependencies.
+
+    Parameters
+    ----------
+    dependencies_expected_prefix
+        The expected prefix of import locations managed by the system manager. Distributions which are not
+        installed in this prefix are neither reported nor walked.
+    dependencies_pypi_name
+        The pypi name of the dependencies from which the walk starts.
+
+    Returns
+    -------
+    :
+        A list of triplets, one for each import name of each transitive dependency, sorted by distance from
+        dependencies_pypi_name. Each triplet contains the import name, the pypi name of the transitive dependency
+        and the pypi name of the dependency which requires it. Dependencies in dependencies_pypi_name, and
+        extras requirements, are not reported.
+    """
+    graph = _requirement_graph(dependencies_expected_prefix)
+    visited = {_normalize(dependency_pypi_name) for dependency_pypi_name in dependencies_pypi_name}
+    queue = list(dependencies_pypi_name)
+    dependencies = []
+    while len(queue) > 0:
+        required_by = queue.pop(0)
+        for requirement in graph.requirements(required_by):
+            if _normalize(requirement) not in visited:
+                visited.add(_normalize(requirement))
+                queue.append(requirement)
+                for import_name in graph.import_names(requirement):
+                    dependencies.append((import_name, requirement, required_by))
+    return dependencies
+
+
+class _RequirementGraph:
+    """Lazily populated requirement graph of the distributions installed in a prefix."""
+
+    def __init__(self, prefix: str) -> None:
+        self._prefix = prefix
+        self._distributions: typing.Dict[str, importlib.metadata.Distribution] = {}
+        try:
+            entries = sorted(os.scandir(prefix), key=lambda entry: entry.name)
+        except OSError:
+            entries = []
+        for entry in entries:
+            if entry.name.endswith((".dist-info", ".egg-info")) and entry.is_dir():
+                self._distributions.setdefault(
+                    _normalize(entry.name.split("-")[0]), importlib.metadata.PathDistribution(pathlib.Path(entry.path)))
+        self._requirements: typing.Dict[str, typing.List[str]] = {}
+        self._import_names: typing.Dict[str, typing.List[str]] = {}
+
+    def requirements(self, pypi_name: str) -> typing.List[str]:
+        """Return the pypi names of the non-extras requirements of a distribution installed in the prefix."""
+        normalized_name = _normalize(pypi_name)
+        if normalized_name not in self._requirements:
+            requirements = []
+            distribution = self._distributions.get(normalized_name)
+            if distribution is not None:
+                for requirement in distribution.requires or []:
+                    (requirement_specifier, _, requirement_marker) = requirement.partition(";")
+                    requirement_name = _REQUIREMENT_NAME.match(requirement_specifier)
+                    if requirement_name is not None and "extra" not in requirement_marker:
+                        requirements.append(requirement_name.group(1))
+            self._requirements[normalized_name] = requirements
+        return self._requirements[normalized_name]
+
+    def import_names(self, pypi_name: str) -> typing.List[str]:
+        """Return the import name of the packages provided by a distribution installed in the prefix."""
+        normalized_name = _normalize(pypi_name)
+        if normalized_name not in self._import_names:
+            import_names: typing.List[str] = []
+            distribution = self._distributions.get(normalized_name)
+            if distribution is not None:
+                top_level = distribution.read_text("top_level.txt")
+                if top_level is not None:
+                    import_names = top_level.split()
+                else:
+                    # Packages, possibly sourceless, and single-file modules, possibly compiled extensions
+                    import_names = sorted({
+                        path.parts[0] for path in distribution.files or []
+                        if len(path.parts) == 2 and path.parts[1] in {
+                            f"__init__{module_suffix}" for module_suffix in _MODULE_SUFFIXES}
+                    } | {
+                        path.name.split(".", 1)[0] for path in distribution.files or []
+                        if len(path.parts) == 1 and path.name.endswith(_MODULE_SUFFIXES)
+                    }) or [normalized_name.replace("-", "_")]
+            self._import_names[normalized_name] = [
+                import_name for import_name in import_names
+                if _find_expected_location(f"{self._prefix}/{import_name}/__init__.py") is not None
+            ]
+        return self._import_names[normalized_name]
+
+
+def _requirement_graph(prefix: str) -> _RequirementGraph:
+    """Return the requirement graph of a prefix, creating it if the prefix changed since the last call."""
+    try:
+        prefix_mtime = os.stat(prefix).st_mtime_ns
+    except OSError:
+        prefix_mtime = -1
+    prefix_state = (prefix_mtime, _distribution_entries(prefix))
+    cached_graph = _requirement_graphs.get(prefix)
+    if cached_graph is None or cached_graph[0] != prefix_state:
+        cached_graph = (prefix_state, _RequirementGraph(prefix))
+        _requirement_graphs[prefix] = cached_graph
+    return cached_graph[1]
+
+
+def _normalize(pypi_name: str) -> str:
+    """Normalize a pypi name, as in PEP 503."""
+    return re.sub(r"[-_.]+", "-", pypi_name).lower()
@@ -0,0 +1,136 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Prove, without probing the dependencies, that none of them can be imported from outside of the expected prefix.
+
+In many deployments user-site imports are impossible by construction, e.g. because the interpreter runs with
+python -s or PYTHONNOUSERSITE, or because sys.path only consists of system-owned directories. The proof inspects
+PYTHONPATH, sys.meta_path and the entries of sys.path which come before the expected prefix, where the user site
+is absent when disabled by the interpreter flags or by site.ENABLE_USER_SITE, and succeeds when:
+* every meta path finder which comes before the path based finder is either a standard one or does not find
+  any dependency, so that dependencies are looked up in sys.path;
+* every entry of sys.path which comes before the expected prefix is neither the user site nor an entry of
+  PYTHONPATH, is owned by root or by the owner of the expected prefix and is not writable by group or others
+  (or, if it does not exist, its closest existing ancestor is), is handled by the standard file finder or by
+  zipimport, and contains no package, module, extension or namespace package named after a dependency, where
+  zip archives are listed from their central directory;
+* every dependency which was already imported was imported from its expected location, and every other one
+  exists in the expected prefix as a package or as a module, so that the path based finder stops there.
+The proof does not import dependencies, so broken dependencies are not detected when the proof succeeds.
+"""
+
+import importlib.machinery
+import os
+import site
+import stat
+import sys
+import typing
+import zipimport
+
+from pusimp.prevent_user_site_imports import _find_expected_location, _list_location, _matches_expected_location
+
+# Meta path finders which never find a module in a directory of sys.path.
+_STANDARD_META_PATH_FINDERS = (importlib.machinery.BuiltinImporter, importlib.machinery.FrozenImporter)
+
+# Path entry finders which only find modules in the directory or zip archive of their entry of sys.path.
+_STANDARD_PATH_ENTRY_FINDERS = (importlib.machinery.FileFinder, zipimport.zipimporter)
+
+
+def prove_sys_path_safety(
+    dependencies_expected_prefix: str, dependencies_import_name: typing.Sequence[str],
+    dependencies_expected_path: typing.Sequence[str]
+) -> bool:
+    """
+    Prove that each dependency is imported from its expected path, and cannot be shadowed by the user site.
+
+    Parameters
+    ----------
+    dependencies_expected_prefix, dependencies_import_name
+        See the documentation of pusimp.prevent_user_site_imports.
+    dependencies_expected_path
+        The expected location of the module of each dependency.
+
+    Returns
+    -------
+    :
+        True if the proof succeeds, and False if it cannot be carried out, in which case the dependencies
+        must be probed as usual.
+    """
+    if not _meta_path_is_safe(dependencies_import_name):
+        return False
+    entries_ahead = _sys_path_entries_ahead(dependencies_expected_prefix)
+    if entries_ahead is None:
+        return False
+    try:
+        trusted_uids = {0, os.stat(dependencies_expected_prefix).st_uid}
+    except OSError:
+        return False
+    untrusted_entries = {
+        _normalize_path(pythonpath_entry) for pythonpath_entry in os.getenv("PYTHONPATH", "").split(os.pathsep)
+        if pythonpath_entry != ""
+    }
+    user_site = getattr(site, "USER_SITE", None)
+    if user_site is not None:
+        untrusted_entries.add(_normalize_path(user_site))
+    dependencies_name = set(dependencies_import_name)
+    for (sys_path_entry, entry_path) in entries_ahead:
+        if entry_path in untrusted_entries or not _is_system_owned(entry_path, trusted_uids):
+            return False
+        entry_finder = sys.path_importer_cache.get(sys_path_entry)
+        if entry_finder is not None and not isinstance(entry_finder, _STANDARD_PATH_ENTRY_FINDERS):
+            return False
+        entry_names = _list_location(entry_path)
+        if entry_names is None or any(entry_name.split(".", 1)[0] in dependencies_name for entry_name in entry_names):
+            return False
+    for (dependency_import_name, dependency_expected_path) in zip(
+            dependencies_import_name, dependencies_expected_path):
+        dependency_module = sys.modules.get(dependency_import_name)
+        if dependency_module is not None:
+            dependency_module_file = getattr(dependency_module, "__file__", None)
+            if dependency_module_file is None or not _matches_expected_location(
+                    dependency_module_file, dependency_expected_path):
+                return False
+        elif _find_expected_location(dependency_expected_path) is None:
+            return False
+    return True
+
+
+def _meta_path_is_safe(dependencies_import_name: typing.Sequence[str]) -> bool:
+    """Check that no meta path finder before the path based finder finds any of the dependencies."""
+    for finder in sys.meta_path:
+        if finder is importlib.machinery.PathFinder:
+            return True
+        if finder not in _STANDARD_META_PATH_FINDERS and any(
+                finder.find_spec(dependency_import_name, None) is not None
+                for dependency_import_name in dependencies_import_name):
+            return False
+    return False
+
+
+def _sys_path_entries_ahead(
+    dependencies_expected_prefix: str
+) -> typing.Optional[typing.List[typing.Tuple[str, str]]]:
+    """Return the entries of sys.path before the expected prefix, together with their path, or None if absent."""
+    expected_prefix = _normalize_path(dependencies_expected_prefix)
+    entries_ahead: typing.List[typing.Tuple[str, str]] = []
+    for sys_path_entry in sys.path:
+        entry_path = _normalize_path(sys_path_entry or os.getcwd())
+        if entry_path == expected_prefix:
+            return entries_ahead
+        entries_ahead.append((sys_path_entry, entry_path))
+    return None
+
+
+def _is_system_owned(path: str, trusted_uids: typing.Set[int]) -> bool:
+    """Check that a path, or its closest existing ancestor, is owned by a trusted user and only writable by it."""
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    path_stat = os.stat(path)
+    return path_stat.st_uid in trusted_uids and not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _normalize_path(path: str) -> str:
+    """Normalize a path, so that entries of sys.path can be compared with each other."""
+    return os.path.normcase(os.path.abspath(path))
@@ -9,26 +9,37 @@ Note that this file does not get automatically imported in __init__.py to avoid
 on virtualenv.
 """
 
+import base64
+import concurrent.futures
+import gc
+import hashlib
+import importlib
+import importlib.machinery
 import os
 import pathlib
+import random
+import shlex
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import tracemalloc
 import types
 import typing
 
 import virtualenv
 
 
-def assert_has_package(executable: str, package: str) -> None:
+def assert_has_package(executable: str, package: str, env: typing.Optional[typing.Dict[str, str]] = None) -> None:
     """Assert that a package is installed.
 
     Note that it is not safe to simply import the package in the current pytest environment,
     since the environment itself might change from one test to the other, but python packages
     can be imported only once and not unloaded.
     """
-    run_import = subprocess.run(f"{executable} -c 'import {package}'", shell=True, capture_output=True)
+    run_import = subprocess.run(f"{executable} -c 'import {package}'", shell=True, env=env, capture_output=True)
     assert run_import.returncode == 0, (
         f"Importing {package} was not successful.\n"
         f"stdout contains {run_import.stdout.decode().strip()}\n"
@@ -42,11 +53,13 @@ def assert_not_has_package(executable: str, package: str) -> None:
     assert run_import.returncode != 0, f"Importing {package} was unexpectedly successful"
 
 
-def assert_package_location(executable: str, package: str, package_path: str) -> None:
+def assert_package_location(
+    executable: str, package: str, package_path: str, env: typing.Optional[typing.Dict[str, str]] = None
+) -> None:
     """Assert that a package imports from the expected location."""
-    assert_has_package(executable, package)
+    assert_has_package(executable, package, env)
     run_import_file = subprocess.run(
-        f"{executable} -c 'import {package}; print({package}.__file__)'", shell=True, capture_output=True)
+        f"{executable} -c 'import {package}; print({package}.__file__)'", shell=True, env=env, capture_output=True)
     assert run_import_file.returncode == 0, (
         "This case was never supposed to happen, because {package} did import successfully with assert_has_package")
     assert run_import_file.stdout.decode().strip() == package_path, (
@@ -75,6 +88,42 @@ def assert_package_import_error(
         )
 
 
+def create_mock_distribution(
+    prefix: str, files: typing.Dict[str, str], pypi_name: typing.Optional[str] = None,
+    requires: typing.Sequence[str] = (), top_level: typing.Optional[typing.List[str]] = None, record: bool = True
+) -> typing.List[str]:
+    """Create mock files in a prefix, optionally together with the dist-info of the distribution providing them.
+
+    files maps the path of each file, relative to the prefix, to its content. When pypi_name is provided, the
+    dist-info directory contains the METADATA with the given requirements, the RECORD of the files (unless
+    record is False) and, if provided, the import names in top_level.txt. The lines of the RECORD are returned
+    in any case, so that tests can write them to a manifest instead.
+    """
+    record_lines = []
+    if pypi_name is not None:
+        dist_info = f"{pypi_name.replace('-', '_')}-1.0.dist-info"
+        files = {
+            **files,
+            f"{dist_info}/METADATA": "".join([
+                f"Metadata-Version: 2.1\nName: {pypi_name}\nVersion: 1.0\n",
+                *(f"Requires-Dist: {requirement}\n" for requirement in requires)])
+        }
+        if top_level is not None:
+            files[f"{dist_info}/top_level.txt"] = "\n".join(top_level)
+    for (path, content) in files.items():
+        os.makedirs(os.path.join(prefix, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(prefix, path), "w") as file_:
+            file_.write(content)
+        digest = base64.urlsafe_b64encode(hashlib.sha256(content.encode()).digest()).rstrip(b"=").decode()
+        record_lines.append(f"{path},sha256={digest},{len(content.encode())}")
+    if pypi_name is not None:
+        record_lines.append(f"{dist_info}/RECORD,,")
+        if record:
+            with open(os.path.join(prefix, dist_info, "RECORD"), "w") as record_file:
+                record_file.write("\n".join(record_lines))
+    return record_lines
+
+
 class TemporarilyEnableEnvironmentVariable:
     """Temporarily enable an environment variable in a test."""
 
@@ -95,6 +144,198 @@ class TemporarilyEnableEnvironmentVariable:
         del os.environ[self._variable_name]
 
 
+class ImportSandbox:
+    """Temporarily isolate the import state of the current interpreter in a test.
+
+    On exit, sys.path, sys.modules, sys.meta_path, sys.path_hooks, sys.path_importer_cache and os.environ are
+    restored to their content on entry. This allows to test several import scenarios in the same interpreter,
+    since modules imported inside the sandbox are forgotten on exit, and will be imported again by later tests.
+    """
+
+    def __init__(self) -> None:
+        self._path: typing.List[str] = []
+        self._modules: typing.Dict[str, types.ModuleType] = {}
+        self._meta_path: typing.List[typing.Any] = []
+        self._path_hooks: typing.List[typing.Any] = []
+        self._path_importer_cache: typing.Dict[str, typing.Any] = {}
+        self._environ: typing.Dict[str, str] = {}
+
+    def __enter__(self) -> None:
+        """Take a snapshot of the import state."""
+        self._path = list(sys.path)
+        self._modules = dict(sys.modules)
+        self._meta_path = list(sys.meta_path)
+        self._path_hooks = list(sys.path_hooks)
+        self._path_importer_cache = dict(sys.path_importer_cache)
+        self._environ = dict(os.environ)
+        importlib.invalidate_caches()
+
+    def __exit__(
+        self, exception_type: typing.Optional[typing.Type[BaseException]],
+        exception_value: typing.Optional[BaseException],
+        traceback: typing.Optional[types.TracebackType]
+    ) -> None:
+        """Restore the import state from the snapshot."""
+        for module_name in set(sys.modules) - set(self._modules):
+            module = sys.modules.pop(module_name)
+            # Importing a submodule sets it as an attribute of its parent package, which may outlive the sandbox
+            (parent_name, _, child_name) = module_name.rpartition(".")
+            parent_module = self._modules.get(parent_name)
+            if parent_module is not None and getattr(parent_module, child_name, None) is module:
+                delattr(parent_module, child_name)
+        sys.modules.update(self._modules)
+        sys.path[:] = self._path
+        sys.meta_path[:] = self._meta_path
+        sys.path_hooks[:] = self._path_hooks
+        sys.path_importer_cache.clear()
+        sys.path_importer_cache.update(self._path_importer_cache)
+        for variable_name in set(os.environ) - set(self._environ):
+            del os.environ[variable_name]
+        os.environ.update(self._environ)
+        importlib.invalidate_caches()
+
+
+class FilesystemInterposer:
+    """Temporarily call a callback before every call to the filesystem primitives employed by pusimp and by imports.
+
+    The primitives are the stat, lstat, listdir and scandir functions of the os module (os.path.exists and
+    similar functions call os.stat), and the stat and directory listing of the path based finders of the
+    import system, which do not go through the os module. The callback receives the name of the primitive,
+    which is one of the keys of FilesystemInterposer.primitives.
+    """
+
+    primitives: typing.ClassVar[typing.Dict[str, typing.Tuple[typing.Any, str]]] = {
+        "stat": (os, "stat"),
+        "lstat": (os, "lstat"),
+        "listdir": (os, "listdir"),
+        "scandir": (os, "scandir"),
+        "import_stat": (sys.modules["_frozen_importlib_external"], "_path_stat"),
+        "import_listdir": (importlib.machinery.FileFinder, "_fill_cache")
+    }
+
+    def __init__(self, callback: typing.Callable[[str], None]) -> None:
+        self._callback = callback
+        self._originals: typing.Dict[str, typing.Callable[..., typing.Any]] = {}
+
+    def __enter__(self) -> None:
+        """Replace every primitive with a wrapper which calls the callback first."""
+        for (primitive_name, (primitive_owner, primitive_attribute)) in self.primitives.items():
+            original = getattr(primitive_owner, primitive_attribute)
+            self._originals[primitive_name] = original
+            setattr(primitive_owner, primitive_attribute, self._wrap(primitive_name, original))
+
+    def __exit__(
+        self, exception_type: typing.Optional[typing.Type[BaseException]],
+        exception_value: typing.Optional[BaseException],
+        traceback: typing.Optional[types.TracebackType]
+    ) -> None:
+        """Restore the original primitives."""
+        for (primitive_name, (primitive_owner, primitive_attribute)) in self.primitives.items():
+            setattr(primitive_owner, primitive_attribute, self._originals.pop(primitive_name))
+
+    def _wrap(
+        self, primitive_name: str, original: typing.Callable[..., typing.Any]
+    ) -> typing.Callable[..., typing.Any]:
+        """Wrap a primitive so that the callback is called first."""
+        callback = self._callback
+
+        def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:  # noqa: ANN401
+            callback(primitive_name)
+            return original(*args, **kwargs)
+
+        return wrapper
+
+
+class FilesystemCallCounter(FilesystemInterposer):
+    """Temporarily count the calls to the filesystem primitives employed by pusimp and by imports, in a test.
+
+    Counts are stored in the counts attribute, keyed by the name of the primitive, and are not reset on exit.
+    See FilesystemInterposer for the list of primitives.
+    """
+
+    def __init__(self) -> None:
+        self.counts: typing.Dict[str, int] = {primitive_name: 0 for primitive_name in self.primitives}
+        self._counts_lock = threading.Lock()
+        super().__init__(self._count)
+
+    def _count(self, primitive_name: str) -> None:
+        """Count a call to a primitive."""
+        with self._counts_lock:
+            self.counts[primitive_name] += 1
+
+    @property
+    def total(self) -> int:
+        """Return the total number of calls to any primitive."""
+        return sum(self.counts.values())
+
+
+class FilesystemLatency(FilesystemInterposer):
+    """Temporarily add latency to every call to the filesystem primitives employed by pusimp and by imports.
+
+    This allows to benchmark guards on a local disk as if files were stored on a network filesystem, e.g.
+    NFS or Lustre, on which every metadata operation is a round trip to a server. Every call is delayed by
+    latency seconds, plus a random jitter uniformly distributed between zero and jitter seconds. The total delay
+    which was injected is stored in the injected_delay attribute. See FilesystemInterposer for the list of
+    primitives.
+    """
+
+    def __init__(self, latency: float, jitter: float = 0.0, seed: typing.Optional[int] = None) -> None:
+        assert latency >= 0.0 and jitter >= 0.0, "Latency and jitter must be non-negative"
+        self.injected_delay = 0.0
+        self._latency = latency
+        self._jitter = jitter
+        self._random = random.Random(seed)
+        self._delay_lock = threading.Lock()
+        super().__init__(self._delay)
+
+    def _delay(self, primitive_name: str) -> None:
+        """Sleep before a call to a primitive."""
+        with self._delay_lock:
+            delay = self._latency + self._random.uniform(0.0, self._jitter)
+            self.injected_delay += delay
+        time.sleep(delay)
+
+
+class MemoryFootprint:
+    """Measure the peak memory of a block, and the memory which pusimp still retains after it, with tracemalloc.
+
+    The peak accounts for every allocation made in the block, while retained memory only accounts for allocations
+    which were made by the files matching filename_pattern (by default, the files of pusimp) and are still alive
+    after a garbage collection at the end of the block. Modules imported by the block, which are meant to outlive it,
+    are therefore not counted as retained. The largest retained allocations are stored, by line, in the
+    retained_statistics attribute, so that regressions can be reported.
+    """
+
+    def __init__(self, filename_pattern: typing.Optional[str] = None) -> None:
+        if filename_pattern is None:
+            filename_pattern = os.path.join(os.path.dirname(os.path.abspath(__file__)), "*")
+        # Allocations made by this module while measuring are never counted as retained.
+        self._filters = [tracemalloc.Filter(True, filename_pattern), tracemalloc.Filter(False, __file__)]
+        self.peak = 0
+        self.retained = 0
+        self.retained_statistics: typing.List[tracemalloc.Statistic] = []
+
+    def __enter__(self) -> "MemoryFootprint":
+        """Start tracing allocations."""
+        assert not tracemalloc.is_tracing(), "Memory footprints cannot be nested"
+        gc.collect()
+        tracemalloc.start()
+        return self
+
+    def __exit__(
+        self, exception_type: typing.Optional[typing.Type[BaseException]],
+        exception_value: typing.Optional[BaseException],
+        traceback: typing.Optional[types.TracebackType]
+    ) -> None:
+        """Stop tracing allocations, and store peak and retained memory."""
+        (_, self.peak) = tracemalloc.get_traced_memory()
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+        tracemalloc.stop()
+        self.retained_statistics = snapshot.statistics("lineno")
+        self.retained = sum(statistic.size for statistic in self.retained_statistics)
+
+
 class VirtualEnv:
     """Helper class to create a temporary virtual environment.
 
@@ -196,6 +437,98 @@ class VirtualEnv:
         """Return the default call to pip uninstall."""
         return f"{executable} -m pip uninstall --yes --break-system-packages {package}"
 
+    def install_packages(
+        self, packages: typing.List[str], install_call: typing.Optional[typing.Callable[[str, str], str]] = None,
+        output_callback: typing.Optional[typing.Callable[[str], None]] = None
+    ) -> None:
+        """Install several packages in the virtual environment, with as few calls to pip as possible.
+
+        The calls generated by install_call for each package are merged into a single call when they only
+        differ by the package itself. The output of pip is passed to output_callback line by line, as soon as
+        it is available.
+        """
+        if install_call is None:
+            install_call = self._default_install_call
+        for (batch_packages, batch_call) in self._merge_calls(
+            [(package, install_call(self.executable, package)) for package in packages]
+        ):
+            (returncode, output) = self._run_streamed(batch_call, output_callback)
+            if returncode != 0:
+                raise RuntimeError(
+                    f"Installing {' '.join(batch_packages)} was not successful.\n"
+                    f"output contains {output}"
+                )
+
+    def uninstall_packages(
+        self, packages: typing.List[str], installation_paths: typing.List[str],
+        uninstall_call: typing.Optional[typing.Callable[[str, str, str], str]] = None,
+        output_callback: typing.Optional[typing.Callable[[str], None]] = None
+    ) -> None:
+        """Uninstall several packages from the virtual environment, with as few calls to pip as possible.
+
+        See install_packages for how calls are merged and how the output of pip is streamed.
+        """
+        assert len(packages) == len(installation_paths), "Incorrect input lengths"
+        if uninstall_call is None:
+            uninstall_call = self._default_uninstall_call
+        for (batch_packages, batch_call) in self._merge_calls([
+            (package, uninstall_call(self.executable, package, installation_path))
+            for (package, installation_path) in zip(packages, installation_paths)
+        ]):
+            (returncode, output) = self._run_streamed(batch_call, output_callback)
+            if returncode != 0 or any(
+                f"WARNING: Skipping {package} as it is not installed" in output for package in batch_packages
+            ):
+                raise RuntimeError(
+                    f"Uninstalling {' '.join(batch_packages)} was not successful.\n"
+                    f"output contains {output}"
+                )
+
+    @staticmethod
+    def _merge_calls(calls: typing.List[typing.Tuple[str, str]]) -> typing.List[typing.Tuple[typing.List[str], str]]:
+        """Merge calls which only differ by the package they act on, preserving the order of the first occurrence.
+
+        Calls are compared by their shell tokens, so that packages quoted by the call are merged as separate
+        arguments. Calls in which exactly one token is not the package itself are not merged.
+        """
+        merged_calls: typing.Dict[
+            typing.Tuple[typing.Tuple[str, ...], ...], typing.Tuple[str, typing.List[str], typing.List[str]]] = {}
+        for (package, call) in calls:
+            try:
+                (call_tokens, package_tokens) = (shlex.split(call), shlex.split(package))
+            except ValueError:
+                (call_tokens, package_tokens) = ([], [])
+            package_positions = [
+                position for (position, call_token) in enumerate(call_tokens) if [call_token] == package_tokens]
+            if len(package_positions) == 1:
+                merge_key: typing.Tuple[typing.Tuple[str, ...], ...] = (
+                    tuple(call_tokens[:package_positions[0]]), tuple(call_tokens[package_positions[0] + 1:]))
+            else:
+                merge_key = ((call, ), )
+            (_, merged_packages, merged_package_tokens) = merged_calls.setdefault(merge_key, (call, [], []))
+            merged_packages.append(package)
+            merged_package_tokens.extend(package_tokens)
+        return [
+            (merged_packages, call if len(merge_key) == 1 or len(merged_packages) == 1 else shlex.join(
+                [*merge_key[0], *merged_package_tokens, *merge_key[1]]))
+            for (merge_key, (call, merged_packages, merged_package_tokens)) in merged_calls.items()
+        ]
+
+    def _run_streamed(
+        self, call: str, output_callback: typing.Optional[typing.Callable[[str], None]]
+    ) -> typing.Tuple[int, str]:
+        """Run a call, passing each line of its combined standard output and error to output_callback."""
+        output_lines = []
+        with subprocess.Popen(
+            call, shell=True, env=self.env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        ) as process:
+            assert process.stdout is not None
+            for line in process.stdout:
+                output_lines.append(line)
+                if output_callback is not None:
+                    output_callback(line.rstrip("\n"))
+        return (process.returncode, "".join(output_lines))
+
 
 def assert_package_import_success_without_local_packages(package: str, package_path: str) -> None:
     """Assert that the package imports correctly without any local packages."""
@@ -210,34 +543,63 @@ def assert_package_import_errors_with_local_packages(
     """Assert that a package fails to import with local packages, but imports successfully when they are uninstalled."""
     with VirtualEnv() as virtual_env:
         # Part 1: assert that the package fails to import with local packages
-        dependencies_local_paths = []
-        for (dependency_import_name, dependency_pypi_name) in zip(dependencies_import_name, dependencies_pypi_name):
-            virtual_env.install_package(dependency_pypi_name, pip_install_call)
-            dependency_local_path = str(virtual_env.dist_path / dependency_import_name / "__init__.py")
-            assert_package_location(virtual_env.executable, dependency_import_name, dependency_local_path)
-            dependencies_local_paths.append(dependency_local_path)
-        dependencies_error_messages = [
-            f"* {dependency_import_name} was imported from a local path: expected in"
-            for dependency_import_name in dependencies_import_name
-        ]
-        dependencies_pypi_name_only = [
-            dependency_pypi_name.replace("'", "").split("@")[0].strip()  # from 'name @ git+url' to name
-            for dependency_pypi_name in dependencies_pypi_name
-        ]
-        dependencies_error_messages.extend(
-            f"* run '{pip_uninstall_call(virtual_env.executable, dependency_pypi_name, dependency_local_path)}' in"
-            for (dependency_pypi_name, dependency_local_path) in zip(
-                dependencies_pypi_name_only, dependencies_local_paths)
-        )
-        dependencies_error_messages.extend(dependencies_extra_error_message)
-        assert_package_import_error(virtual_env.executable, package, dependencies_error_messages, [], True)
+        dependencies_local_paths = _install_local_packages(
+            virtual_env, dependencies_import_name, dependencies_pypi_name, pip_install_call)
+        _assert_package_import_errors_with_installed_local_packages(
+            virtual_env.executable, package, dependencies_import_name, dependencies_pypi_name,
+            dependencies_extra_error_message, pip_uninstall_call, dependencies_local_paths)
         # Part 2: assert that the package imports successfully as soon as local packages are uninstalled
-        for (dependency_pypi_name, dependency_local_path) in zip(dependencies_pypi_name_only, dependencies_local_paths):
-            virtual_env.uninstall_package(
-                dependency_pypi_name, dependency_local_path, _force_yes_in_pip_uninstall_call(pip_uninstall_call))
+        _uninstall_local_packages(virtual_env, dependencies_pypi_name, dependencies_local_paths, pip_uninstall_call)
         assert_has_package(virtual_env.executable, package)
 
 
+def _install_local_packages(
+    virtual_env: VirtualEnv, dependencies_import_name: typing.List[str], dependencies_pypi_name: typing.List[str],
+    pip_install_call: typing.Callable[[str, str], str]
+) -> typing.List[str]:
+    """Install local packages in a virtual environment, and return the path they are imported from."""
+    virtual_env.install_packages(dependencies_pypi_name, pip_install_call)
+    dependencies_local_paths = []
+    for dependency_import_name in dependencies_import_name:
+        dependency_local_path = str(virtual_env.dist_path / dependency_import_name / "__init__.py")
+        assert_package_location(virtual_env.executable, dependency_import_name, dependency_local_path)
+        dependencies_local_paths.append(dependency_local_path)
+    return dependencies_local_paths
+
+
+def _pypi_name_only(dependency_pypi_name: str) -> str:
+    """Strip the URL from a pypi name, i.e. from 'name @ git+url' to name."""
+    return dependency_pypi_name.replace("'", "").split("@")[0].strip()
+
+
+def _assert_package_import_errors_with_installed_local_packages(
+    executable: str, package: str, dependencies_import_name: typing.List[str], dependencies_pypi_name: typing.List[str],
+    dependencies_extra_error_message: typing.List[str], pip_uninstall_call: typing.Callable[[str, str, str], str],
+    dependencies_local_paths: typing.List[str]
+) -> None:
+    """Assert that a package fails to import when local packages have already been installed."""
+    dependencies_error_messages = [
+        f"* {dependency_import_name} was imported from a local path: expected in"
+        for dependency_import_name in dependencies_import_name
+    ]
+    dependencies_error_messages.extend(
+        f"* run '{pip_uninstall_call(executable, _pypi_name_only(dependency_pypi_name), dependency_local_path)}' in"
+        for (dependency_pypi_name, dependency_local_path) in zip(dependencies_pypi_name, dependencies_local_paths)
+    )
+    dependencies_error_messages.extend(dependencies_extra_error_message)
+    assert_package_import_error(executable, package, dependencies_error_messages, [], True)
+
+
+def _uninstall_local_packages(
+    virtual_env: VirtualEnv, dependencies_pypi_name: typing.List[str], dependencies_local_paths: typing.List[str],
+    pip_uninstall_call: typing.Callable[[str, str, str], str]
+) -> None:
+    """Uninstall local packages from a virtual environment, even if pip_uninstall_call would ask for confirmation."""
+    virtual_env.uninstall_packages(
+        [_pypi_name_only(dependency_pypi_name) for dependency_pypi_name in dependencies_pypi_name],
+        dependencies_local_paths, _force_yes_in_pip_uninstall_call(pip_uninstall_call))
+
+
 def _force_yes_in_pip_uninstall_call(
     pip_uninstall_call: typing.Callable[[str, str, str], str]
 ) -> typing.Callable[[str, str, str], str]:
@@ -257,12 +619,7 @@ def assert_package_import_success_with_allowed_local_packages(
 ) -> None:
     """Assert that a package imports correctly even with extra local packages when asked to allow user-site imports."""
     with VirtualEnv() as virtual_env:
-        for (dependency_import_name, dependency_pypi_name) in zip(dependencies_import_name, dependencies_pypi_name):
-            virtual_env.install_package(dependency_pypi_name, pip_install_call)
-            assert_package_location(
-                virtual_env.executable, dependency_import_name,
-                str(virtual_env.dist_path / dependency_import_name / "__init__.py")
-            )
+        _install_local_packages(virtual_env, dependencies_import_name, dependencies_pypi_name, pip_install_call)
         with TemporarilyEnableEnvironmentVariable(f"{package}_allow_user_site_imports".upper()):
             assert_package_location(virtual_env.executable, package, package_path)
 
@@ -272,40 +629,231 @@ def assert_package_import_errors_with_broken_non_optional_packages(
 ) -> None:
     """Assert that a package fails to import when non-optional packages are broken."""
     with VirtualEnv() as virtual_env:
-        for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional):
-            if not dependency_optional:
-                virtual_env.break_package(dependency_import_name)
-                assert_package_import_error(
-                    virtual_env.executable, dependency_import_name,
-                    [f"{dependency_import_name} was purposely broken."], [], False
-                )
-        dependencies_expected_error_messages = [
-            f"* {dependency_import_name} is broken"
+        _break_packages(virtual_env, [
+            dependency_import_name
             for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional)
             if not dependency_optional
-        ]
-        dependencies_not_expected_error_messages = [
-            f"* {dependency_import_name} is broken"
-            for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional)
-            if dependency_optional
-        ]
+        ])
+        _assert_package_import_errors_with_broken_packages(
+            virtual_env.executable, package, dependencies_import_name, dependencies_optional)
+
+
+def _break_packages(virtual_env: VirtualEnv, dependencies_import_name: typing.List[str]) -> None:
+    """Install mock packages in a virtual environment which error out, and check that they do."""
+    for dependency_import_name in dependencies_import_name:
+        virtual_env.break_package(dependency_import_name)
         assert_package_import_error(
-            virtual_env.executable, package, dependencies_expected_error_messages,
-            dependencies_not_expected_error_messages, True
+            virtual_env.executable, dependency_import_name, [f"{dependency_import_name} was purposely broken."], [],
+            False
         )
 
 
+def _assert_package_import_errors_with_broken_packages(
+    executable: str, package: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool]
+) -> None:
+    """Assert that a package fails to import when non-optional packages have already been broken."""
+    dependencies_expected_error_messages = [
+        f"* {dependency_import_name} is broken"
+        for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional)
+        if not dependency_optional
+    ]
+    dependencies_not_expected_error_messages = [
+        f"* {dependency_import_name} is broken"
+        for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional)
+        if dependency_optional
+    ]
+    assert_package_import_error(
+        executable, package, dependencies_expected_error_messages, dependencies_not_expected_error_messages, True
+    )
+
+
 def assert_package_import_success_with_broken_optional_packages(
     package: str, package_path: str, dependencies_import_name: typing.List[str],
     dependencies_optional: typing.List[bool]
 ) -> None:
     """Assert that a package imports correctly when optional packages are broken."""
     with VirtualEnv() as virtual_env:
-        for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional):
-            if dependency_optional:
-                virtual_env.break_package(dependency_import_name)
-                assert_package_import_error(
-                    virtual_env.executable, dependency_import_name,
-                    [f"{dependency_import_name} was purposely broken."], [], False
-                )
+        _break_packages(virtual_env, [
+            dependency_import_name
+            for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional)
+            if dependency_optional
+        ])
         assert_package_location(virtual_env.executable, package, package_path)
+
+
+# A scenario case is one of the assert_package_* helpers above, together with the arguments to be passed to it.
+ScenarioCase = typing.Tuple[typing.Callable[..., None], typing.Tuple[typing.Any, ...]]
+
+
+def run_scenario_matrix(
+    cases: typing.List[ScenarioCase], max_workers: typing.Optional[int] = None
+) -> typing.List[typing.Optional[Exception]]:
+    """
+    Evaluate several scenario cases, sharing virtual environments between cases which require the same state.
+
+    Evaluating a case is equivalent to calling its helper with its arguments. However, rather than creating
+    a new virtual environment for each case, cases are grouped by the state of the virtual environment they
+    require, i.e. which local packages are installed and which packages are broken. Each distinct state is
+    created only once, and all cases requiring it are evaluated concurrently, each one in its own interpreter.
+    Local packages are uninstalled, as required by assert_package_import_errors_with_local_packages, only after
+    all other cases requiring the same state have been evaluated, once for each distinct uninstallation call.
+
+    Parameters
+    ----------
+    cases
+        The cases to be evaluated.
+    max_workers
+        The maximum number of cases evaluated at the same time.
+
+    Returns
+    -------
+    :
+        A list of the same length as cases, which stores at each position either None, if the case was
+        evaluated successfully, or the exception raised while evaluating it.
+    """
+    states: typing.Dict[typing.Tuple[typing.Any, ...], typing.List[int]] = {}
+    for (case_id, (helper, arguments)) in enumerate(cases):
+        states.setdefault(_scenario_state(helper, arguments), []).append(case_id)
+    results: typing.List[typing.Optional[Exception]] = [None] * len(cases)
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        for (state, state_case_ids) in states.items():
+            state_results = _run_scenario_state(state, [cases[case_id] for case_id in state_case_ids], executor)
+            for (case_id, result) in zip(state_case_ids, state_results):
+                results[case_id] = result
+    return results
+
+
+def _run_scenario_state(
+    state: typing.Tuple[typing.Any, ...], cases: typing.List[ScenarioCase],
+    executor: concurrent.futures.ThreadPoolExecutor
+) -> typing.List[typing.Optional[Exception]]:
+    """Create a state of the virtual environment, and evaluate all cases which require it."""
+    if state[0] == "system":
+        return list(executor.map(lambda case: _call_and_catch(case[0], *case[1]), cases))
+    with VirtualEnv() as virtual_env:
+        dependencies_local_paths: typing.Dict[str, str] = {}
+        try:
+            if state[0] == "local":
+                (dependencies_import_name, dependencies_pypi_name, pip_install_call) = _scenario_local_packages(
+                    *cases[0])
+                dependencies_local_paths.update(zip(dependencies_import_name, _install_local_packages(
+                    virtual_env, dependencies_import_name, dependencies_pypi_name, pip_install_call)))
+            else:
+                _break_packages(virtual_env, list(state[1]))
+        except Exception as state_error:
+            return [state_error] * len(cases)
+        results = list(executor.map(
+            lambda case: _call_and_catch(
+                _evaluate_scenario_case, case[0], case[1], virtual_env.executable, dependencies_local_paths),
+            cases))
+        # Uninstall local packages once for each distinct uninstallation command, and then check that the package
+        # of each case imports successfully. Uninstallation calls are compared by the commands they generate,
+        # since they are typically lambdas, and local packages are installed again before each further command.
+        uninstall_case_ids: typing.Dict[typing.Tuple[str, ...], typing.List[int]] = {}
+        for (case_id, case) in enumerate(cases):
+            if case[0] is assert_package_import_errors_with_local_packages and results[case_id] is None:
+                (_, dependencies_import_name, dependencies_pypi_name, _, _, pip_uninstall_call) = case[1]
+                uninstall_case_ids.setdefault(tuple(sorted(
+                    pip_uninstall_call(
+                        "{executable}", _pypi_name_only(dependency_pypi_name),
+                        dependencies_local_paths[dependency_import_name])
+                    for (dependency_import_name, dependency_pypi_name) in zip(
+                        dependencies_import_name, dependencies_pypi_name)
+                )), []).append(case_id)
+        for (uninstall_pass, pass_case_ids) in enumerate(uninstall_case_ids.values()):
+            (_, dependencies_import_name, dependencies_pypi_name, _, pip_install_call, pip_uninstall_call) = cases[
+                pass_case_ids[0]][1]
+            uninstall_error: typing.Optional[Exception] = None
+            pass_results: typing.List[typing.Optional[Exception]]
+            if uninstall_pass > 0:
+                uninstall_error = _call_and_catch(
+                    virtual_env.install_packages, dependencies_pypi_name, pip_install_call)
+            uninstall_error = uninstall_error or _call_and_catch(
+                _uninstall_local_packages, virtual_env, dependencies_pypi_name,
+                [dependencies_local_paths[import_name] for import_name in dependencies_import_name], pip_uninstall_call)
+            if uninstall_error is not None:
+                pass_results = [uninstall_error] * len(pass_case_ids)
+            else:
+                pass_results = list(executor.map(
+                    lambda case_id: _call_and_catch(assert_has_package, virtual_env.executable, cases[case_id][1][0]),
+                    pass_case_ids))
+            for (case_id, result) in zip(pass_case_ids, pass_results):
+                results[case_id] = result
+        return results
+
+
+def _call_and_catch(
+    function: typing.Callable[..., None], *arguments: typing.Any  # noqa: ANN401
+) -> typing.Optional[Exception]:
+    """Call a function, and return the exception it raised, if any."""
+    try:
+        function(*arguments)
+    except Exception as error:
+        return error
+    else:
+        return None
+
+
+def _scenario_local_packages(
+    helper: typing.Callable[..., None], arguments: typing.Tuple[typing.Any, ...]
+) -> typing.Tuple[typing.List[str], typing.List[str], typing.Callable[[str, str], str]]:
+    """Return import name, pypi name and installation call of the local packages required by a case."""
+    if helper is assert_package_import_errors_with_local_packages:
+        return (arguments[1], arguments[2], arguments[4])
+    else:
+        assert helper is assert_package_import_success_with_allowed_local_packages
+        return (arguments[2], arguments[3], arguments[4])
+
+
+def _scenario_state(
+    helper: typing.Callable[..., None], arguments: typing.Tuple[typing.Any, ...]
+) -> typing.Tuple[typing.Any, ...]:
+    """Return a hashable description of the state of the virtual environment required by a case."""
+    if helper is assert_package_import_success_without_local_packages:
+        return ("system", )
+    elif helper in (
+        assert_package_import_errors_with_local_packages, assert_package_import_success_with_allowed_local_packages
+    ):
+        (dependencies_import_name, dependencies_pypi_name, pip_install_call) = _scenario_local_packages(
+            helper, arguments)
+        # Installation calls are compared by the command they generate, since they are typically lambdas
+        return ("local", tuple(sorted(
+            (dependency_import_name, pip_install_call("{executable}", dependency_pypi_name))
+            for (dependency_import_name, dependency_pypi_name) in zip(dependencies_import_name, dependencies_pypi_name)
+        )))
+    else:
+        assert helper in (
+            assert_package_import_errors_with_broken_non_optional_packages,
+            assert_package_import_success_with_broken_optional_packages
+        ), f"Unsupported scenario helper {helper.__name__}"
+        broken_optional = helper is assert_package_import_success_with_broken_optional_packages
+        (dependencies_import_name, dependencies_optional) = arguments[-2:]
+        return ("broken", tuple(sorted(
+            dependency_import_name
+            for (dependency_import_name, dependency_optional) in zip(dependencies_import_name, dependencies_optional)
+            if dependency_optional == broken_optional
+        )))
+
+
+def _evaluate_scenario_case(
+    helper: typing.Callable[..., None], arguments: typing.Tuple[typing.Any, ...], executable: str,
+    dependencies_local_paths: typing.Dict[str, str]
+) -> None:
+    """Evaluate a case in a virtual environment in which the required state has already been created."""
+    if helper is assert_package_import_errors_with_local_packages:
+        (package, dependencies_import_name, dependencies_pypi_name, dependencies_extra_error_message, _,
+         pip_uninstall_call) = arguments
+        _assert_package_import_errors_with_installed_local_packages(
+            executable, package, dependencies_import_name, dependencies_pypi_name, dependencies_extra_error_message,
+            pip_uninstall_call,
+            [dependencies_local_paths[dependency_import_name] for dependency_import_name in dependencies_import_name])
+    elif helper is assert_package_import_success_with_allowed_local_packages:
+        # The environment variable is only set in the environment of the child process, since other cases
+        # are being evaluated at the same time
+        env = dict(os.environ)
+        env[f"{arguments[0]}_allow_user_site_imports".upper()] = "enabled"
+        assert_package_location(executable, arguments[0], arguments[1], env)
+    elif helper is assert_package_import_errors_with_broken_non_optional_packages:
+        _assert_package_import_errors_with_broken_packages(executable, *arguments)
+    else:
+        assert_package_location(executable, arguments[0], arguments[1])
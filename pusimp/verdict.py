@@ -0,0 +1,73 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Verdict tokens, which allow child processes to inherit a successful check from their parent.
+
+When a check succeeds, a token is published in the environment. Child processes, either forked or spawned,
+inherit the environment, and can skip the check by recomputing the token and comparing it with the inherited one.
+The token is a digest of the check configuration and of the state which determines where dependencies are imported
+from, namely the interpreter, sys.path and the state of the user site, including the distributions installed in it,
+so any difference in such state invalidates the token. Note that the token is not meant as a security measure:
+the check can anyway be disabled by exporting the {PACKAGE_NAME}_ALLOW_USER_SITE_IMPORTS environment variable.
+"""
+
+import hashlib
+import json
+import os
+import site
+import sys
+import typing
+
+_TOKEN_VERSION = "pusimp-verdict-2"
+
+
+def verdict_environment_variable(package_name: str) -> str:
+    """Return the name of the environment variable in which the verdict token of a package is published."""
+    return f"{package_name}_user_site_imports_verdict".upper()
+
+
+def compute_verdict_token(check_configuration: typing.Sequence[typing.Any]) -> str:
+    """
+    Compute the verdict token of a check in the current interpreter.
+
+    Parameters
+    ----------
+    check_configuration
+        A JSON-serializable sequence which identifies the check, e.g. the expected prefix, the import names
+        and optional flags of the dependencies, and the check tier.
+
+    Returns
+    -------
+    :
+        A short string, which changes whenever the check configuration, the interpreter, sys.path or the state
+        of the user site change.
+    """
+    user_site = getattr(site, "USER_SITE", None)
+    try:
+        user_site_mtime: typing.Optional[int] = os.stat(user_site).st_mtime_ns  # type: ignore[arg-type]
+    except (OSError, TypeError):
+        user_site_mtime = None
+    fingerprint = json.dumps([
+        _TOKEN_VERSION, list(check_configuration), sys.executable, sys.path, sys.flags.no_user_site,
+        getattr(site, "ENABLE_USER_SITE", None), user_site, user_site_mtime, _distribution_entries(user_site)
+    ])
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+
+
+def _distribution_entries(directory: typing.Optional[str]) -> typing.List[str]:
+    """
+    Return the sorted names of the dist-info and egg-info entries of a directory.
+
+    The names complement the modification time of the directory, which may not change when a distribution is
+    installed within the same tick on filesystems with coarse timestamps (e.g., NFS).
+    """
+    if directory is None:
+        return []
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(entry for entry in entries if entry.endswith((".dist-info", ".egg-info")))
+
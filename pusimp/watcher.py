@@ -0,0 +1,232 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Revalidate the dependencies of a guard whenever the directories they may be imported from change.
+
+Long-running interpreters (e.g., Jupyter kernels or services) are guarded only once, when the package is imported,
+while users may later install packages into the user site. A watcher subscribes to inotify events on the user site,
+on the expected prefix and on the other entries of sys.path, and blocks in a background thread until an entry is
+created, deleted, moved or rewritten. Only the dependencies whose name matches the changed entries (e.g., a package
+directory, a single-file module, an extension module or a .dist-info directory) are checked again, while changes
+to .pth files affect every dependency. inotify is accessed through ctypes, so that no third-party dependency is
+required, and is only available on Linux.
+
+Note that dependencies which were already imported are reported at the location they were imported from, since
+that is the module which the interpreter keeps using: revalidation is meant to catch problems with dependencies
+which are not imported yet, e.g. optional dependencies or dependencies which are imported lazily.
+"""
+
+import ctypes
+import importlib
+import os
+import re
+import select
+import site
+import struct
+import sys
+import threading
+import typing
+
+from pusimp.prevent_user_site_imports import _find_problems, _report_problems, Guard
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_WATCH_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+    | _IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class GuardWatcher:
+    """
+    Watch the directories from which the dependencies of a guard may be imported, and revalidate them on changes.
+
+    Parameters
+    ----------
+    guard
+        The guard whose dependencies are revalidated.
+    report_problems
+        A callable which is called, from the background thread, with the text of the error message whenever
+        revalidation finds a problem. If not provided, a warning is emitted once per distinct error message,
+        since an ImportError raised in a background thread would not reach the user.
+    settle_time
+        The number of seconds to wait for further events after the first one, so that the many events generated
+        by a single installation are handled together.
+    """
+
+    def __init__(
+        self, guard: Guard, report_problems: typing.Optional[typing.Callable[[str], None]] = None,
+        settle_time: float = 0.1
+    ) -> None:
+        self._guard = guard
+        if report_problems is None:
+            def report_problems(import_error: str) -> None:
+                _report_problems(guard.package_name, "warn_once", import_error, 4)
+        self._report_problems = report_problems
+        self._settle_time = settle_time
+        self._dependencies_name = [
+            {dependency_import_name.lower(), _normalize(dependency_pypi_name)}
+            for (dependency_import_name, dependency_pypi_name) in zip(
+                guard.dependencies_import_name, guard.dependencies_pypi_name)
+        ]
+        self._inotify_fd = -1
+        self._stop_fds = (-1, -1)
+        self._watches: typing.Dict[int, typing.Tuple[str, bool]] = {}
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def __enter__(self) -> "GuardWatcher":
+        """Start watching."""
+        self.start()
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:  # noqa: ANN401
+        """Stop watching."""
+        self.stop()
+
+    def start(self) -> None:
+        """Subscribe to inotify events, and start the background thread which handles them."""
+        assert self._thread is None, "The watcher was already started"
+        (self._inotify_fd, self._add_watch) = _inotify()
+        self._stop_fds = os.pipe()
+        self._add_watches()
+        self._thread = threading.Thread(
+            target=self._run, name=f"pusimp-watcher-{self._guard.package_name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread, and unsubscribe from inotify events."""
+        if self._thread is not None:
+            os.write(self._stop_fds[1], b"\0")
+            self._thread.join()
+            self._thread = None
+            for fd in (self._inotify_fd, *self._stop_fds):
+                os.close(fd)
+            self._watches.clear()
+
+    def watched_directories(self) -> typing.List[str]:
+        """Return the directories which are currently watched."""
+        return sorted(directory for (directory, _) in self._watches.values())
+
+    def _add_watches(self) -> None:
+        """
+        Watch the expected prefix, the user site and every directory in sys.path.
+
+        If the user site does not exist yet, its closest existing ancestor is watched instead, and any change
+        to it affects every dependency. Adding a watch on a directory which is already watched has no effect.
+        """
+        directories = [(self._guard.dependencies_expected_prefix, False)]
+        user_site = getattr(site, "USER_SITE", None)
+        if user_site is not None:
+            user_site_ancestor = user_site
+            while not os.path.isdir(user_site_ancestor) and os.path.dirname(user_site_ancestor) != user_site_ancestor:
+                user_site_ancestor = os.path.dirname(user_site_ancestor)
+            directories.append((user_site_ancestor, user_site_ancestor != user_site))
+        directories.extend((sys_path_entry or os.getcwd(), False) for sys_path_entry in sys.path)
+        for (directory, is_ancestor) in directories:
+            if os.path.isdir(directory):
+                watch_descriptor = self._add_watch(self._inotify_fd, os.fsencode(directory), _WATCH_MASK)
+                if watch_descriptor >= 0 and (watch_descriptor not in self._watches or is_ancestor):
+                    self._watches[watch_descriptor] = (directory, is_ancestor)
+
+    def _run(self) -> None:
+        """Block until inotify events are available, and revalidate the affected dependencies."""
+        while True:
+            (ready_fds, _, _) = select.select([self._inotify_fd, self._stop_fds[0]], [], [])
+            if self._stop_fds[0] in ready_fds:
+                return
+            affected_dependencies: typing.Set[int] = set()
+            # Coalesce the burst of events which is generated by a single installation.
+            while len(ready_fds) > 0:
+                affected_dependencies.update(self._read_events())
+                (ready_fds, _, _) = select.select([self._inotify_fd], [], [], self._settle_time)
+            self._add_watches()
+            if len(affected_dependencies) > 0:
+                self._revalidate(sorted(affected_dependencies))
+
+    def _read_events(self) -> typing.Set[int]:
+        """Read the pending inotify events, and return the dependencies which are affected by them."""
+        affected_dependencies: typing.Set[int] = set()
+        events = os.read(self._inotify_fd, 65536)
+        offset = 0
+        while offset < len(events):
+            (watch_descriptor, mask, _, name_length) = _EVENT_HEADER.unpack_from(events, offset)
+            name = os.fsdecode(events[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + name_length].rstrip(
+                b"\0"))
+            offset += _EVENT_HEADER.size + name_length
+            (_, is_ancestor) = self._watches.get(watch_descriptor, ("", True))
+            if mask & (_IN_Q_OVERFLOW | _IN_IGNORED | _IN_DELETE_SELF | _IN_MOVE_SELF) or is_ancestor:
+                if mask & _IN_IGNORED:
+                    self._watches.pop(watch_descriptor, None)
+                affected_dependencies.update(range(len(self._dependencies_name)))
+            else:
+                affected_dependencies.update(self._affected_dependencies(name))
+        return affected_dependencies
+
+    def _affected_dependencies(self, entry_name: str) -> typing.Set[int]:
+        """Return the dependencies which may be affected by a change to an entry of a watched directory."""
+        if entry_name.endswith(".pth"):
+            return set(range(len(self._dependencies_name)))
+        entry_stem = _normalize(re.split(r"[.-]", entry_name, maxsplit=1)[0])
+        return {
+            dependency_id for (dependency_id, dependency_names) in enumerate(self._dependencies_name)
+            if entry_stem in dependency_names
+        }
+
+    def _revalidate(self, dependencies_id: typing.List[int]) -> None:
+        """Check again a subset of the dependencies, bypassing memoized verdicts, and report problems."""
+        guard = self._guard
+        if os.getenv(guard._allow_user_site_imports_env_name) is not None:
+            return
+        (check_tier, escalation_tier, failure_policy) = guard._check_arguments()
+
+        def restrict(values: typing.Sequence[typing.Any]) -> typing.List[typing.Any]:
+            return [values[dependency_id] for dependency_id in dependencies_id]
+
+        affected_guard = Guard(
+            guard.package_name, guard.system_manager, guard.contact_url, guard.dependencies_expected_prefix,
+            restrict(guard.dependencies_import_name), restrict(guard.dependencies_pypi_name),
+            restrict(guard.dependencies_optional), restrict(guard.dependencies_extra_error_message),
+            guard.pip_uninstall_call, check_tier=check_tier, escalation_tier=escalation_tier,
+            failure_policy=failure_policy,
+            dependencies_integrity_manifest=(
+                restrict(guard.dependencies_integrity_manifest)
+                if guard.dependencies_integrity_manifest is not None else None),
+            integrity_cache_path=guard.integrity_cache_path,
+            guard_transitive_dependencies=guard.guard_transitive_dependencies,
+            dependencies_version_constraint=(
+                restrict(guard.dependencies_version_constraint)
+                if guard.dependencies_version_constraint is not None else None),
+            check_wheel_tags=guard.check_wheel_tags
+        )
+        importlib.invalidate_caches()
+        import_error = _find_problems(affected_guard, check_tier, escalation_tier, failure_policy)
+        if import_error is not None:
+            self._report_problems(import_error)
+
+
+def _inotify() -> typing.Tuple[int, typing.Callable[[int, bytes, int], int]]:
+    """Initialize inotify, and return its non-blocking file descriptor together with inotify_add_watch."""
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available on this platform")
+    inotify_fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+    if inotify_fd < 0:
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    add_watch: typing.Callable[[int, bytes, int], int] = libc.inotify_add_watch
+    return inotify_fd, add_watch
+
+
+def _normalize(name: str) -> str:
+    """Normalize a distribution or import name, so that they can be compared with entries of site directories."""
+    return re.sub(r"[-_.]+", "_", name).lower()
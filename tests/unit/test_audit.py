@@ -0,0 +1,111 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the audit of python interpreters defined in pusimp.audit."""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+from pusimp.audit import audit_interpreter, audit_interpreters, discover_interpreters, main
+
+import pusimp_golden_source  # isort: skip
+
+
+def test_discover_interpreters() -> None:
+    """Test that discover_interpreters finds interpreters in bin directories, without duplicates."""
+    root = tempfile.mkdtemp()
+    try:
+        for (environment, names) in (
+            ("env_one", ["python3", "python3.99"]),
+            ("env_two", ["python3", "python3-config"]),
+            (os.path.join("too", "deep", "for", "discovery"), ["python3"])
+        ):
+            os.makedirs(os.path.join(root, environment, "bin"))
+            for name in names:
+                os.symlink(sys.executable, os.path.join(root, environment, "bin", name))
+        assert discover_interpreters([root]) == [
+            os.path.join(root, "env_one", "bin", "python3.99"), os.path.join(root, "env_two", "bin", "python3")]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_audit_interpreter_ok() -> None:
+    """Test that audit_interpreter reports no problems on correctly installed dependencies."""
+    result = audit_interpreter(
+        sys.executable, pusimp_golden_source.system_path, ["pusimp_dependency_one", "pusimp_dependency_missing"],
+        [False, True])
+    assert result == {
+        "executable": sys.executable, "version": ".".join(str(part) for part in sys.version_info[:3]),
+        "missing": {}, "broken": {}, "user_site": {}, "status": "ok"
+    }
+
+
+def test_audit_interpreter_problems(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that audit_interpreter reports missing, broken and user-site dependencies."""
+    mock_user_site_path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(mock_user_site_path, "pusimp_dependency_five"))
+    with open(os.path.join(mock_user_site_path, "pusimp_dependency_five", "__init__.py"), "w") as init_file:
+        init_file.write("print('printed while importing')")
+    monkeypatch.setenv("PYTHONPATH", mock_user_site_path)
+    try:
+        result = audit_interpreter(
+            sys.executable, pusimp_golden_source.system_path,
+            ["pusimp_dependency_missing", "pusimp_dependency_four", "pusimp_dependency_five"], [False, False, False])
+    finally:
+        shutil.rmtree(mock_user_site_path, ignore_errors=True)
+    assert result["status"] == "problems"
+    assert result["missing"] == {
+        "pusimp_dependency_missing": os.path.join(
+            pusimp_golden_source.system_path, "pusimp_dependency_missing", "__init__.py")
+    }
+    assert result["broken"] == {"pusimp_dependency_four": "pusimp_dependency_four is a broken package."}
+    assert result["user_site"] == {
+        "pusimp_dependency_five": os.path.join(mock_user_site_path, "pusimp_dependency_five", "__init__.py")
+    }
+
+
+def test_audit_interpreter_error() -> None:
+    """Test that audit_interpreter reports an error when the interpreter cannot carry out the audit."""
+    for (executable, timeout) in (
+        ("/not/existing/python3", None), (shutil.which("false"), None), (sys.executable, 1e-6)
+    ):
+        assert executable is not None
+        result = audit_interpreter(executable, pusimp_golden_source.system_path, [], [], timeout)
+        assert result["executable"] == executable
+        assert result["status"] == "error"
+        assert "error" in result
+
+
+def test_audit_interpreters() -> None:
+    """Test that audit_interpreters yields a result for every interpreter."""
+    executables = [sys.executable, "/not/existing/python3"]
+    results = list(audit_interpreters(
+        executables, pusimp_golden_source.system_path, ["pusimp_dependency_one"], [False], max_workers=2))
+    assert sorted(result["executable"] for result in results) == sorted(executables)
+    assert sorted(result["status"] for result in results) == ["error", "ok"]
+
+
+def test_main(capsys: pytest.CaptureFixture[str]) -> None:
+    """Test that the command line interface streams NDJSON results and sets the exit code."""
+    assert main([
+        "--prefix", pusimp_golden_source.system_path, "--dependency", "pusimp_dependency_one",
+        "--optional-dependency", "pusimp_dependency_missing", "--interpreter", sys.executable
+    ]) == 0
+    assert main([
+        "--prefix", pusimp_golden_source.system_path, "--dependency", "pusimp_dependency_missing",
+        "--interpreter", sys.executable, "--discover", os.path.dirname(os.path.dirname(sys.executable))
+    ]) == 1
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(results) >= 3
+    assert results[0]["status"] == "ok"
+    assert sys.executable in [result["executable"] for result in results[1:]]
+    assert all(result["status"] == "problems" for result in results[1:])
+    with pytest.raises(SystemExit):
+        main(["--prefix", pusimp_golden_source.system_path])
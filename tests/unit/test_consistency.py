@@ -0,0 +1,153 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the version and wheel tags consistency check defined in pusimp.consistency."""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+import pusimp
+from pusimp.consistency import _compatible_wheel_tag, check_dependencies_consistency, version_satisfies
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+@pytest.mark.parametrize(
+    "version,specifiers,expected",
+    [
+        ("0.8.0", ">=0.8,<0.9", True),
+        ("0.9.0", ">=0.8,<0.9", False),
+        ("0.9.0.dev1", "<0.9", False),
+        ("0.9.0rc1", "<0.9", False),
+        ("0.9.0rc1", "<0.9rc2", True),
+        ("0.8.1rc1", "<0.9", True),
+        ("0.9.0rc1", ">0.9.0a2", True),
+        ("0.9.0.post1", ">0.9", False),
+        ("0.9.0.post2", ">0.9.post1", True),
+        ("0.9.1", ">0.9", True),
+        ("0.9.0.dev1", "<0.9.0a1", True),
+        ("1!0.1", ">2.0", True),
+        ("2019.1.0", "==2019.1.*", True),
+        ("2019.2.0", "==2019.1.*", False),
+        ("2019", "==2019.0.*", True),
+        ("2019.1.0+debian", "!=2019.1.*", False),
+        ("2019.1.0", "== 2019.1", True),
+        ("0.7.2", "~=0.7.0", True),
+        ("0.8.0", "~=0.7.0", False),
+        ("1.2", "~=1.0", True),
+        ("2019.1.0", "===2019.1.0", True),
+        ("2019.1", "===2019.1.0", False),
+        ("not-a-version", "==not-a-version", True),
+        ("not-a-version", ">=1.0", False),
+        ("1.0-1", ">=1.0", True),
+        ("1.0-1", "==1.0.post1", True),
+        ("1.0+local", "==1.0", True),
+        ("1.0", "==1.0+local", False),
+        ("1.0+local.2", "==1.0+local", False),
+        ("1.0+Local.01", "==1.0+local.1", True),
+        ("1.0+other", "!=1.0+local", True),
+        ("1.0a1", "<1.0.post1", True),
+        ("1.0a1", "<1.0", False),
+        ("1.0.post1", ">1.0a1", True),
+        ("1.0.post1", ">1.0.dev1", True),
+        ("1.0.post1.dev1", ">1.0", False),
+        ("1!1.1", "~=1!1.0", True)
+    ]
+)
+def test_version_satisfies(version: str, specifiers: str, expected: bool) -> None:
+    """Test version_satisfies on a few PEP 440 specifiers."""
+    assert version_satisfies(version, specifiers) is expected
+
+
+@pytest.mark.parametrize("specifiers", ["1.0", "~=1", ">=1.0;python_version>'3'", "==not-a-version.*"])
+def test_version_satisfies_invalid(specifiers: str) -> None:
+    """Test that invalid specifiers are rejected."""
+    with pytest.raises(AssertionError):
+        version_satisfies("1.0", specifiers)
+
+
+def test_compatible_wheel_tag() -> None:
+    """Test that wheel tags are checked against the python version and ABI of the running interpreter."""
+    (major, minor) = sys.version_info[:2]
+    assert _compatible_wheel_tag("py3-none-any")
+    assert _compatible_wheel_tag(f"py2.py{major}-none-any")
+    assert _compatible_wheel_tag(f"cp{major}{minor}-cp{major}{minor}{sys.abiflags}-linux_x86_64")
+    assert _compatible_wheel_tag(f"cp{major}{minor - 1}-abi3-linux_x86_64")
+    assert not _compatible_wheel_tag(f"cp{major}{minor + 1}-abi3-linux_x86_64")
+    assert not _compatible_wheel_tag(f"cp{major}{minor + 1}-cp{major}{minor + 1}-linux_x86_64")
+    assert not _compatible_wheel_tag("py2-none-any")
+    assert not _compatible_wheel_tag("not_a_tag")
+
+
+def test_check_dependencies_consistency() -> None:
+    """Test that the distribution found first on sys.path is checked, without being imported."""
+    (major, minor) = sys.version_info[:2]
+    site_path = tempfile.mkdtemp()
+    try:
+        dist_info = os.path.join(site_path, "pusimp_consistency_binary-1.0.dist-info")
+        os.makedirs(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as metadata_file:
+            metadata_file.write("Metadata-Version: 2.1\nName: pusimp-consistency-binary\nVersion: 1.0\n")
+        with open(os.path.join(dist_info, "WHEEL"), "w") as wheel_file:
+            wheel_file.write(f"Wheel-Version: 1.0\nTag: cp{major}{minor + 1}-cp{major}{minor + 1}-linux_x86_64\n")
+        egg_info = os.path.join(site_path, "pusimp_consistency_egg-1.0.egg-info")
+        os.makedirs(egg_info)
+        with open(os.path.join(egg_info, "PKG-INFO"), "w") as metadata_file:
+            metadata_file.write("Metadata-Version: 2.1\nName: pusimp-consistency-egg\nVersion: 1.0\n")
+        with ImportSandbox():
+            sys.path.insert(0, site_path)
+            # Other tests may have already imported the dependency
+            sys.modules.pop("pusimp_dependency_one", None)
+            assert check_dependencies_consistency(
+                ["pusimp-consistency-binary", "pusimp-dependency-one", "pusimp-consistency-missing"],
+                [">=1.0", ">=0.1", ">=1.0"]
+            ) == [None, {
+                "location": pusimp_golden_source.system_path,
+                "problem": f"has version 0.1.dev2 in {pusimp_golden_source.system_path}, which does not satisfy >=0.1"
+            }, None]
+            assert check_dependencies_consistency(
+                ["pusimp-consistency-binary", "pusimp-dependency-one", "pusimp-consistency-egg"], [None, None, None],
+                True
+            ) == [{
+                "location": site_path,
+                "problem": (
+                    f"has wheel tags cp{major}{minor + 1}-cp{major}{minor + 1}-linux_x86_64 in {site_path}, "
+                    f"which are not compatible with cp{major}{minor}")
+            }, None, None]
+            assert "pusimp_dependency_one" not in sys.modules
+    finally:
+        shutil.rmtree(site_path, ignore_errors=True)
+
+
+def test_prevent_user_site_imports_consistency() -> None:
+    """Test that pusimp.prevent_user_site_imports reports dependencies which do not satisfy their constraint."""
+    guard_arguments = (
+        "pusimp_consistency_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        pusimp_golden_source.system_path, ["pusimp_dependency_one", "pusimp_dependency_missing"],
+        ["pusimp-dependency-one", "pusimp-dependency-missing"], [False, True], ["Extra message.", ""],
+        pusimp_golden_source.pip_uninstall_call
+    )
+    with ImportSandbox():
+        pusimp.prevent_user_site_imports(*guard_arguments, check_wheel_tags=True)
+        pusimp.prevent_user_site_imports(*guard_arguments, dependencies_version_constraint=["==0.1.*", "==1.0"])
+        with pytest.raises(ImportError) as excinfo:
+            pusimp.prevent_user_site_imports(*guard_arguments, dependencies_version_constraint=[">=0.2", None])
+    import_error_text = str(excinfo.value)
+    print(f"The following ImportError was raised:\n{import_error_text}")
+    assert (
+        "1) Dependencies which are inconsistent with the requirements of pusimp_consistency_package:\n"
+        f"* pusimp_dependency_one has version 0.1.dev2 in {pusimp_golden_source.system_path}, "
+        "which does not satisfy >=0.2.\n"
+    ) in import_error_text
+    assert (
+        "1) To fix inconsistent dependencies:\n"
+        "* check how to install a version of pusimp_dependency_one consistent with pusimp_consistency_package "
+        f"with {pusimp_golden_source.system_package_manager}. Extra message.\n"
+    ) in import_error_text
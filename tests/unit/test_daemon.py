@@ -0,0 +1,303 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.daemon on a mock user site, with clients simulated in the test process."""
+
+import importlib
+import json
+import os
+import pathlib
+import signal
+import site
+import socket
+import sys
+import threading
+import time
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.daemon
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+def create_guard(**kwargs: typing.Any) -> pusimp.Guard:  # noqa: ANN401
+    """Create a guard on a mock package installed in the system path."""
+    return pusimp.Guard(
+        "pusimp_daemon_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        pusimp_golden_source.system_path, ["pusimp_dependency_one"], ["pusimp-dependency-one"], [False], [""],
+        pusimp_golden_source.pip_uninstall_call, check_tier="spec", **kwargs)
+
+
+@pytest.fixture
+def user_site(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> typing.Iterator[pathlib.Path]:
+    """Prepare an import sandbox with a mock user site in front of the system path."""
+    user_site_path = tmp_path / "user_site"
+    user_site_path.mkdir()
+    monkeypatch.setattr(site, "USER_SITE", str(user_site_path))
+    pusimp.clear_verdicts()
+    with ImportSandbox():
+        sys.path[:] = [str(user_site_path), pusimp_golden_source.system_path]
+        for module_name in [module_name for module_name in sys.modules if module_name.startswith("pusimp_dependency")]:
+            del sys.modules[module_name]
+        yield user_site_path
+    pusimp.clear_verdicts()
+
+
+@pytest.fixture
+def daemon(tmp_path: pathlib.Path) -> typing.Iterator[pusimp.daemon.VerdictDaemon]:
+    """Run a daemon listening on a socket in a temporary directory."""
+    with pusimp.daemon.VerdictDaemon(str(tmp_path / "pusimp.sock")) as verdict_daemon:
+        yield verdict_daemon
+
+
+def count_probes(monkeypatch: pytest.MonkeyPatch) -> typing.List[str]:
+    """Record the package name of every probe of the dependencies, which never reuses memoized verdicts."""
+    probes: typing.List[str] = []
+    original_diagnose = pusimp.Guard._diagnose
+
+    def _(guard: pusimp.Guard) -> typing.Tuple[typing.Optional[str], str]:
+        probes.append(guard.package_name)
+        pusimp.clear_verdicts()
+        return original_diagnose(guard)
+
+    monkeypatch.setattr(pusimp.Guard, "_diagnose", _)
+    return probes
+
+
+def wait_until(predicate: typing.Callable[[], bool]) -> None:
+    """Wait until the daemon thread makes the predicate true."""
+    deadline = time.monotonic() + 10
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_check_with_daemon(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, daemon: pusimp.daemon.VerdictDaemon
+) -> None:
+    """Test that verdicts are served from memory, and dropped when a watched directory changes."""
+    probes = count_probes(monkeypatch)
+    guard = create_guard()
+    for _ in range(3):
+        pusimp.daemon.check_with_daemon(guard, daemon.socket_path)
+    assert probes == ["pusimp_daemon_package"]
+    (user_site / "pusimp_dependency_one").mkdir()
+    (user_site / "pusimp_dependency_one" / "__init__.py").write_text("")
+    importlib.invalidate_caches()
+    wait_until(lambda: len(daemon._verdicts) == 0)
+    for _ in range(2):
+        with pytest.raises(ImportError, match="pusimp_dependency_one was imported from a local path"):
+            pusimp.daemon.check_with_daemon(guard, daemon.socket_path)
+    assert probes == ["pusimp_daemon_package"] * 2
+
+
+def test_check_with_daemon_latency(user_site: pathlib.Path, daemon: pusimp.daemon.VerdictDaemon) -> None:
+    """Test that a verdict served by the daemon is received in well under a millisecond."""
+    guard = create_guard()
+    pusimp.daemon.check_with_daemon(guard, daemon.socket_path)
+    latencies = []
+    for _ in range(50):
+        start = time.perf_counter()
+        pusimp.daemon.check_with_daemon(guard, daemon.socket_path)
+        latencies.append(time.perf_counter() - start)
+    print(f"Best latency of a verdict served by the daemon: {min(latencies) * 1e6:.0f} us")
+    assert min(latencies) < 1e-3
+
+
+def test_check_with_daemon_changed_during_probe(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, daemon: pusimp.daemon.VerdictDaemon
+) -> None:
+    """Test that a verdict is not stored when a watched directory changes while the client probes dependencies."""
+    original_diagnose = pusimp.Guard._diagnose
+    epoch = daemon._epoch
+
+    def _(guard: pusimp.Guard) -> typing.Tuple[typing.Optional[str], str]:
+        (user_site / "unrelated.py").write_text("")
+        wait_until(lambda: daemon._epoch > epoch)
+        return original_diagnose(guard)
+
+    monkeypatch.setattr(pusimp.Guard, "_diagnose", _)
+    pusimp.daemon.check_with_daemon(create_guard(), daemon.socket_path)
+    assert daemon._verdicts == {}
+
+
+def test_check_with_daemon_missing_directory(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, daemon: pusimp.daemon.VerdictDaemon,
+    tmp_path: pathlib.Path
+) -> None:
+    """Test that the closest ancestor of a missing directory is watched, and that removed directories are dropped."""
+    probes = count_probes(monkeypatch)
+    missing_directory = tmp_path / "missing" / "site"
+    sys.path.append(str(missing_directory))
+    guard = create_guard()
+    pusimp.daemon.check_with_daemon(guard, daemon.socket_path)
+    assert str(tmp_path) in daemon._watch_descriptors
+    (tmp_path / "missing").mkdir()
+    wait_until(lambda: len(daemon._verdicts) == 0)
+    pusimp.daemon.check_with_daemon(guard, daemon.socket_path)
+    assert str(tmp_path / "missing") in daemon._watch_descriptors
+    (tmp_path / "missing").rmdir()
+    wait_until(lambda: str(tmp_path / "missing") not in daemon._watch_descriptors)
+    pusimp.daemon.check_with_daemon(guard, daemon.socket_path)
+    assert probes == ["pusimp_daemon_package"] * 3
+
+
+def test_check_with_daemon_overflow(user_site: pathlib.Path, daemon: pusimp.daemon.VerdictDaemon) -> None:
+    """Test that every verdict is dropped when inotify events are lost."""
+    pusimp.daemon.check_with_daemon(create_guard(), daemon.socket_path)
+    assert len(daemon._verdicts) == 1
+    daemon._handle_event(-1, 0x00004000)
+    assert daemon._verdicts == {}
+    assert all(
+        daemon._changed_epoch[watch_descriptor] == daemon._epoch
+        for watch_descriptor in daemon._watch_descriptors.values())
+
+
+def test_check_with_daemon_fallback(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    """Test that dependencies are probed by the client when the daemon is absent, not trusted or not responsive."""
+    probes = count_probes(monkeypatch)
+    guard = create_guard()
+    socket_path = str(tmp_path / "pusimp.sock")
+    pusimp.daemon.check_with_daemon(guard, socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as unresponsive_socket:
+        unresponsive_socket.bind(socket_path)
+        unresponsive_socket.listen()
+        pusimp.daemon.check_with_daemon(guard, socket_path, timeout=0.05)
+        monkeypatch.setattr(os, "getuid", lambda: os.stat(socket_path).st_uid + 1)
+        pusimp.daemon.check_with_daemon(guard, socket_path)
+    assert probes == ["pusimp_daemon_package"] * 3
+
+
+@pytest.mark.parametrize("replies", [[b"[]\n"], [b"{}\n"], [b'{"epoch": "0"}\n'], [b'{"epoch": 0}\n', b"\n"]])
+def test_check_with_daemon_invalid_reply(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, tmp_path: pathlib.Path, replies: typing.List[bytes]
+) -> None:
+    """Test that dependencies are probed once by the client when the replies of the daemon are not valid."""
+    probes = count_probes(monkeypatch)
+    socket_path = str(tmp_path / "pusimp.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server_socket:
+        server_socket.bind(socket_path)
+        server_socket.listen()
+
+        def serve() -> None:
+            (connection, _) = server_socket.accept()
+            with connection, connection.makefile("rwb") as connection_file:
+                for reply in replies:
+                    connection_file.readline()
+                    connection_file.write(reply)
+                    connection_file.flush()
+
+        server_thread = threading.Thread(target=serve)
+        server_thread.start()
+        pusimp.daemon.check_with_daemon(create_guard(), socket_path)
+        server_thread.join()
+    assert probes == ["pusimp_daemon_package"]
+
+
+def test_check_with_daemon_not_served(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, daemon: pusimp.daemon.VerdictDaemon
+) -> None:
+    """Test that checks with the integrity tier, or disabled by the environment variable, do not use the daemon."""
+    probes = count_probes(monkeypatch)
+    pusimp.daemon.check_with_daemon(create_guard(escalation_tier="integrity"), daemon.socket_path)
+    monkeypatch.setenv("PUSIMP_DAEMON_PACKAGE_ALLOW_USER_SITE_IMPORTS", "1")
+    pusimp.daemon.check_with_daemon(create_guard(), daemon.socket_path)
+    assert probes == ["pusimp_daemon_package"]
+    assert daemon._verdicts == {}
+
+
+def test_check_with_daemon_monitor_imports(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, daemon: pusimp.daemon.VerdictDaemon
+) -> None:
+    """Test that imports are monitored after the check, if requested."""
+    started_monitors: typing.List[str] = []
+    monkeypatch.setattr(pusimp.Guard, "_start_import_monitor", lambda guard, policy: started_monitors.append(policy))
+    pusimp.daemon.check_with_daemon(create_guard(monitor_imports=True), daemon.socket_path)
+    assert started_monitors == ["raise"]
+
+
+def test_daemon_invalid_requests(daemon: pusimp.daemon.VerdictDaemon) -> None:
+    """Test that connections which send invalid requests are closed, and that the daemon keeps serving."""
+    for request in (
+        b"not json\n", b'{"key": 1, "directories": []}\n', b'{"key": "k", "directories": [1]}\n',
+        b'{"key": "k", "directories": [], "epoch": "0", "import_error": null}\n',
+        b'{"key": "k", "directories": []}\n{"key": "k", "directories": [], "epoch": 0}\n'
+    ):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+            client_socket.connect(daemon.socket_path)
+            client_socket.sendall(request)
+            client_socket.settimeout(10)
+            replies = client_socket.makefile("rb").read()
+        assert replies.count(b"\n") == request.count(b"\n") - 1
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        client_socket.connect(daemon.socket_path)
+        client_socket.sendall(b'{"key": "k", "directories": ["/"], "epoch": 0, "import_error": null}\n')
+        client_socket.sendall(b'{"key": "unwatched", "directories": [""], "epoch": 0, "import_error": null}\n')
+        client_file = client_socket.makefile("rb")
+        assert [json.loads(client_file.readline()) for _ in range(2)] == [{}, {}]
+    # Verdicts are only stored if every directory can be watched.
+    assert list(daemon._verdicts) == ["k"]
+
+
+def test_daemon_closed_connections(daemon: pusimp.daemon.VerdictDaemon) -> None:
+    """Test that connections closed by clients before reading replies are dropped."""
+    for read_reply_first in (False, True):
+        (server_socket, client_socket) = socket.socketpair()
+        with server_socket, client_socket:
+            daemon._connections[server_socket] = bytearray()
+            client_socket.sendall(b'{"key": "k", "directories": []}\n')
+            if read_reply_first:
+                # The reply is sent, and left unread in the queue of the client when it closes the connection.
+                assert daemon._serve(server_socket)
+            client_socket.close()
+            assert not daemon._serve(server_socket)
+            del daemon._connections[server_socket]
+
+
+def test_daemon_socket(tmp_path: pathlib.Path) -> None:
+    """Test that the socket is private, replaces a stale socket, and is not taken over from a running daemon."""
+    socket_path = str(tmp_path / "pusimp.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale_socket:
+        stale_socket.bind(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        with pusimp.daemon.VerdictDaemon(socket_path):
+            assert os.stat(socket_path).st_mode & 0o777 == 0o600
+            with pytest.raises(OSError, match="Another daemon is already listening"):
+                pusimp.daemon.VerdictDaemon(socket_path).start()
+            # Connections which are still open when the daemon stops are closed by the daemon.
+            client_socket.connect(socket_path)
+            client_socket.sendall(b'{"key": "k", "directories": []}\n')
+            client_file = client_socket.makefile("rb")
+            assert json.loads(client_file.readline()) == {"epoch": 0}
+        assert client_file.readline() == b""
+    assert not os.path.exists(socket_path)
+
+
+def test_daemon_socket_path(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that the default socket is stored in the node runtime directory."""
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert pusimp.daemon.VerdictDaemon().socket_path == str(tmp_path / f"pusimp-{os.getuid()}.sock")
+
+
+def test_daemon_main(tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]) -> None:
+    """Test that the daemon runs from the command line until it receives SIGTERM."""
+    socket_path = str(tmp_path / "pusimp.sock")
+
+    def terminate() -> None:
+        wait_until(lambda: os.path.exists(socket_path))
+        signal.pthread_kill(threading.main_thread().ident, signal.SIGTERM)  # type: ignore[arg-type]
+
+    terminate_thread = threading.Thread(target=terminate)
+    terminate_thread.start()
+    assert pusimp.daemon.main(["--socket", socket_path]) == 0
+    terminate_thread.join()
+    assert capsys.readouterr().out == f"Serving verdicts on {socket_path}\n"
+    assert not os.path.exists(socket_path)
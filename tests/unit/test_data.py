@@ -13,6 +13,8 @@ import tempfile
 
 import pytest
 
+from pusimp.utils import ImportSandbox
+
 import pusimp_golden_source  # isort: skip
 
 
@@ -120,80 +122,101 @@ def test_data_seven() -> None:
     import pusimp_package_seven  # noqa: F401
 
 
-def test_data_eight_nine_ten() -> None:
-    """Test that the eighth to tenth mock package in tests/data fails to import due to dependencies from user site.
+def assert_user_site_import_error(pusimp_package: str) -> None:
+    """Assert that a mock package in tests/data fails to import due to dependencies from user site.
 
-    Note that the eighth and ninth mock package are tested in the same function, rather than two separate functions,
-    because they both the depend on pusimp_dependency_five and pusimp_dependency_six, which will get replaced
-    by an user-site installation inside this test. However, since the python interpreter only loads a module once,
-    we have to be sure that every mock package that requires pusimp_dependency_five and pusimp_dependency_six operates
-    in the same environment.
+    The mock packages tested by this function depend on pusimp_dependency_five and pusimp_dependency_six,
+    which get replaced by an user-site installation inside this function. Since the python interpreter
+    only loads a module once, the import is carried out in a pusimp.utils.ImportSandbox, so that the
+    user-site installation of the dependencies is forgotten once this function returns.
     """
     mock_system_site_path = pusimp_golden_source.system_path
     mock_user_site_path = tempfile.mkdtemp()
-    sys.path.insert(0, mock_user_site_path)
     for dependency_import_name in ("pusimp_dependency_five", "pusimp_dependency_six"):
         dependency_user_site = os.path.join(mock_user_site_path, dependency_import_name)
         os.makedirs(dependency_user_site)
         with open(os.path.join(dependency_user_site, "__init__.py"), "w") as init_file:
             init_file.write("# created by pytest")
     try:
-        for pusimp_package in ("pusimp_package_eight", "pusimp_package_nine", "pusimp_package_ten"):
+        with ImportSandbox():
+            sys.path.insert(0, mock_user_site_path)
             with pytest.raises(ImportError) as excinfo:
                 importlib.import_module(pusimp_package)
-            import_error_text = str(excinfo.value)
-            print(f"The following ImportError was raised:\n{import_error_text}")
+        import_error_text = str(excinfo.value)
+        print(f"The following ImportError was raised:\n{import_error_text}")
+        assert (
+            f"pusimp has detected the following problems with {pusimp_package} dependencies"
+        ) in import_error_text
+        if pusimp_package == "pusimp_package_ten":
+            assert "Missing dependencies:" in import_error_text
+            assert "To install missing dependencies:" in import_error_text
+            assert "Broken dependencies:" in import_error_text
+            assert "To fix broken dependencies:" in import_error_text
+        assert (
+            "Dependencies imported from a local path rather than from the path provided by "
+            "mock system package manager:"
+        ) in import_error_text
+        assert "To uninstall local dependencies:" in import_error_text
+        if pusimp_package == "pusimp_package_ten":
+            assert (
+                "* pusimp_dependency_missing is missing. Its expected path was "
+                f"{os.path.join(mock_system_site_path, 'pusimp_dependency_missing', '__init__.py')}."
+            ) in import_error_text
+            assert (
+                "* check how to install pusimp_dependency_missing with mock system package manager."
+            ) in import_error_text
+            assert (
+                "pusimp_dependency_four is broken. Error on import was "
+                "'pusimp_dependency_four is a broken package.'."
+            ) in import_error_text
             assert (
-                f"pusimp has detected the following problems with {pusimp_package} dependencies"
+                f"* run '{sys.executable} -m pip show pusimp-dependency-four' in a terminal: if the location "
+                f"field is not {mock_system_site_path} consider running '{sys.executable} -m pip uninstall "
+                "pusimp-dependency-four' in a terminal, because the broken dependency is probably being imported "
+                "from a local path rather than from the path provided by mock system package manager."
             ) in import_error_text
-            if pusimp_package == "pusimp_package_ten":
-                assert "Missing dependencies:" in import_error_text
-                assert "To install missing dependencies:" in import_error_text
-                assert "Broken dependencies:" in import_error_text
-                assert "To fix broken dependencies:" in import_error_text
+        for (dependency_import_name, dependency_optional_string) in (
+            ("pusimp_dependency_five", "mandatory"),
+            ("pusimp_dependency_six", "optional")
+        ):
             assert (
-                "Dependencies imported from a local path rather than from the path provided by "
-                "mock system package manager:"
+                f"* {dependency_import_name} was imported from a local path: expected in "
+                f"{os.path.join(mock_system_site_path, dependency_import_name, '__init__.py')}, "
+                f"but imported from "
+                f"{os.path.join(mock_user_site_path, dependency_import_name, '__init__.py')}."
             ) in import_error_text
-            assert "To uninstall local dependencies:" in import_error_text
-            if pusimp_package == "pusimp_package_ten":
-                assert (
-                    "* pusimp_dependency_missing is missing. Its expected path was "
-                    f"{os.path.join(mock_system_site_path, 'pusimp_dependency_missing', '__init__.py')}."
-                ) in import_error_text
-                assert (
-                    "* check how to install pusimp_dependency_missing with mock system package manager."
-                ) in import_error_text
-                assert (
-                    "pusimp_dependency_four is broken. Error on import was "
-                    "'pusimp_dependency_four is a broken package.'."
-                ) in import_error_text
-                assert (
-                    f"* run '{sys.executable} -m pip show pusimp-dependency-four' in a terminal: if the location "
-                    f"field is not {mock_system_site_path} consider running '{sys.executable} -m pip uninstall "
-                    "pusimp-dependency-four' in a terminal, because the broken dependency is probably being imported "
-                    "from a local path rather than from the path provided by mock system package manager."
-                ) in import_error_text
-            for (dependency_import_name, dependency_optional_string) in (
-                ("pusimp_dependency_five", "mandatory"),
-                ("pusimp_dependency_six", "optional")
-            ):
-                assert (
-                    f"* {dependency_import_name} was imported from a local path: expected in "
-                    f"{os.path.join(mock_system_site_path, dependency_import_name, '__init__.py')}, "
-                    f"but imported from "
-                    f"{os.path.join(mock_user_site_path, dependency_import_name, '__init__.py')}."
-                ) in import_error_text
-                dependency_pypi_name = dependency_import_name.replace("_", "-")
-                assert (
-                    f"* run '{sys.executable} -m pip uninstall {dependency_pypi_name}' in a terminal, "
-                    f"and verify that you are prompted to confirm removal of files in "
-                    f"{os.path.join(mock_user_site_path, dependency_import_name)}. "
-                    f"{dependency_import_name} is {dependency_optional_string}."
-                ) in import_error_text
+            dependency_pypi_name = dependency_import_name.replace("_", "-")
             assert (
-                "believe that this message appears incorrectly, report this at mock contact URL ."
+                f"* run '{sys.executable} -m pip uninstall {dependency_pypi_name}' in a terminal, "
+                f"and verify that you are prompted to confirm removal of files in "
+                f"{os.path.join(mock_user_site_path, dependency_import_name)}. "
+                f"{dependency_import_name} is {dependency_optional_string}."
             ) in import_error_text
+        assert (
+            "believe that this message appears incorrectly, report this at mock contact URL ."
+        ) in import_error_text
     finally:
-        del sys.path[0]
         shutil.rmtree(mock_user_site_path, ignore_errors=True)
+
+
+def test_data_eight() -> None:
+    """Test that the eighth mock package in tests/data fails to import due to dependencies from user site."""
+    assert_user_site_import_error("pusimp_package_eight")
+
+
+def test_data_nine() -> None:
+    """Test that the ninth mock package in tests/data fails to import due to dependencies from user site."""
+    assert_user_site_import_error("pusimp_package_nine")
+
+
+def test_data_ten() -> None:
+    """Test that the tenth mock package in tests/data fails to import due to dependencies from user site."""
+    assert_user_site_import_error("pusimp_package_ten")
+
+
+def test_data_user_site_forgotten() -> None:
+    """Test that the user-site installation of pusimp_dependency_five is forgotten outside of the sandbox."""
+    assert_user_site_import_error("pusimp_package_eight")
+    import pusimp_dependency_five
+    assert pusimp_dependency_five.__file__ == os.path.join(
+        pusimp_golden_source.system_path, "pusimp_dependency_five", "__init__.py")
@@ -0,0 +1,192 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Differential test of the faster engines of pusimp against the reference implementation.
+
+Each test case generates a random layout of mock dependencies, named after the ones in tests/data, which may be
+correctly installed, missing, broken, shadowed by a package or by a single-file module in the user site, installed
+only in the user site, or installed through a symbolic link. Every engine must report exactly the same error message
+as pusimp.prevent_user_site_imports with the import tier, with the only documented exception that engines which do
+not import dependencies cannot detect broken ones: those engines are compared against the reference implementation
+on the same layout, after broken dependencies have been fixed in place.
+"""
+
+import os
+import pathlib
+import random
+import site
+import sys
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.lazy
+import pusimp.node
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+DEPENDENCY_STATES = [
+    "correct", "missing", "broken", "shadowed_package", "shadowed_module", "user_site_only", "symlinked"
+]
+BROKEN_DEPENDENCY_CODE = "raise RuntimeError('purposely broken')"
+
+Layout = typing.Dict[str, typing.Any]
+Engine = typing.Callable[[Layout], None]
+
+
+def create_layout(seed: int, root: pathlib.Path) -> Layout:
+    """Create a random layout of mock dependencies in a system site and in a user site under root."""
+    generator = random.Random(seed)
+    (system_site, user_site, elsewhere) = (root / "system_site", root / "user_site", root / "elsewhere")
+    for directory in (system_site, user_site, elsewhere):
+        directory.mkdir()
+    layout: Layout = {
+        "system_site": system_site, "user_site": user_site, "dependencies_import_name": [],
+        "dependencies_optional": [], "broken_paths": [], "failure_policy": generator.choice(["raise", "fail_fast"])
+    }
+    for dependency_id in range(generator.randint(1, 5)):
+        dependency_import_name = f"pusimp_dependency_random_{seed}_{dependency_id}"
+        dependency_state = generator.choice(DEPENDENCY_STATES)
+        layout["dependencies_import_name"].append(dependency_import_name)
+        layout["dependencies_optional"].append(generator.random() < 0.3)
+        if dependency_state in ("correct", "broken", "shadowed_package", "shadowed_module"):
+            (system_site / dependency_import_name).mkdir()
+            dependency_path = system_site / dependency_import_name / "__init__.py"
+            if dependency_state == "broken":
+                dependency_path.write_text(BROKEN_DEPENDENCY_CODE)
+                layout["broken_paths"].append(dependency_path)
+            else:
+                dependency_path.write_text("")
+        if dependency_state in ("shadowed_package", "user_site_only"):
+            (user_site / dependency_import_name).mkdir()
+            (user_site / dependency_import_name / "__init__.py").write_text("")
+        elif dependency_state == "shadowed_module":
+            (user_site / f"{dependency_import_name}.py").write_text("")
+        elif dependency_state == "symlinked":
+            (elsewhere / dependency_import_name).mkdir()
+            (elsewhere / dependency_import_name / "__init__.py").write_text("")
+            os.symlink(elsewhere / dependency_import_name, system_site / dependency_import_name)
+    return layout
+
+
+def create_guard(layout: Layout, check_tier: str, escalation_tier: typing.Optional[str] = None) -> pusimp.Guard:
+    """Create a guard on the dependencies of a layout."""
+    dependencies_import_name = layout["dependencies_import_name"]
+    return pusimp.Guard(
+        "pusimp_differential_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        str(layout["system_site"]), dependencies_import_name,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+        layout["dependencies_optional"], [""] * len(dependencies_import_name),
+        pusimp_golden_source.pip_uninstall_call, check_tier=check_tier, escalation_tier=escalation_tier,
+        failure_policy=layout["failure_policy"])
+
+
+def reference_engine(layout: Layout) -> None:
+    """Check the layout with the reference implementation."""
+    dependencies_import_name = layout["dependencies_import_name"]
+    pusimp.prevent_user_site_imports(
+        "pusimp_differential_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        str(layout["system_site"]), dependencies_import_name,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+        layout["dependencies_optional"], [""] * len(dependencies_import_name),
+        pusimp_golden_source.pip_uninstall_call, failure_policy=layout["failure_policy"])
+
+
+def tier_engine(check_tier: str, escalation_tier: typing.Optional[str] = None) -> Engine:
+    """Check the layout with a guard using the given tiers."""
+    return lambda layout: create_guard(layout, check_tier, escalation_tier).check()
+
+
+def memoized_engine(layout: Layout) -> None:
+    """Check the layout twice with the same guard, so that the second check reuses the memoized verdict."""
+    guard = create_guard(layout, "import")
+    try:
+        guard.check()
+    except ImportError:
+        pass
+    guard.check()
+
+
+def node_engine(layout: Layout) -> None:
+    """Check the layout twice on the node, so that the second check reuses the published result."""
+    runtime_directory = layout["system_site"].parent / "runtime"
+    runtime_directory.mkdir(exist_ok=True)
+    for attempt in range(2):
+        pusimp.clear_verdicts()
+        try:
+            pusimp.node.check_on_node(create_guard(layout, "import"), str(runtime_directory))
+        except ImportError:
+            if attempt == 1:
+                raise
+
+
+def lazy_engine(layout: Layout) -> None:
+    """Check the layout while importing dependencies lazily."""
+    pusimp.lazy.lazy_import(create_guard(layout, "spec"))
+
+
+# Engines which import dependencies, and must therefore agree with the reference implementation on every layout.
+IMPORTING_ENGINES = {
+    "guard": tier_engine("import"),
+    "memoized": memoized_engine,
+    "node": node_engine
+}
+
+# Engines which do not import dependencies, and cannot detect broken dependencies.
+IMPORT_FREE_ENGINES = {
+    "static": tier_engine("static"),
+    "spec": tier_engine("spec"),
+    "static+spec": tier_engine("static", "spec"),
+    "static+import": tier_engine("static", "import"),
+    "spec+import": tier_engine("spec", "import"),
+    "lazy": lazy_engine
+}
+
+
+def run_engine(engine: Engine, layout: Layout) -> typing.Optional[str]:
+    """Run an engine in an import sandbox, and return the text of the ImportError it raised, if any."""
+    pusimp.clear_verdicts()
+    with ImportSandbox():
+        sys.path[:0] = [str(layout["user_site"]), str(layout["system_site"])]
+        try:
+            engine(layout)
+        except ImportError as import_error:
+            return str(import_error)
+        return None
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_differential(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path, seed: int) -> None:
+    """Test that every engine reports the same error message as the reference implementation."""
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    layout = create_layout(seed, tmp_path)
+    monkeypatch.setattr(site, "USER_SITE", str(layout["user_site"]))
+    reference_outcome = run_engine(reference_engine, layout)
+    for (engine_name, engine) in IMPORTING_ENGINES.items():
+        assert run_engine(engine, layout) == reference_outcome, f"Engine {engine_name} differs on seed {seed}"
+    for broken_path in layout["broken_paths"]:
+        broken_path.write_text("")
+    fixed_reference_outcome = run_engine(reference_engine, layout)
+    if len(layout["broken_paths"]) == 0:
+        assert fixed_reference_outcome == reference_outcome
+    for broken_path in layout["broken_paths"]:
+        broken_path.write_text(BROKEN_DEPENDENCY_CODE)
+    for (engine_name, engine) in IMPORT_FREE_ENGINES.items():
+        assert run_engine(engine, layout) == fixed_reference_outcome, f"Engine {engine_name} differs on seed {seed}"
+
+
+def test_differential_coverage() -> None:
+    """Test that the random layouts cover every dependency state, both for optional and mandatory dependencies."""
+    covered_states = set()
+    for seed in range(60):
+        generator = random.Random(seed)
+        generator.choice(["raise", "fail_fast"])
+        for _ in range(generator.randint(1, 5)):
+            dependency_state = generator.choice(DEPENDENCY_STATES)
+            covered_states.add((dependency_state, generator.random() < 0.3))
+    assert covered_states == {
+        (dependency_state, optional) for dependency_state in DEPENDENCY_STATES for optional in (False, True)}
@@ -0,0 +1,149 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the number of filesystem calls made by pusimp.prevent_user_site_imports on the mock packages."""
+
+import os
+import site
+import sys
+import time
+import typing
+
+import pytest
+
+import pusimp
+from pusimp.utils import FilesystemCallCounter, FilesystemLatency, ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+@pytest.fixture
+def filesystem_calls(monkeypatch: pytest.MonkeyPatch) -> typing.Iterator[FilesystemCallCounter]:
+    """Prepare an import sandbox in which sys.path only contains the system path, and return a call counter.
+
+    The user site is disabled, and memoized verdicts and mock packages imported by previous tests are dropped,
+    so that counts do not depend on the environment in which tests are run nor on previous tests.
+    """
+    monkeypatch.setattr(site, "USER_SITE", None)
+    pusimp.clear_verdicts()
+    with ImportSandbox():
+        sys.path[:] = [pusimp_golden_source.system_path]
+        for module_name in [module_name for module_name in sys.modules if module_name.startswith("pusimp_dependency")]:
+            del sys.modules[module_name]
+        yield FilesystemCallCounter()
+
+
+def guard(dependencies_import_name: typing.List[str], check_tier: str) -> None:
+    """Call pusimp.prevent_user_site_imports on mandatory dependencies among the mock packages."""
+    pusimp.prevent_user_site_imports(
+        "pusimp_budget_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        pusimp_golden_source.system_path, dependencies_import_name,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+        [False] * len(dependencies_import_name), [""] * len(dependencies_import_name),
+        pusimp_golden_source.pip_uninstall_call, check_tier=check_tier)
+
+
+# Budgets of each scenario. Calls made by pusimp itself (stat, lstat, listdir and scandir) must match the budget
+# exactly, so that both regressions and improvements are noticed. Calls made by the import system (import_stat and
+# import_listdir) depend on the python version, and must only stay within the budget. As the path based finder,
+# the static tier lists each entry of sys.path and the directory of the package it finds, rather than looking for
+# every module suffix; the expected prefix is listed as well when a dependency is not at its expected path.
+BUDGETS = [
+    ("static", ["pusimp_dependency_one"], {"stat": 3, "listdir": 4, "import_stat": 0, "import_listdir": 0}),
+    ("static", ["pusimp_dependency_one", "pusimp_dependency_two"], {
+        "stat": 4, "listdir": 6, "import_stat": 0, "import_listdir": 0}),
+    ("static", ["pusimp_dependency_one", "pusimp_dependency_missing"], {
+        "stat": 4, "listdir": 5, "import_stat": 0, "import_listdir": 0}),
+    ("spec", ["pusimp_dependency_one"], {"stat": 3, "listdir": 2, "import_stat": 5, "import_listdir": 1}),
+    ("spec", ["pusimp_dependency_one", "pusimp_dependency_two"], {
+        "stat": 4, "listdir": 2, "import_stat": 10, "import_listdir": 1}),
+    ("spec", ["pusimp_dependency_one", "pusimp_dependency_missing"], {
+        "stat": 4, "listdir": 3, "import_stat": 5, "import_listdir": 1}),
+    ("import", ["pusimp_dependency_one"], {"stat": 3, "listdir": 2, "import_stat": 6, "import_listdir": 1}),
+    ("import", ["pusimp_dependency_one", "pusimp_dependency_two"], {
+        "stat": 4, "listdir": 2, "import_stat": 12, "import_listdir": 1}),
+    ("import", ["pusimp_dependency_one", "pusimp_dependency_missing"], {
+        "stat": 4, "listdir": 3, "import_stat": 6, "import_listdir": 1})
+]
+
+
+def assert_within_budget(counts: typing.Dict[str, int], budget: typing.Dict[str, int]) -> None:
+    """Assert that calls made by pusimp match the budget, and that calls made by the import system fit in it."""
+    for (primitive_name, primitive_count) in counts.items():
+        primitive_budget = budget.get(primitive_name, 0)
+        if primitive_name.startswith("import_"):
+            assert primitive_count <= primitive_budget, f"{primitive_name}: {primitive_count} > {primitive_budget}"
+        else:
+            assert primitive_count == primitive_budget, f"{primitive_name}: {primitive_count} != {primitive_budget}"
+
+
+@pytest.mark.parametrize("check_tier,dependencies_import_name,budget", BUDGETS)
+def test_filesystem_budget(
+    filesystem_calls: FilesystemCallCounter, check_tier: str, dependencies_import_name: typing.List[str],
+    budget: typing.Dict[str, int]
+) -> None:
+    """Test the number of filesystem calls of a guard, for every check tier."""
+    with filesystem_calls:
+        try:
+            guard(dependencies_import_name, check_tier)
+        except ImportError:
+            assert "pusimp_dependency_missing" in dependencies_import_name
+    print(f"Filesystem calls: {filesystem_calls.counts}")
+    assert_within_budget(filesystem_calls.counts, budget)
+
+
+def test_filesystem_budget_memoized(filesystem_calls: FilesystemCallCounter) -> None:
+    """Test the number of filesystem calls of a guard whose verdict is memoized."""
+    guard(["pusimp_dependency_one", "pusimp_dependency_two"], "import")
+    with filesystem_calls:
+        guard(["pusimp_dependency_one", "pusimp_dependency_two"], "import")
+    assert_within_budget(filesystem_calls.counts, {"stat": 1, "listdir": 1})
+
+
+def test_filesystem_call_counter() -> None:
+    """Test that the counter counts calls to every primitive, and restores primitives on exit."""
+    original_stat = os.stat
+    counter = FilesystemCallCounter()
+    with counter:
+        assert os.stat is not original_stat
+        os.stat(os.getcwd())
+        os.path.exists(os.getcwd())
+        os.lstat(os.getcwd())
+        os.listdir(os.getcwd())
+        with os.scandir(os.getcwd()):
+            pass
+    assert os.stat is original_stat
+    assert counter.counts == {
+        "stat": 2, "lstat": 1, "listdir": 1, "scandir": 1, "import_stat": 0, "import_listdir": 0}
+    assert counter.total == 5
+
+
+def test_filesystem_latency(filesystem_calls: FilesystemCallCounter) -> None:
+    """Test that latency is added to every filesystem call of a guard."""
+    original_stat = os.stat
+    latency = FilesystemLatency(0.002, 0.001, seed=0)
+    start = time.perf_counter()
+    with filesystem_calls, latency:
+        guard(["pusimp_dependency_one", "pusimp_dependency_two"], "import")
+    elapsed = time.perf_counter() - start
+    assert 0.002 * filesystem_calls.total <= latency.injected_delay <= 0.003 * filesystem_calls.total
+    assert elapsed >= latency.injected_delay
+    assert os.stat is original_stat
+
+
+def test_filesystem_latency_memoized(filesystem_calls: FilesystemCallCounter) -> None:
+    """Benchmark a guard under latency, to show that a memoized verdict is cheaper than a new probe."""
+    latencies = [FilesystemLatency(0.001) for _ in range(2)]
+    for latency in latencies:
+        with latency:
+            guard(["pusimp_dependency_one", "pusimp_dependency_two"], "import")
+    print(f"Injected delay: {latencies[0].injected_delay} s on first call, {latencies[1].injected_delay} s later")
+    assert latencies[1].injected_delay < latencies[0].injected_delay
+
+
+def test_filesystem_latency_invalid() -> None:
+    """Test that negative latencies are rejected."""
+    with pytest.raises(AssertionError):
+        FilesystemLatency(-1.0)
@@ -0,0 +1,108 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the monitor of later imports defined in pusimp.import_monitor."""
+
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import typing
+
+import pytest
+
+import pusimp
+from pusimp.import_monitor import ImportMonitor, start_import_monitor, stop_import_monitor
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+@pytest.fixture
+def mock_sites() -> typing.Iterator[typing.Tuple[str, str]]:
+    """Create a mock system site and a mock user site, both containing files of the dependency pusimp_monitor."""
+    system_site_path = tempfile.mkdtemp()
+    user_site_path = tempfile.mkdtemp()
+    for (site_path, module_relative_paths) in (
+        (system_site_path, ("pusimp_monitor/__init__.py", "pusimp_monitor/system_submodule.py")),
+        (user_site_path, ("pusimp_monitor/user_submodule.py", "pusimp_monitor_optional/__init__.py"))
+    ):
+        for module_relative_path in module_relative_paths:
+            os.makedirs(os.path.join(site_path, os.path.dirname(module_relative_path)), exist_ok=True)
+            open(os.path.join(site_path, module_relative_path), "w").close()
+    with ImportSandbox():
+        sys.path.insert(0, system_site_path)
+        yield (system_site_path, user_site_path)
+    shutil.rmtree(system_site_path, ignore_errors=True)
+    shutil.rmtree(user_site_path, ignore_errors=True)
+
+
+def guard(system_site_path: str, failure_policy: str = "raise") -> None:
+    """Guard a mandatory dependency pusimp_monitor and an optional dependency pusimp_monitor_optional."""
+    pusimp.prevent_user_site_imports(
+        "pusimp_monitor_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        system_site_path, ["pusimp_monitor", "pusimp_monitor_optional"],
+        ["pusimp-monitor", "pusimp-monitor-optional"], [False, True], ["", "Extra message."],
+        pusimp_golden_source.pip_uninstall_call, failure_policy=failure_policy, monitor_imports=True)
+
+
+def test_import_monitor(mock_sites: typing.Tuple[str, str]) -> None:
+    """Test that later imports of guarded dependencies from a local path are reported."""
+    (system_site_path, user_site_path) = mock_sites
+    guard(system_site_path)
+    importlib.import_module("pusimp_monitor.system_submodule")
+    sys.path.insert(0, user_site_path)
+    with pytest.raises(ImportError) as excinfo:
+        importlib.import_module("pusimp_monitor_optional")
+    import_error_text = str(excinfo.value)
+    print(f"The following ImportError was raised:\n{import_error_text}")
+    assert (
+        "1) Dependencies imported from a local path rather than from the path provided by "
+        f"{pusimp_golden_source.system_package_manager}:\n"
+        f"* pusimp_monitor_optional was imported from a local path: expected in "
+        f"{system_site_path}/pusimp_monitor_optional, but imported from "
+        f"{os.path.join(user_site_path, 'pusimp_monitor_optional', '__init__.py')}.\n"
+    ) in import_error_text
+    assert "Extra message.\n" in import_error_text
+    assert "pusimp_monitor_optional" not in sys.modules
+    sys.modules["pusimp_monitor"].__path__.append(os.path.join(user_site_path, "pusimp_monitor"))
+    with pytest.raises(ImportError, match=r"pusimp_monitor\.user_submodule was imported from a local path"):
+        importlib.import_module("pusimp_monitor.user_submodule")
+
+
+def test_import_monitor_warn_once(mock_sites: typing.Tuple[str, str]) -> None:
+    """Test that later imports of guarded dependencies are reported according to the failure policy."""
+    (system_site_path, user_site_path) = mock_sites
+    guard(system_site_path, "warn_once")
+    guard(system_site_path, "warn_once")
+    assert sum(isinstance(finder, ImportMonitor) for finder in sys.meta_path) == 1
+    sys.path.insert(0, user_site_path)
+    with pytest.warns(UserWarning, match="pusimp_monitor_optional was imported from a local path"):
+        importlib.import_module("pusimp_monitor_optional")
+    assert "pusimp_monitor_optional" in sys.modules
+
+
+def test_import_monitor_unguarded_and_not_found(mock_sites: typing.Tuple[str, str]) -> None:
+    """Test that the monitor neither finds unguarded modules nor guarded modules which do not exist."""
+    (system_site_path, _) = mock_sites
+    reported: typing.List[typing.Tuple[str, str]] = []
+    os.makedirs(os.path.join(system_site_path, "pusimp_monitor_namespace"))
+    monitor = ImportMonitor(
+        ["pusimp_monitor", "pusimp_monitor_namespace"], system_site_path, lambda *args: reported.append(args))
+    assert monitor.find_spec("pusimp_monitor_unguarded", None) is None
+    assert monitor.find_spec(
+        "pusimp_monitor.missing_submodule", [os.path.join(system_site_path, "pusimp_monitor")]) is None
+    spec = monitor.find_spec("pusimp_monitor", None)
+    assert spec is not None and spec.origin == os.path.join(system_site_path, "pusimp_monitor", "__init__.py")
+    spec = monitor.find_spec("pusimp_monitor_namespace", None)
+    assert spec is not None and list(spec.submodule_search_locations or []) == [
+        os.path.join(system_site_path, "pusimp_monitor_namespace")]
+    assert reported == []
+    start_import_monitor("pusimp_monitor_package", monitor)
+    assert sys.meta_path[0] is monitor
+    stop_import_monitor("pusimp_monitor_package")
+    assert monitor not in sys.meta_path
+    stop_import_monitor("pusimp_monitor_package")
@@ -0,0 +1,192 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the integrity verification defined in pusimp.integrity."""
+
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.integrity
+from pusimp.integrity import verify_dependencies_integrity
+from pusimp.utils import create_mock_distribution, ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+def create_mock_package(prefix: str, import_name: str, record: bool = True) -> typing.List[str]:
+    """Create a mock distribution of a package with a RECORD file, or without it, and return the lines of its RECORD."""
+    return create_mock_distribution(prefix, {
+        f"{import_name}/__init__.py": "# mock package for integrity verification", f"{import_name}/empty.txt": ""
+    }, import_name, record=record)
+
+
+def count_file_digests(monkeypatch: pytest.MonkeyPatch) -> typing.List[str]:
+    """Record the paths of files whose digest gets actually computed."""
+    computed: typing.List[str] = []
+    original_file_digest = pusimp.integrity._file_digest
+
+    def _(path: str, algorithm: str, size: int) -> str:
+        computed.append(path)
+        return original_file_digest(path, algorithm, size)
+
+    monkeypatch.setattr(pusimp.integrity, "_file_digest", _)
+    return computed
+
+
+def test_verify_dependencies_integrity_installed() -> None:
+    """Test integrity verification on mock dependencies installed in tests/data."""
+    assert verify_dependencies_integrity(
+        pusimp_golden_source.system_path, ["pusimp-dependency-one", "pusimp-dependency-missing"]) == [None, None]
+
+
+def test_verify_dependencies_integrity_record() -> None:
+    """Test that integrity verification reports modified and deleted files listed in RECORD."""
+    prefix = tempfile.mkdtemp()
+    try:
+        create_mock_package(prefix, "pusimp_integrity_record")
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_record"]) == [None]
+        with open(os.path.join(prefix, "pusimp_integrity_record", "__init__.py"), "a") as init_file:
+            init_file.write("\n# modified")
+        os.remove(os.path.join(prefix, "pusimp_integrity_record", "empty.txt"))
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_record"]) == [[
+            os.path.join(prefix, "pusimp_integrity_record", "__init__.py"),
+            os.path.join(prefix, "pusimp_integrity_record", "empty.txt")
+        ]]
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+
+def test_verify_dependencies_integrity_manifest() -> None:
+    """Test that integrity verification falls back on the manifest when RECORD is not available."""
+    prefix = tempfile.mkdtemp()
+    try:
+        record_lines = create_mock_package(prefix, "pusimp_integrity_manifest", record=False)
+        manifest = os.path.join(prefix, "manifest")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("\n".join(record_lines))
+        with open(os.path.join(prefix, "pusimp_integrity_manifest", "__init__.py"), "a") as init_file:
+            init_file.write("\n# modified")
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_manifest"]) == [None]
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_manifest"], [manifest]) == [
+            [os.path.join(prefix, "pusimp_integrity_manifest", "__init__.py")]]
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+
+def test_verify_dependencies_integrity_unverifiable() -> None:
+    """Test that unreadable files, unsupported hash algorithms and unreadable manifests are reported as modified."""
+    prefix = tempfile.mkdtemp()
+    try:
+        create_mock_package(prefix, "pusimp_integrity_unreadable")
+        os.remove(os.path.join(prefix, "pusimp_integrity_unreadable", "empty.txt"))
+        os.makedirs(os.path.join(prefix, "pusimp_integrity_unreadable", "empty.txt", "not_a_file"))
+        record_lines = create_mock_package(prefix, "pusimp_integrity_unsupported", record=False)
+        manifest = os.path.join(prefix, "manifest")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("\n".join(
+                record_line.replace("sha256=", "unsupported=", 1) if "__init__.py" in record_line else record_line
+                for record_line in record_lines))
+        assert verify_dependencies_integrity(
+            prefix, ["pusimp_integrity_unreadable", "pusimp_integrity_unsupported", "pusimp_integrity_missing"],
+            [None, manifest, os.path.join(prefix, "missing_manifest")]
+        ) == [
+            [os.path.join(prefix, "pusimp_integrity_unreadable", "empty.txt")],
+            [os.path.join(prefix, "pusimp_integrity_unsupported", "__init__.py")],
+            [os.path.join(prefix, "missing_manifest")]
+        ]
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+
+@pytest.mark.parametrize("cache_content", [
+    "[[1, 2]]", '{"path": "digest"}', '[["path", "sha256", "size", 0, 0, "digest"]]', '[["path", "sha256", 0, 0]]'])
+def test_verify_dependencies_integrity_cache_invalid_layout(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path, cache_content: str
+) -> None:
+    """Test that a persistent cache with an unexpected layout is ignored."""
+    create_mock_package(str(tmp_path), "pusimp_integrity_cache_layout")
+    (tmp_path / "digests.json").write_text(cache_content)
+    monkeypatch.setattr(pusimp.integrity, "_digests_cache", {})
+    monkeypatch.setattr(pusimp.integrity, "_digests_cache_loaded_paths", set())
+    assert verify_dependencies_integrity(
+        str(tmp_path), ["pusimp_integrity_cache_layout"], cache_path=str(tmp_path / "digests.json")) == [None]
+    assert len(pusimp.integrity._digests_cache) == 3
+
+
+def test_verify_dependencies_integrity_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that digests are computed only once, both with the in-memory cache and with the persistent cache."""
+    prefix = tempfile.mkdtemp()
+    try:
+        create_mock_package(prefix, "pusimp_integrity_cache")
+        cache_path = os.path.join(prefix, "cache", "digests.json")
+        computed = count_file_digests(monkeypatch)
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_cache"], cache_path=cache_path) == [None]
+        assert len(computed) == 3
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_cache"], cache_path=cache_path) == [None]
+        assert len(computed) == 3
+        # Mimic a new run, which only has the persistent cache at its disposal
+        monkeypatch.setattr(pusimp.integrity, "_digests_cache", {})
+        monkeypatch.setattr(pusimp.integrity, "_digests_cache_loaded_paths", set())
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_cache"], cache_path=cache_path) == [None]
+        assert len(computed) == 3
+        # A modification of the file invalidates its cache entry
+        with open(os.path.join(prefix, "pusimp_integrity_cache", "__init__.py"), "a") as init_file:
+            init_file.write("\n# modified")
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_cache"], cache_path=cache_path) == [
+            [os.path.join(prefix, "pusimp_integrity_cache", "__init__.py")]]
+        assert len(computed) == 4
+        # A corrupted persistent cache is ignored
+        with open(cache_path, "w") as cache_file:
+            cache_file.write("corrupted")
+        monkeypatch.setattr(pusimp.integrity, "_digests_cache", {})
+        monkeypatch.setattr(pusimp.integrity, "_digests_cache_loaded_paths", set())
+        assert verify_dependencies_integrity(prefix, ["pusimp_integrity_cache"], cache_path=cache_path) == [
+            [os.path.join(prefix, "pusimp_integrity_cache", "__init__.py")]]
+        assert len(computed) == 7
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+
+def test_prevent_user_site_imports_integrity() -> None:
+    """Test that pusimp.prevent_user_site_imports reports modified dependencies when asked to check integrity."""
+    prefix = tempfile.mkdtemp()
+    try:
+        create_mock_package(prefix, "pusimp_integrity_guard")
+        guard_arguments = (
+            "pusimp_integrity_package", "mock system package manager", "mock contact URL", prefix,
+            ["pusimp_integrity_guard"], ["pusimp-integrity-guard"], [False], ["Extra message."],
+            pusimp_golden_source.pip_uninstall_call
+        )
+        with ImportSandbox():
+            sys.path.insert(0, prefix)
+            pusimp.prevent_user_site_imports(*guard_arguments, check_tier="integrity")
+            pusimp.prevent_user_site_imports(
+                *guard_arguments, check_tier="integrity", dependencies_integrity_manifest=[None])
+            with open(os.path.join(prefix, "pusimp_integrity_guard", "empty.txt"), "w") as empty_file:
+                empty_file.write("not empty anymore")
+            pusimp.prevent_user_site_imports(*guard_arguments)
+            with pytest.raises(ImportError) as excinfo:
+                pusimp.prevent_user_site_imports(*guard_arguments, check_tier="integrity")
+        import_error_text = str(excinfo.value)
+        print(f"The following ImportError was raised:\n{import_error_text}")
+        assert (
+            "1) Dependencies with files which differ from the ones installed by mock system package manager:\n"
+            "* pusimp_integrity_guard has modified or deleted files: "
+            f"{os.path.join(prefix, 'pusimp_integrity_guard', 'empty.txt')}.\n"
+        ) in import_error_text
+        assert (
+            "1) To restore modified dependencies:\n"
+            "* check how to reinstall pusimp_integrity_guard with mock system package manager, because its files "
+            f"in {prefix} were probably overwritten by a local installation. Extra message.\n"
+        ) in import_error_text
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
@@ -0,0 +1,112 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.lazy on mock sites created on the fly."""
+
+import importlib
+import importlib.machinery
+import importlib.util
+import pathlib
+import sys
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.lazy
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+# Mock dependencies record in a list stored in sys, which is shared by every module, when their body is executed.
+MOCK_DEPENDENCY_CODE = """
+import sys
+sys.pusimp_lazy_executed.append(__name__)
+value = 42
+"""
+
+
+@pytest.fixture
+def mock_sites(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> typing.Iterator[pathlib.Path]:
+    """Prepare a mock system site and a mock user site in an import sandbox, and return the system site."""
+    executed: typing.List[str] = []
+    monkeypatch.setattr(sys, "pusimp_lazy_executed", executed, raising=False)
+    (system_site, user_site) = (tmp_path / "system_site", tmp_path / "user_site")
+    for (site_path, dependencies_import_name) in (
+        (system_site, ["pusimp_lazy_one", "pusimp_lazy_two", "pusimp_lazy_shadowed"]),
+        (user_site, ["pusimp_lazy_shadowed"])
+    ):
+        for dependency_import_name in dependencies_import_name:
+            (site_path / dependency_import_name).mkdir(parents=True)
+            (site_path / dependency_import_name / "__init__.py").write_text(MOCK_DEPENDENCY_CODE)
+    with ImportSandbox():
+        sys.path[:0] = [str(user_site), str(system_site)]
+        yield system_site
+
+
+def create_guard(
+    system_site: pathlib.Path, dependencies_import_name: typing.List[str], **kwargs: typing.Any  # noqa: ANN401
+) -> pusimp.Guard:
+    """Create a guard on mock dependencies, which are optional if their name contains optional."""
+    return pusimp.Guard(
+        "pusimp_lazy_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        str(system_site), dependencies_import_name,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+        ["optional" in dependency_import_name for dependency_import_name in dependencies_import_name],
+        [""] * len(dependencies_import_name), pusimp_golden_source.pip_uninstall_call, **kwargs)
+
+
+@pytest.mark.parametrize("check_tier", ["static", "spec"])
+def test_lazy_import(mock_sites: pathlib.Path, check_tier: str) -> None:
+    """Test that dependencies are checked, and executed only on first attribute access."""
+    lazy_modules = pusimp.lazy.lazy_import(
+        create_guard(mock_sites, ["pusimp_lazy_one", "pusimp_lazy_two", "pusimp_lazy_optional"], check_tier=check_tier))
+    assert list(lazy_modules) == ["pusimp_lazy_one", "pusimp_lazy_two"]
+    assert sys.pusimp_lazy_executed == []  # type: ignore[attr-defined]
+    assert sys.modules["pusimp_lazy_one"] is lazy_modules["pusimp_lazy_one"]
+    assert lazy_modules["pusimp_lazy_two"].value == 42
+    assert sys.pusimp_lazy_executed == ["pusimp_lazy_two"]  # type: ignore[attr-defined]
+    assert lazy_modules["pusimp_lazy_two"].__file__ == str(mock_sites / "pusimp_lazy_two" / "__init__.py")
+
+
+def test_lazy_import_already_imported(mock_sites: pathlib.Path) -> None:
+    """Test that dependencies which were already imported are returned as they are."""
+    dependency_module = importlib.import_module("pusimp_lazy_one")
+    lazy_modules = pusimp.lazy.lazy_import(create_guard(mock_sites, ["pusimp_lazy_one"], check_tier="spec"))
+    assert lazy_modules == {"pusimp_lazy_one": dependency_module}
+
+
+def test_lazy_import_user_site(mock_sites: pathlib.Path) -> None:
+    """Test that user-site dependencies are reported by the check, and are not imported."""
+    with pytest.raises(ImportError, match="pusimp_lazy_shadowed was imported from a local path"):
+        pusimp.lazy.lazy_import(create_guard(mock_sites, ["pusimp_lazy_shadowed"], check_tier="static"))
+    assert "pusimp_lazy_shadowed" not in sys.modules
+
+
+def test_lazy_import_allow_user_site_imports(monkeypatch: pytest.MonkeyPatch, mock_sites: pathlib.Path) -> None:
+    """Test that user-site dependencies are imported lazily when the check is disabled by the environment variable."""
+    monkeypatch.setenv("PUSIMP_LAZY_PACKAGE_ALLOW_USER_SITE_IMPORTS", "1")
+    lazy_modules = pusimp.lazy.lazy_import(create_guard(mock_sites, ["pusimp_lazy_shadowed"], check_tier="static"))
+    assert sys.pusimp_lazy_executed == []  # type: ignore[attr-defined]
+    assert lazy_modules["pusimp_lazy_shadowed"].value == 42
+    assert "user_site" in str(lazy_modules["pusimp_lazy_shadowed"].__file__)
+
+
+@pytest.mark.parametrize("failure_policy", ["raise", "warn_once"])
+def test_lazy_import_spec_mismatch(
+    monkeypatch: pytest.MonkeyPatch, mock_sites: pathlib.Path, failure_policy: str
+) -> None:
+    """Test that dependencies whose spec does not point to the checked location are not imported lazily."""
+    guard = create_guard(mock_sites, ["pusimp_lazy_one"], check_tier="static", failure_policy=failure_policy)
+    spec_from_elsewhere = importlib.machinery.ModuleSpec(
+        "pusimp_lazy_one", None, origin="/elsewhere/pusimp_lazy_one/__init__.py")
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: spec_from_elsewhere)
+    if failure_policy == "raise":
+        with pytest.raises(ImportError, match=r"but imported from /elsewhere/pusimp_lazy_one/__init__\.py"):
+            pusimp.lazy.lazy_import(guard)
+    else:
+        with pytest.warns(UserWarning, match=r"but imported from /elsewhere/pusimp_lazy_one/__init__\.py"):
+            assert pusimp.lazy.lazy_import(guard) == {}
+    assert "pusimp_lazy_one" not in sys.modules
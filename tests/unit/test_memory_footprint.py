@@ -0,0 +1,134 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the peak and retained memory of pusimp.prevent_user_site_imports on mock and synthetic dependencies."""
+
+import pathlib
+import site
+import sys
+import typing
+
+import pytest
+
+import pusimp
+from pusimp.utils import ImportSandbox, MemoryFootprint
+
+import pusimp_golden_source  # isort: skip
+
+
+@pytest.fixture
+def sandbox(monkeypatch: pytest.MonkeyPatch) -> typing.Iterator[None]:
+    """Prepare an import sandbox in which sys.path only contains the system path.
+
+    The user site is disabled, and memoized verdicts and mock packages imported by previous tests are dropped,
+    so that measurements do not depend on the environment in which tests are run nor on previous tests.
+    """
+    monkeypatch.setattr(site, "USER_SITE", None)
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    pusimp.clear_verdicts()
+    with ImportSandbox():
+        sys.path[:] = [pusimp_golden_source.system_path]
+        for module_name in [module_name for module_name in sys.modules if module_name.startswith("pusimp_dependency")]:
+            del sys.modules[module_name]
+        yield
+    pusimp.clear_verdicts()
+
+
+def guard(
+    dependencies_import_name: typing.List[str], check_tier: str,
+    dependencies_expected_prefix: str = pusimp_golden_source.system_path
+) -> typing.Optional[str]:
+    """Call pusimp.prevent_user_site_imports on mandatory dependencies, and return the text of the error, if any."""
+    try:
+        pusimp.prevent_user_site_imports(
+            "pusimp_memory_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+            dependencies_expected_prefix, dependencies_import_name,
+            [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+            [False] * len(dependencies_import_name), [""] * len(dependencies_import_name),
+            pusimp_golden_source.pip_uninstall_call, check_tier=check_tier)
+    except ImportError as import_error:
+        return str(import_error)
+    else:
+        return None
+
+
+def report(scenario: str, footprint: MemoryFootprint) -> None:
+    """Print the peak and retained memory of a scenario, together with the lines which retain the most memory."""
+    print(f"{scenario}: peak {footprint.peak} B, retained {footprint.retained} B")
+    for statistic in footprint.retained_statistics[:3]:
+        print(f"    {statistic}")
+
+
+# Budgets, in bytes, of each scenario on the mock packages. Retained memory is the size of the memoized verdict.
+BUDGETS = [
+    ("static", ["pusimp_dependency_one", "pusimp_dependency_two"], {"peak": 64 * 1024, "retained": 1024}),
+    ("static", ["pusimp_dependency_one", "pusimp_dependency_missing"], {"peak": 64 * 1024, "retained": 4 * 1024}),
+    ("spec", ["pusimp_dependency_one", "pusimp_dependency_two"], {"peak": 128 * 1024, "retained": 1024}),
+    ("spec", ["pusimp_dependency_one", "pusimp_dependency_missing"], {"peak": 128 * 1024, "retained": 4 * 1024}),
+    ("import", ["pusimp_dependency_one", "pusimp_dependency_two"], {"peak": 128 * 1024, "retained": 1024}),
+    ("import", ["pusimp_dependency_one", "pusimp_dependency_missing"], {"peak": 128 * 1024, "retained": 4 * 1024})
+]
+
+
+@pytest.mark.parametrize("check_tier,dependencies_import_name,budget", BUDGETS)
+def test_memory_footprint(
+    sandbox: None, check_tier: str, dependencies_import_name: typing.List[str], budget: typing.Dict[str, int]
+) -> None:
+    """Test that the peak and retained memory of a guard on the mock packages fit in the budget."""
+    with MemoryFootprint() as footprint:
+        guard(dependencies_import_name, check_tier)
+    report(f"{check_tier} {dependencies_import_name}", footprint)
+    assert footprint.peak <= budget["peak"]
+    assert footprint.retained <= budget["retained"]
+
+
+def create_synthetic_prefix(root: pathlib.Path, number_of_entries: int) -> str:
+    """Create an expected prefix with many unrelated entries, which are listed by the environment fingerprint."""
+    root.mkdir()
+    for entry_id in range(number_of_entries):
+        (root / f"pusimp_unrelated_{entry_id}.py").write_text("")
+    return str(root)
+
+
+@pytest.mark.parametrize("check_tier", ["static", "spec", "import"])
+def test_memory_footprint_large_dependency_list(sandbox: None, tmp_path: pathlib.Path, check_tier: str) -> None:
+    """Test that a failed guard on many missing dependencies only retains its error message, until cleared."""
+    dependencies_import_name = [f"pusimp_dependency_synthetic_{dependency_id}" for dependency_id in range(1000)]
+    dependencies_expected_prefix = create_synthetic_prefix(tmp_path / "prefix", 2000)
+    with MemoryFootprint() as footprint:
+        import_error = guard(dependencies_import_name, check_tier, dependencies_expected_prefix)
+    assert import_error is not None
+    report(f"{check_tier} with 1000 missing dependencies", footprint)
+    assert footprint.peak <= 8 * 1024 * 1024
+    # The memoized verdict holds the error message, but neither the listing of the prefix nor per-dependency data.
+    assert footprint.retained <= sys.getsizeof(import_error) + 4 * 1024
+    with MemoryFootprint() as footprint:
+        guard(dependencies_import_name, check_tier, dependencies_expected_prefix)
+        pusimp.clear_verdicts()
+    report(f"{check_tier} with 1000 missing dependencies, after clearing verdicts", footprint)
+    assert footprint.retained <= 1024
+
+
+def test_memory_footprint_broken_dependencies(sandbox: None, tmp_path: pathlib.Path) -> None:
+    """Test that the exceptions raised by broken dependencies, and their tracebacks, are released after the guard."""
+    dependencies_import_name = [f"pusimp_dependency_broken_{dependency_id}" for dependency_id in range(100)]
+    for dependency_import_name in dependencies_import_name:
+        (tmp_path / dependency_import_name).mkdir()
+        (tmp_path / dependency_import_name / "__init__.py").write_text(
+            "payload = bytearray(64 * 1024)\nraise RuntimeError('purposely broken')")
+    sys.path.insert(0, str(tmp_path))
+    with MemoryFootprint() as footprint:
+        import_error = guard(dependencies_import_name, "import", str(tmp_path))
+        pusimp.clear_verdicts()
+    assert import_error is not None
+    assert "purposely broken" in import_error
+    report("import with 100 broken dependencies, after clearing verdicts", footprint)
+    # Each broken dependency allocates 64 KiB before failing, which would be retained by a leaked traceback,
+    # while the error message is still referenced by this test.
+    assert footprint.retained <= sys.getsizeof(import_error) + 1024
+    with MemoryFootprint(filename_pattern=str(tmp_path / "*")) as footprint:
+        guard(dependencies_import_name, "import", str(tmp_path))
+        pusimp.clear_verdicts()
+    assert footprint.retained <= 1024
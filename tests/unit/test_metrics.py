@@ -0,0 +1,160 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.metrics on textfiles in a temporary directory."""
+
+import fcntl
+import importlib
+import os
+import pathlib
+import threading
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.metrics
+
+import pusimp_golden_source  # isort: skip
+
+prevent_user_site_imports_module = importlib.import_module("pusimp.prevent_user_site_imports")
+
+
+def create_guard(dependencies_expected_prefix: str, **kwargs: typing.Any) -> pusimp.Guard:  # noqa: ANN401
+    """Create a guard on a mock package, which is correct when installed in dependencies_expected_prefix."""
+    return pusimp.Guard(
+        "pusimp_metrics_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        dependencies_expected_prefix, ["pusimp_dependency_one", "pusimp_dependency_two"],
+        ["pusimp-dependency-one", "pusimp-dependency-two"], [False, False], ["", ""],
+        pusimp_golden_source.pip_uninstall_call, check_tier="spec", **kwargs)
+
+
+def read_samples(textfile_path: pathlib.Path) -> typing.Dict[str, float]:
+    """Read the samples of a textfile, indexed by their line without the value."""
+    return {
+        line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in textfile_path.read_text().splitlines() if not line.startswith("#")
+    }
+
+
+def test_check_with_metrics(tmp_path: pathlib.Path) -> None:
+    """Test that the outcomes, violations and durations of checks accumulate in the textfile."""
+    textfile_path = tmp_path / "pusimp.prom"
+    pusimp.metrics.check_with_metrics(create_guard(pusimp_golden_source.system_path), str(textfile_path))
+    for _ in range(2):
+        with pytest.raises(ImportError, match="pusimp_dependency_one is missing"):
+            pusimp.metrics.check_with_metrics(create_guard("/stale"), str(textfile_path))
+    pusimp.metrics.flush_metrics()
+    samples = read_samples(textfile_path)
+    assert samples['pusimp_guard_runs_total{outcome="ok",package="pusimp_metrics_package"}'] == 1
+    assert samples['pusimp_guard_runs_total{outcome="problems",package="pusimp_metrics_package"}'] == 2
+    for dependency_import_name in ("pusimp_dependency_one", "pusimp_dependency_two"):
+        assert samples[
+            'pusimp_guard_violations_total{category="missing",dependency="' + dependency_import_name
+            + '",package="pusimp_metrics_package"}'] == 2
+    assert samples['pusimp_guard_duration_seconds_count{package="pusimp_metrics_package"}'] == 3
+    assert samples['pusimp_guard_duration_seconds_bucket{le="+Inf",package="pusimp_metrics_package"}'] == 3
+    assert samples['pusimp_guard_duration_seconds_sum{package="pusimp_metrics_package"}'] > 0
+    buckets = [
+        samples[f'pusimp_guard_duration_seconds_bucket{{le="{bucket!r}",package="pusimp_metrics_package"}}']
+        for bucket in pusimp.metrics.DURATION_BUCKETS]
+    assert buckets == sorted(buckets)
+    textfile_content = textfile_path.read_text()
+    assert textfile_content.startswith(
+        "# HELP pusimp_guard_runs_total Number of guard checks, by outcome.\n"
+        "# TYPE pusimp_guard_runs_total counter\n")
+    assert "# TYPE pusimp_guard_duration_seconds histogram\n" in textfile_content
+    assert oct(textfile_path.stat().st_mode & 0o777) == oct(0o644)
+    assert sorted(os.listdir(tmp_path)) == ["pusimp.prom", "pusimp.prom.lock"]
+
+
+def test_check_with_metrics_allowed(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that a check skipped because user-site imports are allowed counts as ok, and starts the monitor."""
+    monitors: typing.List[str] = []
+    monkeypatch.setattr(pusimp.Guard, "_start_import_monitor", lambda guard, failure_policy: monitors.append(
+        failure_policy))
+    monkeypatch.setenv("PUSIMP_METRICS_PACKAGE_ALLOW_USER_SITE_IMPORTS", "1")
+    pusimp.metrics.check_with_metrics(create_guard("/stale", monitor_imports=True), str(tmp_path / "pusimp.prom"))
+    pusimp.metrics.flush_metrics()
+    assert monitors == ["raise"]
+    samples = read_samples(tmp_path / "pusimp.prom")
+    assert samples['pusimp_guard_runs_total{outcome="ok",package="pusimp_metrics_package"}'] == 1
+    assert not any(sample.startswith("pusimp_guard_violations_total") for sample in samples)
+
+
+def test_check_with_metrics_locked(tmp_path: pathlib.Path) -> None:
+    """Test that the check does not wait for another process which holds the lock of the textfile."""
+    textfile_path = tmp_path / "pusimp.prom"
+    lock_fd = os.open(f"{textfile_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        pusimp.metrics.check_with_metrics(create_guard(pusimp_golden_source.system_path), str(textfile_path))
+        pusimp.metrics.flush_metrics(0.1)
+        assert not textfile_path.exists()
+    finally:
+        os.close(lock_fd)
+    pusimp.metrics.flush_metrics()
+    assert read_samples(textfile_path)['pusimp_guard_runs_total{outcome="ok",package="pusimp_metrics_package"}'] == 1
+
+
+def test_check_with_metrics_concurrent(tmp_path: pathlib.Path) -> None:
+    """Test that concurrent updates of the textfile are not lost."""
+    textfile_path = tmp_path / "pusimp.prom"
+    guard = create_guard(pusimp_golden_source.system_path)
+    threads = [
+        threading.Thread(target=pusimp.metrics.check_with_metrics, args=(guard, str(textfile_path)))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pusimp.metrics.flush_metrics()
+    assert read_samples(textfile_path)['pusimp_guard_runs_total{outcome="ok",package="pusimp_metrics_package"}'] == 8
+
+
+def test_check_with_metrics_unwritable(tmp_path: pathlib.Path) -> None:
+    """Test that a textfile which cannot be written does not break the check."""
+    pusimp.metrics.check_with_metrics(
+        create_guard(pusimp_golden_source.system_path), str(tmp_path / "missing" / "pusimp.prom"))
+    pusimp.metrics.flush_metrics()
+    assert os.listdir(tmp_path) == []
+
+
+def test_problems_by_category() -> None:
+    """Test that the dependencies in each category are read back from the error message of a guard."""
+    guard = create_guard("/stale")
+    import_error = prevent_user_site_imports_module._format_problems(
+        guard, ["one", "two", "three"], ["one", "two", "three"], ["", "", ""],
+        ["/stale/one/__init__.py", None, None],
+        [None, {"expected": "/stale/two/__init__.py", "error": "Line one\n\nLine two"}, None],
+        [None, None, {"expected": "/stale/three/__init__.py", "actual": "/local/three/__init__.py"}],
+        [["one/__init__.py"], None, ["three/__init__.py"]],
+        [None, {"problem": "has version 1.0, but >=2.0 is required"}, None])
+    assert pusimp.metrics.problems_by_category(import_error) == {
+        "missing": ["one"], "broken": ["two"], "user_site": ["three"], "modified": ["one", "three"],
+        "inconsistent": ["two"]
+    }
+    assert pusimp.metrics.problems_by_category(None) == {}
+
+
+def test_textfile_round_trip(tmp_path: pathlib.Path) -> None:
+    """Test that label values are escaped, and that lines which are not valid samples are dropped."""
+    textfile_path = tmp_path / "pusimp.prom"
+    textfile_path.write_text(
+        "# A comment\n"
+        "not a sample\n"
+        'pusimp_guard_runs_total{outcome="ok",package="pusimp_metrics_package"} not_a_number\n'
+        'pusimp_guard_runs_total{package="pusimp_metrics_package",outcome="ok"} 2\n')
+    labels = (("category", "broken"), ("dependency", 'a "quoted"\\ \n name'), ("package", "pusimp_metrics_package"))
+    pusimp.metrics._update_textfile(str(textfile_path), {
+        ("pusimp_guard_runs_total", (("outcome", "ok"), ("package", "pusimp_metrics_package"))): 1,
+        ("pusimp_guard_violations_total", labels): 1
+    })
+    assert pusimp.metrics._read_samples(str(textfile_path)) == {
+        ("pusimp_guard_runs_total", (("outcome", "ok"), ("package", "pusimp_metrics_package"))): 3.0,
+        ("pusimp_guard_violations_total", labels): 1.0
+    }
+    assert 'dependency="a \\"quoted\\"\\\\ \\n name"' in textfile_path.read_text()
+    assert "not a sample" not in textfile_path.read_text()
@@ -0,0 +1,190 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.prevent_user_site_imports on sourceless packages, single-file modules and extension modules."""
+
+import importlib
+import importlib.machinery
+import os
+import pathlib
+import py_compile
+import site
+import sys
+import types
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.lazy
+import pusimp.requirement_graph
+import pusimp.sys_path_safety
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+prevent_user_site_imports_module = importlib.import_module("pusimp.prevent_user_site_imports")
+
+# Extension modules are tagged with the ABI of the interpreter, e.g. .cpython-311-x86_64-linux-gnu.so
+EXTENSION_SUFFIX = importlib.machinery.EXTENSION_SUFFIXES[0]
+
+# Relative path of the file of each layout of the dependency pusimp_layout.
+LAYOUTS = {
+    "package": os.path.join("pusimp_layout", "__init__.py"),
+    "sourceless_package": os.path.join("pusimp_layout", "__init__.pyc"),
+    "module": "pusimp_layout.py",
+    "sourceless_module": "pusimp_layout.pyc",
+    "extension_module": f"pusimp_layout{EXTENSION_SUFFIX}"
+}
+
+
+def create_layout(site_path: pathlib.Path, layout: str) -> pathlib.Path:
+    """Install the dependency pusimp_layout in a site with the given layout, and return the path of its file."""
+    module_path = site_path / LAYOUTS[layout]
+    module_path.parent.mkdir(parents=True, exist_ok=True)
+    if layout.startswith("sourceless"):
+        source_path = module_path.with_suffix(".source")
+        source_path.write_text("value = 1")
+        py_compile.compile(str(source_path), cfile=str(module_path), doraise=True)
+        source_path.unlink()
+    elif layout == "extension_module":
+        # Not a valid shared object: the static and spec tiers find it without loading it.
+        module_path.write_bytes(b"")
+    else:
+        module_path.write_text("value = 1")
+    return module_path
+
+
+@pytest.fixture
+def mock_sites(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> typing.Iterator[pathlib.Path]:
+    """Prepare a sys.path with an empty user site ahead of an empty system site, and return their parent."""
+    for site_name in ("user_site", "system_site"):
+        (tmp_path / site_name).mkdir()
+    monkeypatch.setattr(site, "USER_SITE", str(tmp_path / "user_site"))
+    pusimp.clear_verdicts()
+    with ImportSandbox():
+        sys.path[:0] = [str(tmp_path / "user_site"), str(tmp_path / "system_site")]
+        yield tmp_path
+
+
+def guard(system_site: pathlib.Path, check_tier: str, **kwargs: typing.Any) -> None:  # noqa: ANN401
+    """Guard the dependency pusimp_layout, expected in the system site."""
+    pusimp.prevent_user_site_imports(
+        "pusimp_layout_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        str(system_site), ["pusimp_layout"], ["pusimp-layout"], [False], [""],
+        pusimp_golden_source.pip_uninstall_call, check_tier=check_tier, **kwargs)
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("check_tier", ["static", "spec", "import"])
+def test_module_layouts(mock_sites: pathlib.Path, layout: str, check_tier: str) -> None:
+    """Test that every layout is found in the system site, matches its expected location, and satisfies the proof."""
+    module_path = create_layout(mock_sites / "system_site", layout)
+    if check_tier == "import" and layout == "extension_module":
+        with pytest.raises(ImportError) as excinfo:
+            guard(mock_sites / "system_site", check_tier)
+        assert "* pusimp_layout is broken." in str(excinfo.value)
+        assert f"if the location field is not {module_path.parent} " in str(excinfo.value)
+    else:
+        guard(mock_sites / "system_site", check_tier)
+        sys.path.remove(str(mock_sites / "user_site"))
+        assert pusimp.sys_path_safety.prove_sys_path_safety(
+            str(mock_sites / "system_site"), ["pusimp_layout"],
+            [f"{mock_sites / 'system_site'}/pusimp_layout/__init__.py"])
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("check_tier", ["static", "spec"])
+def test_module_layouts_shadowed(mock_sites: pathlib.Path, layout: str, check_tier: str) -> None:
+    """Test that every layout in the user site is reported when it shadows a different layout in the system site."""
+    system_layout = "module" if layout.endswith("package") else "package"
+    system_module_path = create_layout(mock_sites / "system_site", system_layout)
+    user_module_path = create_layout(mock_sites / "user_site", layout)
+    with pytest.raises(ImportError) as excinfo:
+        guard(mock_sites / "system_site", check_tier)
+    assert (
+        f"* pusimp_layout was imported from a local path: expected in {system_module_path}, "
+        f"but imported from {user_module_path}." in str(excinfo.value))
+
+
+def test_module_layouts_missing(mock_sites: pathlib.Path) -> None:
+    """Test that missing dependencies are still reported by the expected path of their package."""
+    (mock_sites / "system_site" / "pusimp_layout").mkdir()
+    (mock_sites / "system_site" / "pusimp_layout" / "__init__.pyi").write_text("")
+    (mock_sites / "system_site" / "pusimp_layout.txt").write_text("")
+    with pytest.raises(ImportError) as excinfo:
+        guard(mock_sites / "system_site", "spec")
+    assert (
+        f"* pusimp_layout is missing. Its expected path was {mock_sites}/system_site/pusimp_layout/__init__.py."
+        in str(excinfo.value))
+
+
+@pytest.mark.parametrize("check_tier", ["static", "spec"])
+def test_module_layouts_without_location(mock_sites: pathlib.Path, check_tier: str) -> None:
+    """Test that a dependency without a location fails the assertion on its location rather than being matched."""
+    create_layout(mock_sites / "system_site", "package")
+    sys.modules["pusimp_layout"] = types.ModuleType("pusimp_layout")
+    sys.modules["pusimp_layout"].__spec__ = importlib.machinery.ModuleSpec("pusimp_layout", None)
+    with pytest.raises(AssertionError, match="Unable to find location of pusimp_layout"):
+        guard(mock_sites / "system_site", check_tier)
+
+
+def test_module_layouts_lazy_import(mock_sites: pathlib.Path) -> None:
+    """Test that sourceless packages are imported lazily."""
+    create_layout(mock_sites / "system_site", "sourceless_package")
+    lazy_modules = pusimp.lazy.lazy_import(pusimp.Guard(
+        "pusimp_layout_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        str(mock_sites / "system_site"), ["pusimp_layout"], ["pusimp-layout"], [False], [""],
+        pusimp_golden_source.pip_uninstall_call, check_tier="spec"))
+    assert lazy_modules["pusimp_layout"].value == 1
+
+
+def test_find_module_location(tmp_path: pathlib.Path) -> None:
+    """Test that packages come before modules, and that suffixes are looked for in the order of the path finder."""
+    for file_name in (
+        f"package/__init__{EXTENSION_SUFFIX}", "package/__init__.py", "package/__init__.pyc", "package.py",
+        "module.py", "module.pyc", "namespace/submodule.py", "namespace.pyc"
+    ):
+        (tmp_path / file_name).parent.mkdir(exist_ok=True)
+        (tmp_path / file_name).write_text("")
+    for (module_name, module_file_name) in (
+        ("package", f"package/__init__{EXTENSION_SUFFIX}"), ("module", "module.py"), ("namespace", "namespace.pyc"),
+        ("missing", None)
+    ):
+        assert prevent_user_site_imports_module._find_module_location(str(tmp_path), module_name) == (
+            os.path.join(str(tmp_path), module_file_name) if module_file_name is not None else None)
+
+
+@pytest.mark.parametrize("actual_location,matches", [
+    ("/prefix/pusimp_layout/__init__.py", True),
+    ("/prefix/pusimp_layout/../pusimp_layout/__init__.py", True),
+    ("/prefix/pusimp_layout/__init__.pyc", True),
+    (f"/prefix/pusimp_layout/__init__{EXTENSION_SUFFIX}", True),
+    ("/prefix/pusimp_layout.py", True),
+    (f"/prefix/pusimp_layout{EXTENSION_SUFFIX}", True),
+    ("/prefix/pusimp_layout/submodule.py", False),
+    ("/prefix/pusimp_layout.txt", False),
+    ("/prefix/pusimp_other.py", False),
+    ("/elsewhere/pusimp_layout.py", False),
+    ("/elsewhere/pusimp_layout/__init__.pyc", False)
+])
+def test_matches_expected_location(actual_location: str, matches: bool) -> None:
+    """Test that a location matches when it is the package or the module of the dependency in the prefix."""
+    assert prevent_user_site_imports_module._matches_expected_location(
+        actual_location, "/prefix/pusimp_layout/__init__.py") == matches
+
+
+def test_module_layouts_requirement_graph(tmp_path: pathlib.Path) -> None:
+    """Test that sourceless packages and extension modules listed in RECORD are walked as transitive dependencies."""
+    dist_info = tmp_path / "pusimp_layout_graph-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text("Metadata-Version: 2.1\nName: pusimp-layout-graph\nVersion: 1.0\n")
+    create_layout(tmp_path, "sourceless_package")
+    (tmp_path / f"pusimp_layout_extension{EXTENSION_SUFFIX}").write_bytes(b"")
+    (dist_info / "RECORD").write_text("\n".join([
+        "pusimp_layout/__init__.pyc,,", f"pusimp_layout_extension{EXTENSION_SUFFIX},,", "pusimp_layout.pth,,",
+        "pusimp_layout_deleted.py,,"]))
+    assert pusimp.requirement_graph._RequirementGraph(str(tmp_path)).import_names("pusimp-layout-graph") == [
+        "pusimp_layout", "pusimp_layout_extension"]
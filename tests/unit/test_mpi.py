@@ -0,0 +1,155 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.mpi on ranks simulated by threads."""
+
+import socket
+import sys
+import threading
+import types
+import typing
+import warnings
+
+import pytest
+
+import pusimp
+import pusimp.mpi
+
+import pusimp_golden_source  # isort: skip
+
+T = typing.TypeVar("T")
+
+
+class FakeCommunicator:
+    """A communicator whose ranks are threads of the current process, sharing a buffer and a barrier."""
+
+    def __init__(self, rank: int, buffer: typing.List[typing.Any], barrier: threading.Barrier) -> None:
+        self._rank = rank
+        self._buffer = buffer
+        self._barrier = barrier
+
+    def Get_rank(self) -> int:  # noqa: N802
+        """Return the rank of the current thread."""
+        return self._rank
+
+    def Get_size(self) -> int:  # noqa: N802
+        """Return the number of threads."""
+        return len(self._buffer)
+
+    def gather(self, sendobj: T, root: int = 0) -> typing.Optional[typing.List[T]]:
+        """Gather an object from every thread on the root thread."""
+        self._buffer[self._rank] = sendobj
+        self._barrier.wait()
+        gathered = list(self._buffer) if self._rank == root else None
+        self._barrier.wait()
+        return gathered
+
+    def bcast(self, obj: T, root: int = 0) -> T:
+        """Broadcast an object from the root thread to every thread."""
+        if self._rank == root:
+            self._buffer[root] = obj
+        self._barrier.wait()
+        broadcast: T = self._buffer[root]
+        self._barrier.wait()
+        return broadcast
+
+
+def create_guard(dependencies_expected_prefix: str, **kwargs: typing.Any) -> pusimp.Guard:  # noqa: ANN401
+    """Create a guard on a mock package, which is correct when installed in dependencies_expected_prefix."""
+    return pusimp.Guard(
+        "pusimp_mpi_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        dependencies_expected_prefix, ["pusimp_dependency_one"], ["pusimp-dependency-one"], [False], [""],
+        pusimp_golden_source.pip_uninstall_call, **kwargs)
+
+
+def run_ranks(
+    monkeypatch: pytest.MonkeyPatch, guards: typing.List[pusimp.Guard], hostnames: typing.List[str], root: int = 0
+) -> typing.List[typing.Optional[BaseException]]:
+    """Check the guards collectively, each on a thread acting as a rank, and return the exception of each rank."""
+    monkeypatch.setattr(socket, "gethostname", lambda: hostnames[int(threading.current_thread().name)])
+    buffer: typing.List[typing.Any] = [None] * len(guards)
+    barrier = threading.Barrier(len(guards))
+    outcomes: typing.List[typing.Optional[BaseException]] = [None] * len(guards)
+
+    def run_rank(rank: int) -> None:
+        try:
+            pusimp.mpi.check_across_ranks(guards[rank], FakeCommunicator(rank, buffer, barrier), root)
+        except BaseException as rank_exception:
+            outcomes[rank] = rank_exception
+
+    threads = [threading.Thread(target=run_rank, args=(rank, ), name=str(rank)) for rank in range(len(guards))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_check_across_ranks(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that distinct problems are reported once, with the ranks and hosts on which they were found."""
+    correct_guard = create_guard(pusimp_golden_source.system_path)
+    stale_guards = [create_guard(f"/stale/{node}") for node in ("node1", "node2")]
+    outcomes = run_ranks(
+        monkeypatch,
+        [correct_guard, correct_guard, stale_guards[0], stale_guards[0], stale_guards[0], stale_guards[1]],
+        ["node0", "node0", "node1", "node1", "node2", "node2"], 1)
+    assert all(isinstance(outcome, ImportError) for outcome in outcomes)
+    summary = str(outcomes[1])
+    print(f"The following ImportError was raised:\n{summary}")
+    assert summary.startswith(
+        "pusimp_mpi_package found problems with its dependencies on 4 out of 6 ranks, with 2 distinct error messages.")
+    assert "Problem 1 was found on 3 ranks (2-4) on hosts node1, node2:\n" in summary
+    assert "Problem 2 was found on 1 rank (5) on host node2:\n" in summary
+    assert summary.count("Its expected path was /stale/node1/pusimp_dependency_one/__init__.py") == 1
+    assert summary.count("Its expected path was /stale/node2/pusimp_dependency_one/__init__.py") == 1
+    for rank in (0, 2, 3, 4, 5):
+        assert str(outcomes[rank]) == (
+            "pusimp_mpi_package found problems with its dependencies. "
+            "See the error reported by rank 1 for more details.")
+
+
+def test_check_across_ranks_success(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that no rank fails when every rank passes the check."""
+    correct_guard = create_guard(pusimp_golden_source.system_path)
+    assert run_ranks(monkeypatch, [correct_guard] * 4, ["node0"] * 4) == [None] * 4
+
+
+def test_check_across_ranks_allow_user_site_imports(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that no rank fails when the check is disabled by the environment variable."""
+    monkeypatch.setenv("PUSIMP_MPI_PACKAGE_ALLOW_USER_SITE_IMPORTS", "1")
+    stale_guard = create_guard("/stale")
+    assert run_ranks(monkeypatch, [stale_guard] * 2, ["node0"] * 2) == [None] * 2
+
+
+def test_check_across_ranks_warn_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that only the root rank warns with the warn_once failure policy."""
+    stale_guard = create_guard("/stale", failure_policy="warn_once")
+    with warnings.catch_warnings(record=True) as recorded_warnings:
+        warnings.simplefilter("always")
+        assert run_ranks(monkeypatch, [stale_guard] * 3, ["node0", "node1", "node1"]) == [None] * 3
+    assert len(recorded_warnings) == 1
+    assert "Problem 1 was found on 3 ranks (0-2) on hosts node0, node1:\n" in str(recorded_warnings[0].message)
+
+
+def test_check_across_ranks_monitor_imports(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that imports are monitored after a successful collective check, if requested."""
+    started_monitors: typing.List[str] = []
+    monkeypatch.setattr(pusimp.Guard, "_start_import_monitor", lambda guard, policy: started_monitors.append(policy))
+    correct_guard = create_guard(pusimp_golden_source.system_path, monitor_imports=True)
+    assert run_ranks(monkeypatch, [correct_guard] * 2, ["node0"] * 2) == [None] * 2
+    assert started_monitors == ["raise"] * 2
+
+
+def test_check_across_ranks_world_communicator(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the world communicator of mpi4py is used if no communicator is provided."""
+    barrier = threading.Barrier(1)
+    mpi_module = types.ModuleType("mpi4py.MPI")
+    mpi_module.COMM_WORLD = FakeCommunicator(0, [None], barrier)  # type: ignore[attr-defined]
+    mpi4py_module = types.ModuleType("mpi4py")
+    mpi4py_module.MPI = mpi_module  # type: ignore[attr-defined]
+    monkeypatch.setitem(sys.modules, "mpi4py", mpi4py_module)
+    monkeypatch.setitem(sys.modules, "mpi4py.MPI", mpi_module)
+    with pytest.raises(ImportError, match="found problems with its dependencies on 1 out of 1 ranks"):
+        pusimp.mpi.check_across_ranks(create_guard("/stale"))
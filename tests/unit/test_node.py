@@ -0,0 +1,184 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.node on processes simulated by threads, which lock separate open file descriptions."""
+
+import fcntl
+import glob
+import os
+import pathlib
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.node
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+def create_guard(dependencies_expected_prefix: str, **kwargs: typing.Any) -> pusimp.Guard:  # noqa: ANN401
+    """Create a guard on a mock package, which is correct when installed in dependencies_expected_prefix."""
+    return pusimp.Guard(
+        "pusimp_node_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        dependencies_expected_prefix, ["pusimp_dependency_one"], ["pusimp-dependency-one"], [False], [""],
+        pusimp_golden_source.pip_uninstall_call, **kwargs)
+
+
+def count_probes(monkeypatch: pytest.MonkeyPatch, delay: float = 0.0) -> typing.List[str]:
+    """Record the package name of every probe of the dependencies, delaying each probe by the given time."""
+    probes: typing.List[str] = []
+    original_diagnose = pusimp.Guard._diagnose
+
+    def _(guard: pusimp.Guard) -> typing.Tuple[typing.Optional[str], str]:
+        probes.append(guard.package_name)
+        time.sleep(delay)
+        return original_diagnose(guard)
+
+    monkeypatch.setattr(pusimp.Guard, "_diagnose", _)
+    return probes
+
+
+def test_check_on_node(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that concurrent processes probe the dependencies once, and reuse the result of the first process."""
+    probes = count_probes(monkeypatch, 0.2)
+    stale_guard = create_guard("/stale")
+    outcomes: typing.List[typing.Optional[BaseException]] = [None] * 4
+
+    def run_process(process_id: int) -> None:
+        try:
+            pusimp.node.check_on_node(stale_guard, str(tmp_path))
+        except ImportError as process_error:
+            outcomes[process_id] = process_error
+
+    threads = [threading.Thread(target=run_process, args=(process_id, )) for process_id in range(len(outcomes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert probes == ["pusimp_node_package"]
+    assert all(isinstance(outcome, ImportError) for outcome in outcomes)
+    assert len({str(outcome) for outcome in outcomes}) == 1
+    assert "Its expected path was /stale/pusimp_dependency_one/__init__.py" in str(outcomes[0])
+    assert len(glob.glob(str(tmp_path / "pusimp-pusimp_node_package-*.json"))) == 1
+
+
+def test_check_on_node_success(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that a successful result is reused as well."""
+    probes = count_probes(monkeypatch)
+    correct_guard = create_guard(pusimp_golden_source.system_path, check_tier="spec")
+    for _ in range(2):
+        pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    assert probes == ["pusimp_node_package"]
+
+
+def test_check_on_node_environment_changed(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that a result is not reused after the environment changed."""
+    probes = count_probes(monkeypatch)
+    correct_guard = create_guard(pusimp_golden_source.system_path, check_tier="spec")
+    pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    with ImportSandbox():
+        sys.path.insert(0, tempfile.gettempdir())
+        pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    assert probes == ["pusimp_node_package"] * 2
+
+
+def test_check_on_node_stale_lock(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that a process probes the dependencies by itself if the lock is not released within the timeout."""
+    probes = count_probes(monkeypatch)
+    stale_guard = create_guard("/stale", failure_policy="warn_once")
+    lock_paths = []
+    with pytest.warns(UserWarning, match="pusimp_dependency_one is missing"):
+        pusimp.node.check_on_node(stale_guard, str(tmp_path))
+    for result_path in glob.glob(str(tmp_path / "*.json")):
+        os.remove(result_path)
+        lock_paths.append(result_path.replace(".json", ".lock"))
+    assert len(lock_paths) == 1
+    hung_lock_fd = os.open(lock_paths[0], os.O_RDWR)
+    try:
+        fcntl.flock(hung_lock_fd, fcntl.LOCK_EX)
+        start = time.monotonic()
+        pusimp.node.check_on_node(stale_guard, str(tmp_path), timeout=0.1)
+        assert time.monotonic() - start >= 0.1
+    finally:
+        os.close(hung_lock_fd)
+    assert probes == ["pusimp_node_package"] * 2
+    assert len(glob.glob(str(tmp_path / "*.json"))) == 1
+
+
+@pytest.mark.parametrize("result_content", ["not json", "[[1, 2]]", '{"key": "other", "import_error": null}'])
+def test_check_on_node_invalid_result(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path, result_content: str
+) -> None:
+    """Test that invalid or mismatching results are ignored, and replaced."""
+    probes = count_probes(monkeypatch)
+    correct_guard = create_guard(pusimp_golden_source.system_path, check_tier="spec")
+    pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    (result_path, ) = glob.glob(str(tmp_path / "*.json"))
+    with open(result_path, "w") as result_file:
+        result_file.write(result_content)
+    pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    assert probes == ["pusimp_node_package"] * 2
+    pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    assert probes == ["pusimp_node_package"] * 2
+
+
+def test_check_on_node_result_of_other_user(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that results owned by a different user are not trusted."""
+    probes = count_probes(monkeypatch)
+    correct_guard = create_guard(pusimp_golden_source.system_path, check_tier="spec")
+    pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    user_id = os.getuid()
+    (result_path, ) = glob.glob(str(tmp_path / "*.json"))
+    os.rename(result_path, result_path.replace(f"-{user_id}-", f"-{user_id + 1}-"))
+    monkeypatch.setattr(os, "getuid", lambda: user_id + 1)
+    pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    assert probes == ["pusimp_node_package"] * 2
+
+
+def test_check_on_node_not_shared(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that checks with the integrity tier or disabled by the environment variable do not share results."""
+    probes = count_probes(monkeypatch)
+    correct_guard = create_guard(
+        pusimp_golden_source.system_path, check_tier="integrity", dependencies_integrity_manifest=[None])
+    pusimp.node.check_on_node(correct_guard, str(tmp_path))
+    assert probes == ["pusimp_node_package"]
+    monkeypatch.setenv("PUSIMP_NODE_PACKAGE_ALLOW_USER_SITE_IMPORTS", "1")
+    pusimp.node.check_on_node(create_guard("/stale"), str(tmp_path))
+    assert probes == ["pusimp_node_package"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_check_on_node_monitor_imports(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test that imports are monitored after the check, if requested."""
+    started_monitors: typing.List[str] = []
+    monkeypatch.setattr(pusimp.Guard, "_start_import_monitor", lambda guard, policy: started_monitors.append(policy))
+    pusimp.node.check_on_node(
+        create_guard(pusimp_golden_source.system_path, check_tier="spec", monitor_imports=True), str(tmp_path))
+    assert started_monitors == ["raise"]
+
+
+def test_node_runtime_directory(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """Test the choice of the runtime directory."""
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert pusimp.node.node_runtime_directory() == str(tmp_path)
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    monkeypatch.setattr(os.path, "isdir", lambda path: path == "/dev/shm")
+    assert pusimp.node.node_runtime_directory() == "/dev/shm"
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+    assert pusimp.node.node_runtime_directory() == tempfile.gettempdir()
+
+
+def test_node_lock_error(tmp_path: pathlib.Path) -> None:
+    """Test that errors other than a lock held by another process are not swallowed."""
+    closed_fd = os.open(tmp_path / "closed.lock", os.O_RDWR | os.O_CREAT)
+    os.close(closed_fd)
+    with pytest.raises(OSError, match="Bad file descriptor"):
+        pusimp.node._lock(closed_fd, 0.0, 0.0)
@@ -0,0 +1,415 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test optional arguments of pusimp.prevent_user_site_imports on mock layouts created on the fly."""
+
+import importlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import typing
+import warnings
+
+import pytest
+
+import pusimp
+from pusimp.utils import create_mock_distribution, ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+class MockSites:
+    """Create a mock system site and a mock user site, and add them to sys.path in an import sandbox.
+
+    The system site contains a correct dependency pusimp_tier_correct, a broken dependency pusimp_tier_broken,
+    and dependencies pusimp_tier_shadowed and pusimp_tier_module which are shadowed by a package and
+    by a single-file module in the user site, respectively.
+    """
+
+    def __init__(self) -> None:
+        self.system_site_path = tempfile.mkdtemp()
+        create_mock_distribution(self.system_site_path, {
+            "pusimp_tier_correct/__init__.py": "",
+            "pusimp_tier_broken/__init__.py": "raise RuntimeError('purposely broken')",
+            "pusimp_tier_shadowed/__init__.py": "", "pusimp_tier_module/__init__.py": ""
+        })
+        self.user_site_path = tempfile.mkdtemp()
+        create_mock_distribution(
+            self.user_site_path, {"pusimp_tier_shadowed/__init__.py": "", "pusimp_tier_module.py": ""})
+        self._sandbox = ImportSandbox()
+
+    def __enter__(self) -> "MockSites":
+        """Enter the import sandbox, and add the mock sites to sys.path."""
+        self._sandbox.__enter__()
+        sys.path.insert(0, self.user_site_path)
+        sys.path.insert(1, self.system_site_path)
+        return self
+
+    def __exit__(
+        self, exception_type: typing.Optional[typing.Type[BaseException]],
+        exception_value: typing.Optional[BaseException],
+        traceback: typing.Optional[types.TracebackType]
+    ) -> None:
+        """Exit the import sandbox, and remove the mock sites."""
+        self._sandbox.__exit__(exception_type, exception_value, traceback)
+        shutil.rmtree(self.system_site_path, ignore_errors=True)
+        shutil.rmtree(self.user_site_path, ignore_errors=True)
+
+    def guard(
+        self, dependencies_import_name: typing.List[str], kwargs: typing.Optional[typing.Dict[str, typing.Any]] = None
+    ) -> None:
+        """Call pusimp.prevent_user_site_imports on mandatory dependencies of a mock package."""
+        pusimp.prevent_user_site_imports(
+            "pusimp_tier_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+            self.system_site_path, dependencies_import_name,
+            [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+            [False] * len(dependencies_import_name), [""] * len(dependencies_import_name),
+            pusimp_golden_source.pip_uninstall_call, **(kwargs or {}))
+
+    def guard_error(
+        self, dependencies_import_name: typing.List[str], kwargs: typing.Optional[typing.Dict[str, typing.Any]] = None
+    ) -> str:
+        """Call pusimp.prevent_user_site_imports on mandatory dependencies, and return the ImportError text."""
+        with pytest.raises(ImportError) as excinfo:
+            self.guard(dependencies_import_name, kwargs)
+        import_error_text = str(excinfo.value)
+        print(f"The following ImportError was raised:\n{import_error_text}")
+        return import_error_text
+
+
+@pytest.mark.parametrize("check_tier", ["static", "spec"])
+def test_check_tier_without_import(check_tier: str) -> None:
+    """Test that the static and spec tiers detect user-site dependencies without importing them."""
+    with MockSites() as mock_sites:
+        mock_sites.guard(["pusimp_tier_correct", "pusimp_tier_broken"], {"check_tier": check_tier})
+        import_error_text = mock_sites.guard_error(
+            ["pusimp_tier_correct", "pusimp_tier_shadowed"], {"check_tier": check_tier})
+        assert (
+            "* pusimp_tier_shadowed was imported from a local path: expected in "
+            f"{os.path.join(mock_sites.system_site_path, 'pusimp_tier_shadowed', '__init__.py')}, but imported from "
+            f"{os.path.join(mock_sites.user_site_path, 'pusimp_tier_shadowed', '__init__.py')}."
+        ) in import_error_text
+        assert "pusimp_tier_correct" not in import_error_text
+        for dependency_import_name in ("pusimp_tier_correct", "pusimp_tier_broken", "pusimp_tier_shadowed"):
+            assert dependency_import_name not in sys.modules
+
+
+@pytest.mark.parametrize("check_tier", ["static", "spec"])
+def test_check_tier_without_import_not_found(check_tier: str) -> None:
+    """Test that the static and spec tiers report dependencies which cannot be found on sys.path as broken."""
+    with MockSites() as mock_sites:
+        sys.path.remove(mock_sites.system_site_path)
+        import_error_text = mock_sites.guard_error(["pusimp_tier_correct"], {"check_tier": check_tier})
+        assert (
+            "* pusimp_tier_correct is broken. Error on import was 'No module named 'pusimp_tier_correct''."
+        ) in import_error_text
+
+
+def test_check_tier_static_module_and_imported() -> None:
+    """Test the static tier on single-file modules and on dependencies which were already imported."""
+    with MockSites() as mock_sites:
+        import_error_text = mock_sites.guard_error(["pusimp_tier_module"], {"check_tier": "static"})
+        assert f"but imported from {os.path.join(mock_sites.user_site_path, 'pusimp_tier_module.py')}." in (
+            import_error_text)
+        sys.path.remove(mock_sites.system_site_path)
+        sys.path.insert(0, "")
+        current_working_directory = os.getcwd()
+        os.chdir(mock_sites.system_site_path)
+        try:
+            importlib.import_module("pusimp_tier_correct")
+            mock_sites.guard(["pusimp_tier_correct"], {"check_tier": "static"})
+            sys.modules["pusimp_tier_correct"].__file__ = "/unknown"
+            assert "but imported from /unknown." in mock_sites.guard_error(
+                ["pusimp_tier_correct"], {"check_tier": "static"})
+        finally:
+            os.chdir(current_working_directory)
+
+
+def test_escalation_tier() -> None:
+    """Test that only dependencies flagged by the check tier are checked again with the escalation tier."""
+    with MockSites() as mock_sites:
+        import_error_text = mock_sites.guard_error(
+            ["pusimp_tier_broken", "pusimp_tier_shadowed"], {"check_tier": "static", "escalation_tier": "import"})
+        assert "pusimp_tier_broken" not in import_error_text
+        assert "* pusimp_tier_shadowed was imported from a local path" in import_error_text
+        assert "pusimp_tier_broken" not in sys.modules
+        assert "pusimp_tier_shadowed" in sys.modules
+
+
+def test_check_tier_environment_variables(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that check tier, escalation tier and failure policy can be overridden by environment variables."""
+    with MockSites() as mock_sites:
+        monkeypatch.setenv("PUSIMP_TIER_PACKAGE_USER_SITE_IMPORTS_CHECK_TIER", "spec")
+        monkeypatch.setenv("PUSIMP_TIER_PACKAGE_USER_SITE_IMPORTS_ESCALATION_TIER", "")
+        mock_sites.guard(["pusimp_tier_broken"], {"escalation_tier": "import"})
+        monkeypatch.setenv("PUSIMP_TIER_PACKAGE_USER_SITE_IMPORTS_CHECK_TIER", "import")
+        monkeypatch.setenv("PUSIMP_TIER_PACKAGE_USER_SITE_IMPORTS_FAILURE_POLICY", "warn_once")
+        with pytest.warns(UserWarning, match="pusimp_tier_broken is broken"):
+            mock_sites.guard(["pusimp_tier_broken"], {"check_tier": "static", "failure_policy": "raise"})
+
+
+def test_failure_policy_warn_once() -> None:
+    """Test that the warn_once failure policy emits the same warning only once."""
+    with MockSites() as mock_sites:
+        with pytest.warns(UserWarning, match="pusimp_tier_shadowed was imported from a local path"):
+            mock_sites.guard(["pusimp_tier_shadowed"], {"failure_policy": "warn_once"})
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            mock_sites.guard(["pusimp_tier_shadowed"], {"failure_policy": "warn_once"})
+
+
+def test_failure_policy_fail_fast() -> None:
+    """Test that the fail_fast failure policy stops at the first problem."""
+    with MockSites() as mock_sites:
+        import_error_text = mock_sites.guard_error(
+            ["pusimp_tier_correct", "pusimp_tier_broken", "pusimp_tier_shadowed"], {"failure_policy": "fail_fast"})
+        assert "* pusimp_tier_broken is broken" in import_error_text
+        assert "pusimp_tier_shadowed" not in import_error_text
+        assert "pusimp_tier_shadowed" not in sys.modules
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"check_tier": "not_a_tier"},
+        {"escalation_tier": "not_a_tier"},
+        {"check_tier": "import", "escalation_tier": "spec"},
+        {"failure_policy": "not_a_policy"}
+    ]
+)
+def test_invalid_check_arguments(kwargs: typing.Dict[str, str]) -> None:
+    """Test that invalid tiers and failure policies are rejected."""
+    with MockSites() as mock_sites:
+        with pytest.raises(AssertionError):
+            mock_sites.guard(["pusimp_tier_correct"], kwargs)
+
+
+def gate_classify_dependencies(
+    monkeypatch: pytest.MonkeyPatch, gated_import_name: str,
+    side_effect: typing.Optional[typing.Callable[[], None]] = None
+) -> typing.Tuple[typing.List[str], threading.Event]:
+    """Make the classification of a dependency wait on an event, and record the dependency guarded by each call."""
+    guard_module = importlib.import_module("pusimp.prevent_user_site_imports")
+    original_classify_dependencies = guard_module._classify_dependencies
+    calls: typing.List[str] = []
+    release = threading.Event()
+
+    def _(*args: typing.Any) -> typing.Any:  # noqa: ANN401
+        calls.append(args[1][0])
+        if args[1][0] == gated_import_name:
+            release.wait()
+            if side_effect is not None:
+                side_effect()
+        return original_classify_dependencies(*args)
+
+    monkeypatch.setattr(guard_module, "_classify_dependencies", _)
+    return (calls, release)
+
+
+def run_guards_in_threads(
+    guards: typing.List[typing.Callable[[], None]], release: threading.Event
+) -> typing.List[typing.Optional[BaseException]]:
+    """Run guards in concurrent threads, release them once all wait on the first one, and return their outcome."""
+    outcomes: typing.List[typing.Optional[BaseException]] = [None] * len(guards)
+
+    def run_guard(guard_id: int) -> None:
+        try:
+            guards[guard_id]()
+        except BaseException as exception:
+            outcomes[guard_id] = exception
+
+    flights = importlib.import_module("pusimp.prevent_user_site_imports")._flights
+    threads = [threading.Thread(target=run_guard, args=(guard_id, )) for guard_id in range(len(guards))]
+    for thread in threads:
+        thread.start()
+    while sum(flight.waiters for flight in list(flights.values())) < len(guards) - 1:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_single_flight(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that concurrent and later guards with the same configuration probe the dependencies only once."""
+    guard_module = importlib.import_module("pusimp.prevent_user_site_imports")
+    (calls, release) = gate_classify_dependencies(monkeypatch, "pusimp_tier_correct")
+    with MockSites() as mock_sites:
+        outcomes = run_guards_in_threads([lambda: mock_sites.guard(["pusimp_tier_correct"])] * 4, release)
+        assert outcomes == [None] * 4
+        assert calls == ["pusimp_tier_correct"]
+        assert guard_module._flights == {}
+        mock_sites.guard(["pusimp_tier_correct"])
+        assert calls == ["pusimp_tier_correct"]
+        pusimp.clear_verdicts()
+        mock_sites.guard(["pusimp_tier_correct"])
+        assert calls == ["pusimp_tier_correct"] * 2
+        sys.path.insert(0, mock_sites.user_site_path)
+        mock_sites.guard(["pusimp_tier_correct"])
+        assert calls == ["pusimp_tier_correct"] * 3
+
+
+def test_single_flight_memoized_failure() -> None:
+    """Test that later guards with the same configuration report the memoized problems."""
+    with MockSites() as mock_sites:
+        import_error_text = mock_sites.guard_error(["pusimp_tier_shadowed"])
+        assert mock_sites.guard_error(["pusimp_tier_shadowed"]) == import_error_text
+
+
+def test_single_flight_integrity_not_memoized(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that verdicts of guards which check integrity are not memoized."""
+    (calls, release) = gate_classify_dependencies(monkeypatch, "pusimp_tier_correct")
+    release.set()
+    with MockSites() as mock_sites:
+        mock_sites.guard(["pusimp_tier_correct"], {"check_tier": "integrity"})
+        mock_sites.guard(["pusimp_tier_correct"], {"check_tier": "integrity"})
+        assert calls == ["pusimp_tier_correct"] * 2
+
+
+def test_single_flight_failure(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that concurrent guards with the same configuration all raise the error found by the first one."""
+    (calls, release) = gate_classify_dependencies(monkeypatch, "pusimp_tier_shadowed")
+    with MockSites() as mock_sites:
+        outcomes = run_guards_in_threads([lambda: mock_sites.guard(["pusimp_tier_shadowed"])] * 4, release)
+        assert calls == ["pusimp_tier_shadowed"]
+        assert all(isinstance(outcome, ImportError) for outcome in outcomes)
+        assert len({str(outcome) for outcome in outcomes}) == 1
+        assert "* pusimp_tier_shadowed was imported from a local path" in str(outcomes[0])
+
+
+def test_single_flight_exception(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that concurrent guards with the same configuration all raise an unexpected exception of the first one."""
+    def side_effect() -> None:
+        raise RuntimeError("Unexpected error")
+
+    (calls, release) = gate_classify_dependencies(monkeypatch, "pusimp_tier_correct", side_effect)
+    with MockSites() as mock_sites:
+        outcomes = run_guards_in_threads([lambda: mock_sites.guard(["pusimp_tier_correct"])] * 4, release)
+        assert calls == ["pusimp_tier_correct"]
+        assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+        assert len({id(outcome) for outcome in outcomes}) == 4
+        assert sum(outcome.__cause__ is None for outcome in outcomes if outcome is not None) == 1
+
+
+def test_single_flight_unrelated_configurations(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a guard does not wait on concurrent guards with a different configuration."""
+    (calls, release) = gate_classify_dependencies(monkeypatch, "pusimp_tier_correct")
+    with MockSites() as mock_sites:
+        blocked_guard = threading.Thread(target=lambda: mock_sites.guard(["pusimp_tier_correct"]))
+        blocked_guard.start()
+        while len(calls) == 0:
+            time.sleep(0.01)
+        mock_sites.guard(["pusimp_tier_broken", "pusimp_tier_correct"], {"check_tier": "static"})
+        assert blocked_guard.is_alive()
+        release.set()
+        blocked_guard.join()
+        assert calls == ["pusimp_tier_correct", "pusimp_tier_broken"]
+
+
+def test_single_flight_reentrant(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a guard which is requested again by the thread evaluating it does not wait on itself."""
+    with MockSites() as mock_sites:
+        def side_effect() -> None:
+            if len(calls) == 1:
+                mock_sites.guard(["pusimp_tier_correct"])
+
+        (calls, release) = gate_classify_dependencies(monkeypatch, "pusimp_tier_correct", side_effect)
+        release.set()
+        mock_sites.guard(["pusimp_tier_correct"])
+        assert calls == ["pusimp_tier_correct"] * 2
+        assert importlib.import_module("pusimp.prevent_user_site_imports")._flights == {}
+
+
+def create_guard(
+    mock_sites: MockSites, dependencies_import_name: typing.List[str], **kwargs: typing.Any  # noqa: ANN401
+) -> pusimp.Guard:
+    """Create a pusimp.Guard on mandatory dependencies of a mock package."""
+    return pusimp.Guard(
+        "pusimp_tier_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        mock_sites.system_site_path, dependencies_import_name,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+        [False] * len(dependencies_import_name), [""] * len(dependencies_import_name),
+        pusimp_golden_source.pip_uninstall_call, **kwargs)
+
+
+def test_guard() -> None:
+    """Test that a guard reports the same errors of pusimp.prevent_user_site_imports, on every check."""
+    with MockSites() as mock_sites:
+        guard = create_guard(mock_sites, ["pusimp_tier_correct", "pusimp_tier_shadowed"])
+        assert guard.dependencies_expected_path == tuple(
+            f"{mock_sites.system_site_path}/{dependency_import_name}/__init__.py"
+            for dependency_import_name in ("pusimp_tier_correct", "pusimp_tier_shadowed"))
+        import_error_text = mock_sites.guard_error(["pusimp_tier_correct", "pusimp_tier_shadowed"])
+        for _ in range(2):
+            with pytest.raises(ImportError) as excinfo:
+                guard.check()
+            assert str(excinfo.value) == import_error_text
+        create_guard(mock_sites, ["pusimp_tier_correct"]).check()
+
+
+def test_guard_expected_path() -> None:
+    """Test that the expected paths precomputed by a guard match the ones computed by _classify_dependencies."""
+    guard_module = importlib.import_module("pusimp.prevent_user_site_imports")
+    with MockSites() as mock_sites:
+        guard = create_guard(mock_sites, ["pusimp_tier_correct", "pusimp_tier_shadowed"], check_tier="static")
+        assert guard_module._classify_dependencies(
+            guard.dependencies_expected_prefix, guard.dependencies_import_name, guard.dependencies_optional,
+            "static"
+        ) == guard_module._classify_dependencies(
+            guard.dependencies_expected_prefix, guard.dependencies_import_name, guard.dependencies_optional,
+            "static", None, False, guard.dependencies_expected_path)
+
+
+def test_guard_environment_variables(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that environment variables are read on every check of a guard, rather than on its creation."""
+    with MockSites() as mock_sites:
+        guard = create_guard(mock_sites, ["pusimp_tier_shadowed"], check_tier="static")
+        monkeypatch.setenv("PUSIMP_TIER_PACKAGE_USER_SITE_IMPORTS_FAILURE_POLICY", "warn_once")
+        with pytest.warns(UserWarning, match="pusimp_tier_shadowed was imported from a local path"):
+            guard.check()
+        monkeypatch.setenv("PUSIMP_TIER_PACKAGE_ALLOW_USER_SITE_IMPORTS", "1")
+        monkeypatch.delenv("PUSIMP_TIER_PACKAGE_USER_SITE_IMPORTS_FAILURE_POLICY")
+        guard.check()
+        monkeypatch.delenv("PUSIMP_TIER_PACKAGE_ALLOW_USER_SITE_IMPORTS")
+        monkeypatch.setenv("PUSIMP_TIER_PACKAGE_USER_SITE_IMPORTS_CHECK_TIER", "invalid")
+        with pytest.raises(AssertionError, match="Invalid check tier invalid"):
+            guard.check()
+
+
+def test_guard_invalid_arguments() -> None:
+    """Test that the arguments of a guard are validated on creation."""
+    with MockSites() as mock_sites:
+        with pytest.raises(AssertionError, match="Incorrect input lengths"):
+            create_guard(mock_sites, ["pusimp_tier_correct"], dependencies_version_constraint=[None, None])
+        with pytest.raises(AssertionError, match="Invalid failure policy invalid"):
+            create_guard(mock_sites, ["pusimp_tier_correct"], failure_policy="invalid")
+
+
+def test_guard_immutable() -> None:
+    """Test that guards cannot be modified."""
+    with MockSites() as mock_sites:
+        guard = create_guard(mock_sites, ["pusimp_tier_correct"])
+        with pytest.raises(AttributeError, match="guards are immutable"):
+            guard.check_tier = "static"
+        with pytest.raises(AttributeError, match="guards are immutable"):
+            del guard.check_tier
+        assert guard.check_tier == "import"
+
+
+def test_guard_pickle() -> None:
+    """Test that a guard can be pickled, and checked again after unpickling."""
+    with MockSites() as mock_sites:
+        guard = create_guard(
+            mock_sites, ["pusimp_tier_shadowed"], check_tier="static", dependencies_version_constraint=[None])
+        unpickled_guard = pickle.loads(pickle.dumps(guard))
+        for name in pusimp.Guard.__slots__:
+            assert getattr(unpickled_guard, name) == getattr(guard, name)
+        with pytest.raises(ImportError, match="pusimp_tier_shadowed was imported from a local path"):
+            unpickled_guard.check()
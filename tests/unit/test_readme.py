@@ -13,6 +13,8 @@ import tempfile
 
 import pytest
 
+from pusimp.utils import ImportSandbox
+
 
 def test_readme() -> None:
     """Test the snippet in README.md."""
@@ -40,8 +42,6 @@ def test_readme() -> None:
     mock_executable_path = "python3"
     mock_system_site_path = tempfile.mkdtemp()
     mock_user_site_path = tempfile.mkdtemp()
-    sys.path.insert(0, mock_user_site_path)
-    sys.path.insert(1, mock_system_site_path)
     # Write package and dependencies to disk
     packages_code = {
         "my_package": code_snippet.replace(readme_system_site_path, mock_system_site_path),
@@ -58,8 +58,11 @@ def test_readme() -> None:
                 init_file.write(package_code)
     shutil.rmtree(os.path.join(mock_user_site_path, "my_dependency_one"), ignore_errors=True)
     try:
-        with pytest.raises(ImportError) as excinfo:
-            importlib.import_module("my_package")
+        with ImportSandbox():
+            sys.path.insert(0, mock_user_site_path)
+            sys.path.insert(1, mock_system_site_path)
+            with pytest.raises(ImportError) as excinfo:
+                importlib.import_module("my_package")
         import_error_text = str(excinfo.value)
         import_error_text = import_error_text.replace(f"{sys.executable} -m", f"{mock_executable_path} -m")
         import_error_text = import_error_text.replace(mock_system_site_path, readme_system_site_path)
@@ -67,8 +70,6 @@ def test_readme() -> None:
         import_error_text = "\n".join([line.rstrip() for line in import_error_text.splitlines()])
         print(f"The following ImportError was raised:\n{import_error_text}")
     finally:
-        del sys.path[0]
-        del sys.path[1]
         shutil.rmtree(mock_user_site_path, ignore_errors=True)
         shutil.rmtree(mock_system_site_path, ignore_errors=True)
     # Check that the README is up to date with the current error message
@@ -0,0 +1,114 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the transitive dependencies walk defined in pusimp.requirement_graph."""
+
+import os
+import shutil
+import sys
+import tempfile
+import typing
+
+import pytest
+
+import pusimp
+import pusimp.requirement_graph
+from pusimp.requirement_graph import transitive_dependencies
+from pusimp.utils import create_mock_distribution, ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+
+@pytest.fixture
+def mock_prefix() -> typing.Iterator[str]:
+    """Create a mock prefix with a small requirement graph, containing a cycle and an extras requirement."""
+    prefix = tempfile.mkdtemp()
+    create_mock_distribution(
+        prefix, {"pusimp_graph_direct/__init__.py": ""}, "pusimp-graph-direct",
+        ["pusimp-graph-middle>=1.0", "pusimp-graph-extra; extra == 'test'"])
+    create_mock_distribution(
+        prefix, {"pusimp_graph_middle/__init__.py": "", "pusimp_graph_middle_plugins/__init__.py": ""},
+        "pusimp-graph-middle",
+        ["pusimp_graph_leaf (>=1.0)", "pusimp-graph-absent", "pusimp-graph-direct; python_version >= '3'"])
+    create_mock_distribution(
+        prefix, {"pusimp_graph_leaf/__init__.py": ""}, "pusimp-graph-leaf", ["pusimp-graph-direct"],
+        top_level=["pusimp_graph_leaf"])
+    create_mock_distribution(prefix, {"pusimp_graph_extra/__init__.py": ""}, "pusimp-graph-extra")
+    yield prefix
+    shutil.rmtree(prefix, ignore_errors=True)
+
+
+def test_transitive_dependencies(mock_prefix: str) -> None:
+    """Test that the walk reports transitive dependencies installed in the prefix, in breadth-first order."""
+    assert transitive_dependencies(mock_prefix, ["pusimp_graph.direct"]) == [
+        ("pusimp_graph_middle", "pusimp-graph-middle", "pusimp_graph.direct"),
+        ("pusimp_graph_middle_plugins", "pusimp-graph-middle", "pusimp_graph.direct"),
+        ("pusimp_graph_leaf", "pusimp_graph_leaf", "pusimp-graph-middle")
+    ]
+    assert transitive_dependencies(mock_prefix, ["pusimp-graph-leaf"]) == [
+        ("pusimp_graph_direct", "pusimp-graph-direct", "pusimp-graph-leaf"),
+        ("pusimp_graph_middle", "pusimp-graph-middle", "pusimp-graph-direct"),
+        ("pusimp_graph_middle_plugins", "pusimp-graph-middle", "pusimp-graph-direct")
+    ]
+    assert transitive_dependencies(mock_prefix, ["pusimp-graph-absent"]) == []
+    assert transitive_dependencies(os.path.join(mock_prefix, "not_existing"), ["pusimp-graph-direct"]) == []
+
+
+def test_transitive_dependencies_import_names_fallback(mock_prefix: str) -> None:
+    """Test that the import name defaults to the normalized pypi name when no package is listed in RECORD."""
+    create_mock_distribution(mock_prefix, {}, "pusimp-graph-fallback")
+    create_mock_distribution(mock_prefix, {}, "pusimp-graph-requires-fallback", ["pusimp-graph-fallback"])
+    create_mock_distribution(mock_prefix, {"pusimp_graph_fallback/__init__.py": ""})
+    assert transitive_dependencies(mock_prefix, ["pusimp-graph-requires-fallback"]) == [
+        ("pusimp_graph_fallback", "pusimp-graph-fallback", "pusimp-graph-requires-fallback")]
+
+
+def test_transitive_dependencies_cache(mock_prefix: str) -> None:
+    """Test that the requirement graph is shared across calls, until the prefix or its distributions change."""
+    transitive_dependencies(mock_prefix, ["pusimp-graph-direct"])
+    graph = pusimp.requirement_graph._requirement_graphs[mock_prefix]
+    transitive_dependencies(mock_prefix, ["pusimp-graph-leaf"])
+    assert pusimp.requirement_graph._requirement_graphs[mock_prefix] is graph
+    os.utime(mock_prefix, ns=(0, 0))
+    transitive_dependencies(mock_prefix, ["pusimp-graph-direct"])
+    assert pusimp.requirement_graph._requirement_graphs[mock_prefix] is not graph
+    graph = pusimp.requirement_graph._requirement_graphs[mock_prefix]
+    # Same modification time, as on filesystems with coarse timestamps, but different distributions
+    create_mock_distribution(mock_prefix, {"pusimp_graph_new/__init__.py": ""}, "pusimp-graph-new")
+    os.utime(mock_prefix, ns=(0, 0))
+    transitive_dependencies(mock_prefix, ["pusimp-graph-direct"])
+    assert pusimp.requirement_graph._requirement_graphs[mock_prefix] is not graph
+
+
+def test_prevent_user_site_imports_transitive(mock_prefix: str) -> None:
+    """Test that pusimp.prevent_user_site_imports reports user-site imports of transitive dependencies."""
+    user_site = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(user_site, "pusimp_graph_leaf"))
+        open(os.path.join(user_site, "pusimp_graph_leaf", "__init__.py"), "w").close()
+        guard_arguments = (
+            "pusimp_graph_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+            mock_prefix, ["pusimp_graph_direct"], ["pusimp-graph-direct"], [False], [""],
+            pusimp_golden_source.pip_uninstall_call
+        )
+        with ImportSandbox():
+            sys.path.insert(0, user_site)
+            sys.path.insert(1, mock_prefix)
+            pusimp.prevent_user_site_imports(*guard_arguments)
+            with pytest.raises(ImportError) as excinfo:
+                pusimp.prevent_user_site_imports(
+                    *guard_arguments, guard_transitive_dependencies=True, dependencies_integrity_manifest=[None],
+                    dependencies_version_constraint=[None])
+        import_error_text = str(excinfo.value)
+        print(f"The following ImportError was raised:\n{import_error_text}")
+        assert (
+            "* pusimp_graph_leaf was imported from a local path: expected in "
+            f"{os.path.join(mock_prefix, 'pusimp_graph_leaf', '__init__.py')}, but imported from "
+            f"{os.path.join(user_site, 'pusimp_graph_leaf', '__init__.py')}.\n"
+        ) in import_error_text
+        assert "Note that pusimp_graph_leaf is required by pusimp-graph-middle.\n" in import_error_text
+        assert "pusimp_graph_middle " not in import_error_text
+    finally:
+        shutil.rmtree(user_site, ignore_errors=True)
@@ -0,0 +1,217 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.sys_path_safety on mock sites created on the fly."""
+
+import importlib
+import importlib.abc
+import importlib.machinery
+import os
+import pathlib
+import site
+import sys
+import types
+import typing
+import zipfile
+import zipimport
+
+import pytest
+
+import pusimp
+import pusimp.sys_path_safety
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+DEPENDENCIES_IMPORT_NAME = ["pusimp_safety_one", "pusimp_safety_two"]
+
+
+@pytest.fixture
+def mock_sites(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path
+) -> typing.Iterator[typing.Dict[str, pathlib.Path]]:
+    """Prepare a sys.path with a mock standard library and a missing archive ahead of a mock system site.
+
+    The mock user site is not in sys.path, as if the interpreter was run with python -s.
+    """
+    paths = {
+        site_name: tmp_path / site_name for site_name in ("stdlib", "archive.zip", "system_site", "user_site")}
+    for site_name in ("stdlib", "system_site", "user_site"):
+        paths[site_name].mkdir()
+    (paths["stdlib"] / "os.py").write_text("")
+    for dependency_import_name in DEPENDENCIES_IMPORT_NAME:
+        (paths["system_site"] / dependency_import_name).mkdir()
+        (paths["system_site"] / dependency_import_name / "__init__.py").write_text(
+            "raise RuntimeError('purposely broken')")
+    monkeypatch.setattr(site, "USER_SITE", str(paths["user_site"]))
+    monkeypatch.delenv("PYTHONPATH", raising=False)
+    with ImportSandbox():
+        sys.path[:0] = [str(paths[site_name]) for site_name in ("stdlib", "archive.zip", "system_site")]
+        yield paths
+
+
+def prove(system_site: pathlib.Path) -> bool:
+    """Prove the safety of sys.path for the mock dependencies."""
+    return pusimp.sys_path_safety.prove_sys_path_safety(
+        str(system_site), DEPENDENCIES_IMPORT_NAME,
+        [str(system_site / dependency_import_name / "__init__.py")
+         for dependency_import_name in DEPENDENCIES_IMPORT_NAME])
+
+
+def guard(system_site: pathlib.Path, **kwargs: typing.Any) -> None:  # noqa: ANN401
+    """Guard the mock dependencies, asking for a proof of the safety of sys.path."""
+    pusimp.prevent_user_site_imports(
+        "pusimp_safety_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        str(system_site), DEPENDENCIES_IMPORT_NAME,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in DEPENDENCIES_IMPORT_NAME],
+        [False] * len(DEPENDENCIES_IMPORT_NAME), [""] * len(DEPENDENCIES_IMPORT_NAME),
+        pusimp_golden_source.pip_uninstall_call, **kwargs)
+
+
+def test_prove_sys_path_safety(mock_sites: typing.Dict[str, pathlib.Path]) -> None:
+    """Test that the proof succeeds, and that the guard then neither probes nor imports the dependencies."""
+    assert prove(mock_sites["system_site"])
+    guard(mock_sites["system_site"], prove_sys_path_safety=True)
+    assert all(dependency_import_name not in sys.modules for dependency_import_name in DEPENDENCIES_IMPORT_NAME)
+    # Without the proof, the dependencies are imported, and found to be broken.
+    with pytest.raises(ImportError, match="purposely broken"):
+        guard(mock_sites["system_site"])
+
+
+@pytest.mark.parametrize("check_tier,kwargs", [
+    ("integrity", {}),
+    ("import", {"dependencies_version_constraint": [None, None]}),
+    ("import", {"check_wheel_tags": True}),
+    ("import", {"guard_transitive_dependencies": True})
+])
+def test_prove_sys_path_safety_not_attempted(
+    mock_sites: typing.Dict[str, pathlib.Path], check_tier: str, kwargs: typing.Dict[str, typing.Any]
+) -> None:
+    """Test that the proof is not attempted when checks which do not concern locations are requested."""
+    with pytest.raises(ImportError, match="purposely broken"):
+        guard(mock_sites["system_site"], check_tier=check_tier, prove_sys_path_safety=True, **kwargs)
+
+
+def test_prove_sys_path_safety_already_imported(mock_sites: typing.Dict[str, pathlib.Path]) -> None:
+    """Test that dependencies which were already imported must have been imported from their expected path."""
+    for dependency_import_name in DEPENDENCIES_IMPORT_NAME:
+        (mock_sites["system_site"] / dependency_import_name / "__init__.py").write_text("")
+    importlib.import_module("pusimp_safety_one")
+    assert prove(mock_sites["system_site"])
+    (mock_sites["user_site"] / "pusimp_safety_two.py").write_text("")
+    sys.path.insert(0, str(mock_sites["user_site"]))
+    importlib.import_module("pusimp_safety_two")
+    del sys.path[0]
+    assert not prove(mock_sites["system_site"])
+
+
+def test_prove_sys_path_safety_shadowing(mock_sites: typing.Dict[str, pathlib.Path]) -> None:
+    """Test that the proof fails when an entry ahead of the expected prefix contains a dependency, in any form."""
+    for entry_name in (
+        "pusimp_safety_one", "pusimp_safety_one.py", "pusimp_safety_two.cpython-311-x86_64-linux-gnu.so"
+    ):
+        entry_path = mock_sites["stdlib"] / entry_name
+        if "." in entry_name:
+            entry_path.write_text("")
+        else:
+            entry_path.mkdir()
+        assert not prove(mock_sites["system_site"])
+        if entry_path.is_dir():
+            entry_path.rmdir()
+        else:
+            entry_path.unlink()
+        assert prove(mock_sites["system_site"])
+
+
+def test_prove_sys_path_safety_untrusted_entries(
+    monkeypatch: pytest.MonkeyPatch, mock_sites: typing.Dict[str, pathlib.Path]
+) -> None:
+    """Test that the proof fails when the user site, or an entry of PYTHONPATH, comes before the expected prefix."""
+    sys.path.insert(0, str(mock_sites["user_site"]))
+    assert not prove(mock_sites["system_site"])
+    monkeypatch.setattr(site, "USER_SITE", None)
+    assert prove(mock_sites["system_site"])
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(["", str(mock_sites["user_site"])]))
+    assert not prove(mock_sites["system_site"])
+
+
+def test_prove_sys_path_safety_ownership(mock_sites: typing.Dict[str, pathlib.Path], tmp_path: pathlib.Path) -> None:
+    """Test that the proof fails when an entry ahead of the expected prefix, or its ancestor, is writable by others."""
+    for site_name in ("stdlib", "archive.zip"):
+        writable_path = mock_sites[site_name] if site_name == "stdlib" else tmp_path
+        original_mode = writable_path.stat().st_mode
+        writable_path.chmod(original_mode | 0o020)
+        assert not prove(mock_sites["system_site"])
+        writable_path.chmod(original_mode)
+        assert prove(mock_sites["system_site"])
+
+
+def test_prove_sys_path_safety_importers(mock_sites: typing.Dict[str, pathlib.Path]) -> None:
+    """Test that the proof fails when an entry ahead of the expected prefix is not handled by the file finder."""
+    mock_sites["archive.zip"].write_text("")
+    assert not prove(mock_sites["system_site"])
+    mock_sites["archive.zip"].unlink()
+    class PathEntryFinder(importlib.abc.PathEntryFinder):
+        """A path entry finder which does not find any module."""
+
+        def find_spec(
+            self, fullname: str, target: typing.Optional[types.ModuleType] = None
+        ) -> typing.Optional[importlib.machinery.ModuleSpec]:
+            """Do not find the spec of any module."""
+            return None
+
+    sys.path_importer_cache[str(mock_sites["stdlib"])] = PathEntryFinder()
+    assert not prove(mock_sites["system_site"])
+    sys.path_importer_cache[str(mock_sites["stdlib"])] = importlib.machinery.FileFinder(str(mock_sites["stdlib"]))
+    assert prove(mock_sites["system_site"])
+
+
+def test_prove_sys_path_safety_zip_archives(mock_sites: typing.Dict[str, pathlib.Path]) -> None:
+    """Test that zip archives ahead of the expected prefix are listed from their central directory."""
+    sys.path.insert(1, f"{mock_sites['archive.zip']}/lib")
+    for (member_name, safe) in (
+        ("unrelated.py", True), ("pusimp_safety_one.pyc", False), ("lib/pusimp_safety_two/__init__.py", False),
+        ("lib/unrelated/pusimp_safety_two.py", True)
+    ):
+        with zipfile.ZipFile(mock_sites["archive.zip"], "w") as archive:
+            archive.writestr(member_name, "")
+        sys.path_importer_cache[str(mock_sites["archive.zip"])] = zipimport.zipimporter(str(mock_sites["archive.zip"]))
+        assert prove(mock_sites["system_site"]) == safe
+        mock_sites["archive.zip"].unlink()
+
+
+def test_prove_sys_path_safety_meta_path(mock_sites: typing.Dict[str, pathlib.Path]) -> None:
+    """Test that the proof fails when a meta path finder may find a dependency before sys.path is looked up."""
+    class Finder(importlib.abc.MetaPathFinder):
+        """A meta path finder which only finds one of the mock dependencies."""
+
+        def __init__(self, found_name: str) -> None:
+            self._found_name = found_name
+
+        def find_spec(
+            self, fullname: str, path: typing.Optional[typing.Sequence[str]],
+            target: typing.Optional[types.ModuleType] = None
+        ) -> typing.Optional[importlib.machinery.ModuleSpec]:
+            """Find the spec of the module, if it is the one this finder finds."""
+            return importlib.machinery.ModuleSpec(fullname, None) if fullname == self._found_name else None
+
+    sys.meta_path.insert(0, Finder("pusimp_unrelated"))
+    assert prove(mock_sites["system_site"])
+    sys.meta_path.insert(0, Finder("pusimp_safety_two"))
+    assert not prove(mock_sites["system_site"])
+    sys.meta_path[:] = [
+        finder for finder in sys.meta_path[1:] if finder is not importlib.machinery.PathFinder]
+    assert not prove(mock_sites["system_site"])
+
+
+def test_prove_sys_path_safety_expected_prefix(
+    mock_sites: typing.Dict[str, pathlib.Path], tmp_path: pathlib.Path
+) -> None:
+    """Test that the proof fails when the expected prefix, or a dependency in it, is missing."""
+    (mock_sites["system_site"] / "pusimp_safety_two" / "__init__.py").unlink()
+    assert not prove(mock_sites["system_site"])
+    assert not prove(tmp_path / "elsewhere")
+    sys.path.append(str(tmp_path / "elsewhere"))
+    assert not prove(tmp_path / "elsewhere")
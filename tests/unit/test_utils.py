@@ -5,18 +5,22 @@
 # SPDX-License-Identifier: MIT
 """Test utility functions defined in pusimp.utils."""
 
+import importlib
 import os
+import shutil
 import sys
+import tempfile
 import typing
 
 import pytest
 
+import pusimp.utils
 from pusimp.utils import (
     assert_has_package, assert_not_has_package, assert_package_import_error,
     assert_package_import_errors_with_broken_non_optional_packages, assert_package_import_errors_with_local_packages,
     assert_package_import_success_with_allowed_local_packages,
     assert_package_import_success_with_broken_optional_packages, assert_package_import_success_without_local_packages,
-    assert_package_location, VirtualEnv)
+    assert_package_location, ImportSandbox, run_scenario_matrix, ScenarioCase, VirtualEnv)
 
 import pusimp_golden_source  # isort: skip
 
@@ -59,6 +63,43 @@ def test_assert_package_import_error() -> None:
     )
 
 
+def test_import_sandbox() -> None:
+    """Test that the import state is restored when exiting from an import sandbox."""
+    mock_site_path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(mock_site_path, "pusimp_sandbox_parent"))
+    for module_file in ("__init__.py", "child.py"):
+        with open(os.path.join(mock_site_path, "pusimp_sandbox_parent", module_file), "w") as init_file:
+            init_file.write("# created by pytest")
+    sys_path = list(sys.path)
+    sys_meta_path = list(sys.meta_path)
+    sys_path_hooks = list(sys.path_hooks)
+    environ = dict(os.environ)
+    try:
+        with ImportSandbox():
+            sys.path.insert(0, mock_site_path)
+            pusimp_sandbox_parent = importlib.import_module("pusimp_sandbox_parent")
+            sys_path_importer_cache = dict(sys.path_importer_cache)
+            with ImportSandbox():
+                pusimp_sandbox_child = importlib.import_module("pusimp_sandbox_parent.child")
+                assert pusimp_sandbox_parent.child is pusimp_sandbox_child
+                os.environ["PUSIMP_SANDBOX_VARIABLE"] = "enabled"
+                del os.environ["PATH"]
+                sys.meta_path.clear()
+                sys.path_hooks.clear()
+                sys.path_importer_cache.clear()
+            assert sys.modules["pusimp_sandbox_parent"] is pusimp_sandbox_parent
+            assert "pusimp_sandbox_parent.child" not in sys.modules
+            assert not hasattr(pusimp_sandbox_parent, "child")
+            assert sys.path_importer_cache == sys_path_importer_cache
+        assert "pusimp_sandbox_parent" not in sys.modules
+        assert sys.path == sys_path
+        assert sys.meta_path == sys_meta_path
+        assert sys.path_hooks == sys_path_hooks
+        assert dict(os.environ) == environ
+    finally:
+        shutil.rmtree(mock_site_path, ignore_errors=True)
+
+
 def test_virtual_env() -> None:
     """Test that the creation of a virtual environment is successful."""
     with VirtualEnv() as virtual_env:
@@ -172,6 +213,57 @@ def test_uninstall_package_in_virtual_env_custom_call_failure() -> None:
         assert runtime_error_text.startswith("Uninstalling not-really-used was not successful")
 
 
+def test_install_uninstall_packages_in_virtual_env_success() -> None:
+    """Test that installing and uninstalling several packages in a virtual environment require one pip call each."""
+    with VirtualEnv() as virtual_env:
+        output_lines: typing.List[str] = []
+        virtual_env.install_packages(["my-empty-package", "six"], output_callback=output_lines.append)
+        assert len([line for line in output_lines if line.startswith("Successfully installed")]) == 1
+        for package in ("my_empty_package", "six"):
+            assert_has_package(virtual_env.executable, package)
+        output_lines.clear()
+        virtual_env.uninstall_packages(
+            ["my-empty-package", "six"], [str(virtual_env.dist_path / "my_empty_package"), "/not/really/used"],
+            output_callback=output_lines.append)
+        assert len([line for line in output_lines if line.strip().startswith("Successfully uninstalled")]) == 2
+        assert len([line for line in output_lines if line.startswith("Found existing installation")]) == 2
+        assert_not_has_package(virtual_env.executable, "my_empty_package")
+
+
+def test_install_uninstall_packages_in_virtual_env_failure() -> None:
+    """Test that installing and uninstalling several packages in a virtual environment reports failures."""
+    with VirtualEnv() as virtual_env:
+        with pytest.raises(RuntimeError) as excinfo:
+            virtual_env.install_packages(["my-empty-package", "not-existing-package"])
+        assert str(excinfo.value).startswith("Installing my-empty-package not-existing-package was not successful")
+        with pytest.raises(RuntimeError) as excinfo:
+            virtual_env.uninstall_packages(["my-empty-package"], ["/not/really/used"])
+        assert str(excinfo.value).startswith("Uninstalling my-empty-package was not successful")
+
+
+def test_merge_calls() -> None:
+    """Test that calls which only differ by the package they act on are merged."""
+    assert VirtualEnv._merge_calls([
+        ("one", "python3 -m pip install one"), ("pip", "python3 -m pip install pip"),
+        ("two", "python3 -m pip install --user two"), ("three", "python3 -m pip install three")
+    ]) == [
+        (["one", "three"], "python3 -m pip install one three"), (["pip"], "python3 -m pip install pip"),
+        (["two"], "python3 -m pip install --user two")
+    ]
+
+
+def test_merge_calls_quoted() -> None:
+    """Test that calls are compared by their shell tokens, so that packages quoted by the call are merged."""
+    assert VirtualEnv._merge_calls([
+        ("pkgx", "python3 -m pip uninstall -y 'pkgx'"), ("pkgy", "python3 -m pip uninstall -y 'pkgy'"),
+        ("'pkg-z @ file:///z'", "python3 -m pip uninstall -y 'pkg-z @ file:///z'"),
+        ("pkgw", "python3 -m pip uninstall -y pkgw 'unbalanced")
+    ]) == [
+        (["pkgx", "pkgy", "'pkg-z @ file:///z'"], "python3 -m pip uninstall -y pkgx pkgy 'pkg-z @ file:///z'"),
+        (["pkgw"], "python3 -m pip uninstall -y pkgw 'unbalanced")
+    ]
+
+
 def generate_test_data_pypi_names(import_names: typing.List[str]) -> typing.List[str]:
     """Replace underscore with dash in import names, and add installation from local directory."""
     pypi_names = [import_name.replace("_", "-") for import_name in import_names]
@@ -182,184 +274,280 @@ def generate_test_data_pypi_names(import_names: typing.List[str]) -> typing.List
     ]
 
 
-@pytest.mark.parametrize(
-    "package_name",
-    [
-        "pusimp_package_one",
-        "pusimp_package_two",
-        "pusimp_package_three",
-        # "pusimp_package_four",  # raises ImportError due to mandatory missing dependency
-        "pusimp_package_five",
-        # "pusimp_package_six",  # raises ImportError due to mandatory broken dependency
-        "pusimp_package_seven",
-        # "pusimp_package_eight",  # its dependencies are supposed to always be local
-        # "pusimp_package_nine",  # its dependencies are supposed to always be local
-        # "pusimp_package_ten",  # its dependencies are supposed to either always local, missing or broken
-    ]
-)
-def test_assert_package_import_success_without_local_packages_data(package_name: str) -> None:
-    """Test assert_package_import_success_without_local_packages on mock packages that don't raise errors on import."""
-    assert_package_import_success_without_local_packages(
-        package_name, os.path.join(pusimp_golden_source.system_path, package_name, "__init__.py")
+# Results of the scenario matrix, keyed by the name of the function which generates each case and by its data
+ScenarioMatrixResults = typing.Dict[typing.Tuple[str, str], typing.Optional[Exception]]
+
+
+def success_without_local_packages_case(package_name: str) -> ScenarioCase:
+    """Generate a case for assert_package_import_success_without_local_packages."""
+    return (
+        assert_package_import_success_without_local_packages,
+        (package_name, os.path.join(pusimp_golden_source.system_path, package_name, "__init__.py"))
     )
 
 
-@pytest.mark.parametrize(
-    "package_name,dependencies_import_name,dependencies_extra_error_message",
-    [
-        ("pusimp_package_one", ["pusimp_dependency_two"], ["pusimp_dependency_two is mandatory."]),
-        ("pusimp_package_two", ["pusimp_dependency_two"], ["pusimp_dependency_two is mandatory."]),
-        ("pusimp_package_two", ["pusimp_dependency_three"], ["pusimp_dependency_three is optional."]),
-        (
-            "pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"],
-            ["pusimp_dependency_two is mandatory.", "pusimp_dependency_three is optional."]
-        ),
-        ("pusimp_package_three", ["pusimp_dependency_two"], ["pusimp_dependency_two is mandatory."]),
-        ("pusimp_package_three", ["pusimp_dependency_three"], ["pusimp_dependency_three is optional."]),
+def errors_with_local_packages_case(
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_extra_error_message: typing.List[str]
+) -> ScenarioCase:
+    """Generate a case for assert_package_import_errors_with_local_packages."""
+    return (
+        assert_package_import_errors_with_local_packages,
         (
-            "pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"],
-            ["pusimp_dependency_two is mandatory.", "pusimp_dependency_three is optional."]
-        ),
-        # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
-        # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
-        # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
-        # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
-        ("pusimp_package_eight", ["pusimp_dependency_five"], ["pusimp_dependency_five is mandatory."]),
-        ("pusimp_package_eight", ["pusimp_dependency_six"], ["pusimp_dependency_six is optional."]),
+            package_name, dependencies_import_name, generate_test_data_pypi_names(dependencies_import_name),
+            dependencies_extra_error_message,
+            lambda executable, dependency_pypi_name: (
+                f"{executable} -m pip install --ignore-installed {dependency_pypi_name}"),
+            lambda executable, dependency_pypi_name, _: f"{executable} -m pip uninstall {dependency_pypi_name}"
+        )
+    )
+
+
+def success_with_allowed_local_packages_case(
+    package_name: str, dependencies_import_name: typing.List[str]
+) -> ScenarioCase:
+    """Generate a case for assert_package_import_success_with_allowed_local_packages."""
+    return (
+        assert_package_import_success_with_allowed_local_packages,
         (
-            "pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"],
-            ["pusimp_dependency_five is mandatory.", "pusimp_dependency_six is optional."]
-        ),
-        ("pusimp_package_nine", ["pusimp_dependency_five"], ["pusimp_dependency_five is mandatory."]),
-        ("pusimp_package_nine", ["pusimp_dependency_six"], ["pusimp_dependency_six is optional."]),
+            package_name, os.path.join(pusimp_golden_source.system_path, package_name, "__init__.py"),
+            dependencies_import_name, generate_test_data_pypi_names(dependencies_import_name),
+            lambda executable, dependency_pypi_name: (
+                f"{executable} -m pip install --ignore-installed {dependency_pypi_name}")
+        )
+    )
+
+
+def errors_with_broken_non_optional_packages_case(
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool]
+) -> ScenarioCase:
+    """Generate a case for assert_package_import_errors_with_broken_non_optional_packages."""
+    return (
+        assert_package_import_errors_with_broken_non_optional_packages,
+        (package_name, dependencies_import_name, dependencies_optional)
+    )
+
+
+def success_with_broken_optional_packages_case(
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool]
+) -> ScenarioCase:
+    """Generate a case for assert_package_import_success_with_broken_optional_packages."""
+    return (
+        assert_package_import_success_with_broken_optional_packages,
         (
-            "pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"],
-            ["pusimp_dependency_five is mandatory.", "pusimp_dependency_six is optional."]
+            package_name, os.path.join(pusimp_golden_source.system_path, package_name, "__init__.py"),
+            dependencies_import_name, dependencies_optional
         )
-        # (
-        #    "pusimp_package_ten", [], []
-        # )  # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
-    ]
-)
-def test_assert_package_import_errors_with_local_packages_data(
-    package_name: str, dependencies_import_name: typing.List[str], dependencies_extra_error_message: typing.List[str]
+    )
+
+
+@pytest.fixture(scope="module")
+def scenario_matrix_results() -> ScenarioMatrixResults:
+    """Evaluate the cases of all the data tests below at once, sharing virtual environments between them."""
+    cases_data: typing.List[typing.Tuple[typing.Callable[..., ScenarioCase], typing.Tuple[typing.Any, ...]]] = []
+    for (case_generator, data) in (
+        (success_without_local_packages_case, SUCCESS_WITHOUT_LOCAL_PACKAGES_DATA),
+        (errors_with_local_packages_case, ERRORS_WITH_LOCAL_PACKAGES_DATA),
+        (success_with_allowed_local_packages_case, SUCCESS_WITH_ALLOWED_LOCAL_PACKAGES_DATA),
+        (errors_with_broken_non_optional_packages_case, BROKEN_NON_OPTIONAL_SUCCESS_DATA),
+        (errors_with_broken_non_optional_packages_case, BROKEN_NON_OPTIONAL_FAILURE_POSITION_DATA),
+        (errors_with_broken_non_optional_packages_case, BROKEN_NON_OPTIONAL_FAILURE_ONLY_OPTIONAL_DATA),
+        (success_with_broken_optional_packages_case, SUCCESS_WITH_BROKEN_OPTIONAL_PACKAGES_DATA)
+    ):
+        cases_data.extend(
+            (case_generator, case_data if isinstance(case_data, tuple) else (case_data, )) for case_data in data)
+    results = run_scenario_matrix([case_generator(*case_data) for (case_generator, case_data) in cases_data])
+    return {
+        (case_generator.__name__, repr(case_data)): result
+        for ((case_generator, case_data), result) in zip(cases_data, results)
+    }
+
+
+def raise_scenario_result(
+    results: ScenarioMatrixResults, case_generator: typing.Callable[..., ScenarioCase],
+    *case_data: typing.Any  # noqa: ANN401
 ) -> None:
-    """Test assert_package_import_errors_with_local_packages on mock packages."""
-    assert_package_import_errors_with_local_packages(
-        package_name, dependencies_import_name, generate_test_data_pypi_names(dependencies_import_name),
-        dependencies_extra_error_message,
-        lambda executable, dependency_pypi_name: (
-            f"{executable} -m pip install --ignore-installed {dependency_pypi_name}"),
-        lambda executable, dependency_pypi_name, _: f"{executable} -m pip uninstall {dependency_pypi_name}"
+    """Raise the exception raised while evaluating a case of the scenario matrix, if any."""
+    result = results[(case_generator.__name__, repr(case_data))]
+    if result is not None:
+        raise result
+
+
+SUCCESS_WITHOUT_LOCAL_PACKAGES_DATA = [
+    "pusimp_package_one",
+    "pusimp_package_two",
+    "pusimp_package_three",
+    # "pusimp_package_four",  # raises ImportError due to mandatory missing dependency
+    "pusimp_package_five",
+    # "pusimp_package_six",  # raises ImportError due to mandatory broken dependency
+    "pusimp_package_seven",
+    # "pusimp_package_eight",  # its dependencies are supposed to always be local
+    # "pusimp_package_nine",  # its dependencies are supposed to always be local
+    # "pusimp_package_ten",  # its dependencies are supposed to either always local, missing or broken
+]
+
+
+@pytest.mark.parametrize("package_name", SUCCESS_WITHOUT_LOCAL_PACKAGES_DATA)
+def test_assert_package_import_success_without_local_packages_data(
+    package_name: str, scenario_matrix_results: ScenarioMatrixResults
+) -> None:
+    """Test assert_package_import_success_without_local_packages on mock packages that don't raise errors on import."""
+    raise_scenario_result(scenario_matrix_results, success_without_local_packages_case, package_name)
+
+
+ERRORS_WITH_LOCAL_PACKAGES_DATA = [
+    ("pusimp_package_one", ["pusimp_dependency_two"], ["pusimp_dependency_two is mandatory."]),
+    ("pusimp_package_two", ["pusimp_dependency_two"], ["pusimp_dependency_two is mandatory."]),
+    ("pusimp_package_two", ["pusimp_dependency_three"], ["pusimp_dependency_three is optional."]),
+    (
+        "pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"],
+        ["pusimp_dependency_two is mandatory.", "pusimp_dependency_three is optional."]
+    ),
+    ("pusimp_package_three", ["pusimp_dependency_two"], ["pusimp_dependency_two is mandatory."]),
+    ("pusimp_package_three", ["pusimp_dependency_three"], ["pusimp_dependency_three is optional."]),
+    (
+        "pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"],
+        ["pusimp_dependency_two is mandatory.", "pusimp_dependency_three is optional."]
+    ),
+    # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
+    # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
+    # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
+    # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
+    ("pusimp_package_eight", ["pusimp_dependency_five"], ["pusimp_dependency_five is mandatory."]),
+    ("pusimp_package_eight", ["pusimp_dependency_six"], ["pusimp_dependency_six is optional."]),
+    (
+        "pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"],
+        ["pusimp_dependency_five is mandatory.", "pusimp_dependency_six is optional."]
+    ),
+    ("pusimp_package_nine", ["pusimp_dependency_five"], ["pusimp_dependency_five is mandatory."]),
+    ("pusimp_package_nine", ["pusimp_dependency_six"], ["pusimp_dependency_six is optional."]),
+    (
+        "pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"],
+        ["pusimp_dependency_five is mandatory.", "pusimp_dependency_six is optional."]
     )
+    # (
+    #    "pusimp_package_ten", [], []
+    # )  # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
+]
 
 
 @pytest.mark.parametrize(
-    "package_name,dependencies_import_name",
-    [
-        ("pusimp_package_one", ["pusimp_dependency_two"]),
-        ("pusimp_package_two", ["pusimp_dependency_two"]),
-        ("pusimp_package_two", ["pusimp_dependency_three"]),
-        ("pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"]),
-        ("pusimp_package_three", ["pusimp_dependency_two"]),
-        ("pusimp_package_three", ["pusimp_dependency_three"]),
-        ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"]),
-        # ("pusimp_package_four", []), # pusimp_dependency_missing is not installable
-        ("pusimp_package_five", []),
-        # ("pusimp_package_six", []),  # pusimp_dependency_four is always broken
-        ("pusimp_package_seven", []),
-        ("pusimp_package_eight", ["pusimp_dependency_five"]),
-        ("pusimp_package_eight", ["pusimp_dependency_six"]),
-        ("pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"]),
-        ("pusimp_package_nine", ["pusimp_dependency_five"]),
-        ("pusimp_package_nine", ["pusimp_dependency_six"]),
-        ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"])
-        # (
-        #    "pusimp_package_ten", [], []
-        # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
-    ]
-)
+    "package_name,dependencies_import_name,dependencies_extra_error_message", ERRORS_WITH_LOCAL_PACKAGES_DATA)
+def test_assert_package_import_errors_with_local_packages_data(
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_extra_error_message: typing.List[str],
+    scenario_matrix_results: ScenarioMatrixResults
+) -> None:
+    """Test assert_package_import_errors_with_local_packages on mock packages."""
+    raise_scenario_result(
+        scenario_matrix_results, errors_with_local_packages_case, package_name, dependencies_import_name,
+        dependencies_extra_error_message)
+
+
+SUCCESS_WITH_ALLOWED_LOCAL_PACKAGES_DATA = [
+    ("pusimp_package_one", ["pusimp_dependency_two"]),
+    ("pusimp_package_two", ["pusimp_dependency_two"]),
+    ("pusimp_package_two", ["pusimp_dependency_three"]),
+    ("pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"]),
+    ("pusimp_package_three", ["pusimp_dependency_two"]),
+    ("pusimp_package_three", ["pusimp_dependency_three"]),
+    ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"]),
+    # ("pusimp_package_four", []), # pusimp_dependency_missing is not installable
+    ("pusimp_package_five", []),
+    # ("pusimp_package_six", []),  # pusimp_dependency_four is always broken
+    ("pusimp_package_seven", []),
+    ("pusimp_package_eight", ["pusimp_dependency_five"]),
+    ("pusimp_package_eight", ["pusimp_dependency_six"]),
+    ("pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"]),
+    ("pusimp_package_nine", ["pusimp_dependency_five"]),
+    ("pusimp_package_nine", ["pusimp_dependency_six"]),
+    ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"])
+    # (
+    #    "pusimp_package_ten", [], []
+    # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
+]
+
+
+@pytest.mark.parametrize("package_name,dependencies_import_name", SUCCESS_WITH_ALLOWED_LOCAL_PACKAGES_DATA)
 def test_assert_package_import_success_with_allowed_local_packages_data(
-    package_name: str, dependencies_import_name: typing.List[str]
+    package_name: str, dependencies_import_name: typing.List[str], scenario_matrix_results: ScenarioMatrixResults
 ) -> None:
     """Test assert_package_import_success_with_allowed_local_packages on mock packages."""
-    assert_package_import_success_with_allowed_local_packages(
-        package_name, os.path.join(pusimp_golden_source.system_path, package_name, "__init__.py"),
-        dependencies_import_name, generate_test_data_pypi_names(dependencies_import_name),
-        lambda executable, dependency_pypi_name: (
-            f"{executable} -m pip install --ignore-installed {dependency_pypi_name}")
-    )
+    raise_scenario_result(
+        scenario_matrix_results, success_with_allowed_local_packages_case, package_name, dependencies_import_name)
+
+
+BROKEN_NON_OPTIONAL_SUCCESS_DATA = [
+    # ("pusimp_package_one", ["pusimp_dependency_two"], [False]),  # in failure_position
+    # ("pusimp_package_two", ["pusimp_dependency_two"], [False]),  # in failure_position
+    # ("pusimp_package_two", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
+    # (
+    #    "pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]
+    # )  # in failure_position
+    ("pusimp_package_three", ["pusimp_dependency_two"], [False]),
+    # ("pusimp_package_three", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
+    ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
+    # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
+    # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
+    # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
+    # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
+    # ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),  # in failure_position
+    # ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
+    # (
+    #    "pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True]
+    # )  # in failure_position
+    ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),
+    # ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
+    ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])
+    # (
+    #    "pusimp_package_ten", [], []
+    # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
+]
 
 
 @pytest.mark.parametrize(
-    "package_name,dependencies_import_name,dependencies_optional",
-    [
-        # ("pusimp_package_one", ["pusimp_dependency_two"], [False]),  # in failure_position
-        # ("pusimp_package_two", ["pusimp_dependency_two"], [False]),  # in failure_position
-        # ("pusimp_package_two", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
-        # (
-        #    "pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]
-        # )  # in failure_position
-        ("pusimp_package_three", ["pusimp_dependency_two"], [False]),
-        # ("pusimp_package_three", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
-        ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
-        # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
-        # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
-        # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
-        # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
-        # ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),  # in failure_position
-        # ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
-        # (
-        #    "pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True]
-        # )  # in failure_position
-        ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),
-        # ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
-        ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])
-        # (
-        #    "pusimp_package_ten", [], []
-        # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
-    ]
-)
+    "package_name,dependencies_import_name,dependencies_optional", BROKEN_NON_OPTIONAL_SUCCESS_DATA)
 def test_assert_package_import_errors_with_broken_non_optional_packages_data_success(
-    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool]
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool],
+    scenario_matrix_results: ScenarioMatrixResults
 ) -> None:
     """Test success of assert_package_import_errors_with_broken_non_optional_packages on mock packages.
 
     The successful cases are the cases in which dependencies_import_name lists actual mandatory dependencies,
     and the import of the broken dependency happens after the call to pusimp.prevent_user_site_imports.
     """
-    assert_package_import_errors_with_broken_non_optional_packages(
-        package_name, dependencies_import_name, dependencies_optional
-    )
+    raise_scenario_result(
+        scenario_matrix_results, errors_with_broken_non_optional_packages_case, package_name,
+        dependencies_import_name, dependencies_optional)
+
+
+BROKEN_NON_OPTIONAL_FAILURE_POSITION_DATA = [
+    ("pusimp_package_one", ["pusimp_dependency_two"], [False]),
+    ("pusimp_package_two", ["pusimp_dependency_two"], [False]),
+    # ("pusimp_package_two", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
+    ("pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
+    # ("pusimp_package_three", ["pusimp_dependency_two"], [False]),  # in success
+    # ("pusimp_package_three", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
+    # ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),  # in success
+    # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
+    # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
+    # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
+    # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
+    ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),
+    # ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
+    ("pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])
+    # ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),  # in success
+    # ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
+    # ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])  # in success
+    # (
+    #    "pusimp_package_ten", [], []
+    # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
+]
 
 
 @pytest.mark.parametrize(
-    "package_name,dependencies_import_name,dependencies_optional",
-    [
-        ("pusimp_package_one", ["pusimp_dependency_two"], [False]),
-        ("pusimp_package_two", ["pusimp_dependency_two"], [False]),
-        # ("pusimp_package_two", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
-        ("pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
-        # ("pusimp_package_three", ["pusimp_dependency_two"], [False]),  # in success
-        # ("pusimp_package_three", ["pusimp_dependency_three"], [True]),  # in failure_only_optional
-        # ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),  # in success
-        # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
-        # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
-        # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
-        # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
-        ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),
-        # ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
-        ("pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])
-        # ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),  # in success
-        # ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),  # in failure_only_optional
-        # ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])  # in success
-        # (
-        #    "pusimp_package_ten", [], []
-        # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
-    ]
-)
+    "package_name,dependencies_import_name,dependencies_optional", BROKEN_NON_OPTIONAL_FAILURE_POSITION_DATA)
 def test_assert_package_import_errors_with_broken_non_optional_packages_data_failure_position(
-    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool]
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool],
+    scenario_matrix_results: ScenarioMatrixResults
 ) -> None:
     """Test failure of assert_package_import_errors_with_broken_non_optional_packages on mock packages.
 
@@ -367,9 +555,9 @@ def test_assert_package_import_errors_with_broken_non_optional_packages_data_fai
     in dependencies_import_name happens before the call to pusimp.prevent_user_site_imports.
     """
     with pytest.raises(AssertionError) as excinfo:
-        assert_package_import_errors_with_broken_non_optional_packages(
-            package_name, dependencies_import_name, dependencies_optional
-        )
+        raise_scenario_result(
+            scenario_matrix_results, errors_with_broken_non_optional_packages_case, package_name,
+            dependencies_import_name, dependencies_optional)
     assertion_error_text = str(excinfo.value)
     assert assertion_error_text.startswith(
         f"'* {dependencies_import_name[0]} is broken' was not found in the ImportError text, namely "
@@ -378,83 +566,169 @@ def test_assert_package_import_errors_with_broken_non_optional_packages_data_fai
     assert f"{dependencies_import_name[0]} was purposely broken" in assertion_error_text
 
 
+BROKEN_NON_OPTIONAL_FAILURE_ONLY_OPTIONAL_DATA = [
+    # ("pusimp_package_one", ["pusimp_dependency_two"], [False]),  # in failure_position
+    # ("pusimp_package_two", ["pusimp_dependency_two"], [False]),  # in failure_position
+    ("pusimp_package_two", ["pusimp_dependency_three"], [True]),
+    # (
+    #    "pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]
+    # )  # in failure_position
+    # ("pusimp_package_three", ["pusimp_dependency_two"], [False]),  # in success
+    ("pusimp_package_three", ["pusimp_dependency_three"], [True]),
+    # ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),  # in success
+    # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
+    # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
+    # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
+    # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
+    # ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),  # in failure_position
+    ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),
+    # (
+    #    "pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True]
+    # ),  # in failure_position
+    # ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),  # in success
+    ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),
+    # ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])  # in success
+    # (
+    #    "pusimp_package_ten", [], []
+    # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
+]
+
+
 @pytest.mark.parametrize(
-    "package_name,dependencies_import_name,dependencies_optional",
-    [
-        # ("pusimp_package_one", ["pusimp_dependency_two"], [False]),  # in failure_position
-        # ("pusimp_package_two", ["pusimp_dependency_two"], [False]),  # in failure_position
-        ("pusimp_package_two", ["pusimp_dependency_three"], [True]),
-        # (
-        #    "pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]
-        # )  # in failure_position
-        # ("pusimp_package_three", ["pusimp_dependency_two"], [False]),  # in success
-        ("pusimp_package_three", ["pusimp_dependency_three"], [True]),
-        # ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),  # in success
-        # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
-        # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
-        # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
-        # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
-        # ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),  # in failure_position
-        ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),
-        # (
-        #    "pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True]
-        # ),  # in failure_position
-        # ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),  # in success
-        ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),
-        # ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])  # in success
-        # (
-        #    "pusimp_package_ten", [], []
-        # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
-    ]
-)
+    "package_name,dependencies_import_name,dependencies_optional", BROKEN_NON_OPTIONAL_FAILURE_ONLY_OPTIONAL_DATA)
 def test_assert_package_import_errors_with_broken_non_optional_packages_data_failure_only_optional(
-    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool]
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool],
+    scenario_matrix_results: ScenarioMatrixResults
 ) -> None:
     """Test failure of assert_package_import_errors_with_broken_non_optional_packages on mock packages.
 
     These failing cases are the cases in which only optional dependencies have been listed in dependencies_import_name.
     """
     with pytest.raises(AssertionError) as excinfo:
-        assert_package_import_errors_with_broken_non_optional_packages(
-            package_name, dependencies_import_name, dependencies_optional
-        )
+        raise_scenario_result(
+            scenario_matrix_results, errors_with_broken_non_optional_packages_case, package_name,
+            dependencies_import_name, dependencies_optional)
     assertion_error_text = str(excinfo.value)
     assert f"Importing {package_name} was unexpectedly successful" in assertion_error_text
 
 
+SUCCESS_WITH_BROKEN_OPTIONAL_PACKAGES_DATA = [
+    ("pusimp_package_one", ["pusimp_dependency_two"], [False]),
+    ("pusimp_package_two", ["pusimp_dependency_two"], [False]),
+    ("pusimp_package_two", ["pusimp_dependency_three"], [True]),
+    ("pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
+    ("pusimp_package_three", ["pusimp_dependency_two"], [False]),
+    ("pusimp_package_three", ["pusimp_dependency_three"], [True]),
+    ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
+    # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
+    # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
+    # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
+    # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
+    ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),
+    ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),
+    ("pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True]),
+    ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),
+    ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),
+    ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])
+    # (
+    #    "pusimp_package_ten", [], []
+    # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
+]
+
+
 @pytest.mark.parametrize(
-    "package_name,dependencies_import_name,dependencies_optional",
-    [
-        ("pusimp_package_one", ["pusimp_dependency_two"], [False]),
-        ("pusimp_package_two", ["pusimp_dependency_two"], [False]),
-        ("pusimp_package_two", ["pusimp_dependency_three"], [True]),
-        ("pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
-        ("pusimp_package_three", ["pusimp_dependency_two"], [False]),
-        ("pusimp_package_three", ["pusimp_dependency_three"], [True]),
-        ("pusimp_package_three", ["pusimp_dependency_two", "pusimp_dependency_three"], [False, True]),
-        # ("pusimp_package_four", [], []), # pusimp_dependency_missing is not installable
-        # ("pusimp_package_five", [], []),  # pusimp_dependency_missing is not installable
-        # ("pusimp_package_six", [], []),  # pusimp_dependency_four is always broken
-        # ("pusimp_package_seven", [], []),  # pusimp_dependency_four is always broken
-        ("pusimp_package_eight", ["pusimp_dependency_five"], [False]),
-        ("pusimp_package_eight", ["pusimp_dependency_six"], [True]),
-        ("pusimp_package_eight", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True]),
-        ("pusimp_package_nine", ["pusimp_dependency_five"], [False]),
-        ("pusimp_package_nine", ["pusimp_dependency_six"], [True]),
-        ("pusimp_package_nine", ["pusimp_dependency_five", "pusimp_dependency_six"], [False, True])
-        # (
-        #    "pusimp_package_ten", [], []
-        # ), # pusimp_dependency_missing is not installable, pusimp_dependency_four is always broken
-    ]
-)
+    "package_name,dependencies_import_name,dependencies_optional", SUCCESS_WITH_BROKEN_OPTIONAL_PACKAGES_DATA)
 def test_assert_package_import_success_with_broken_optional_packages_data(
-    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool]
+    package_name: str, dependencies_import_name: typing.List[str], dependencies_optional: typing.List[bool],
+    scenario_matrix_results: ScenarioMatrixResults
 ) -> None:
     """Test success of assert_package_import_success_with_broken_optional_packages on mock packages.
 
     The successful cases are the cases in which dependencies_import_name lists actual optional dependencies.
     """
-    assert_package_import_success_with_broken_optional_packages(
-        package_name, os.path.join(pusimp_golden_source.system_path, package_name, "__init__.py"),
-        dependencies_import_name, dependencies_optional
-    )
+    raise_scenario_result(
+        scenario_matrix_results, success_with_broken_optional_packages_case, package_name, dependencies_import_name,
+        dependencies_optional)
+
+
+@pytest.mark.parametrize(
+    "scenario_case",
+    [
+        success_without_local_packages_case("pusimp_package_one"),
+        errors_with_local_packages_case(
+            "pusimp_package_two", ["pusimp_dependency_two", "pusimp_dependency_three"],
+            ["pusimp_dependency_two is mandatory.", "pusimp_dependency_three is optional."]),
+        success_with_allowed_local_packages_case("pusimp_package_two", ["pusimp_dependency_two"]),
+        errors_with_broken_non_optional_packages_case("pusimp_package_three", ["pusimp_dependency_two"], [False]),
+        success_with_broken_optional_packages_case("pusimp_package_three", ["pusimp_dependency_three"], [True])
+    ]
+)
+def test_scenario_helpers_without_scenario_matrix(scenario_case: ScenarioCase) -> None:
+    """Test that scenario helpers can also be called directly, each one creating its own virtual environment."""
+    (helper, arguments) = scenario_case
+    helper(*arguments)
+
+
+def test_run_scenario_matrix_state_failure() -> None:
+    """Test that run_scenario_matrix reports failures while creating a state to every case requiring it."""
+    results = run_scenario_matrix([
+        success_with_allowed_local_packages_case("pusimp_package_one", ["pusimp_dependency_not_existing"]),
+        errors_with_local_packages_case("pusimp_package_one", ["pusimp_dependency_not_existing"], [""]),
+        success_without_local_packages_case("pusimp_package_not_existing")
+    ])
+    assert isinstance(results[0], RuntimeError)
+    assert str(results[0]).startswith("Installing 'pusimp-dependency-not-existing @ file://")
+    assert results[1] is results[0]
+    assert isinstance(results[2], AssertionError)
+
+
+def test_run_scenario_matrix_uninstall_calls(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that run_scenario_matrix uninstalls local packages once for each distinct uninstallation call."""
+    calls: typing.List[typing.Tuple[str, str]] = []
+
+    class MockVirtualEnv:
+        """A virtual environment which only records the installation of packages."""
+
+        executable = "python"
+
+        def __enter__(self) -> "MockVirtualEnv":
+            return self
+
+        def __exit__(self, *args: typing.Any) -> None:  # noqa: ANN401
+            pass
+
+        def install_packages(self, packages: typing.List[str], install_call: typing.Callable[[str, str], str]) -> None:
+            calls.append(("install", ", ".join(packages)))
+
+    def mock_install_local_packages(
+        virtual_env: MockVirtualEnv, dependencies_import_name: typing.List[str],
+        dependencies_pypi_name: typing.List[str], pip_install_call: typing.Callable[[str, str], str]
+    ) -> typing.List[str]:
+        virtual_env.install_packages(dependencies_pypi_name, pip_install_call)
+        return [f"/local/{dependency_import_name}/__init__.py" for dependency_import_name in dependencies_import_name]
+
+    monkeypatch.setattr(pusimp.utils, "VirtualEnv", MockVirtualEnv)
+    monkeypatch.setattr(pusimp.utils, "_install_local_packages", mock_install_local_packages)
+    monkeypatch.setattr(pusimp.utils, "_evaluate_scenario_case", lambda *args: None)
+    monkeypatch.setattr(
+        pusimp.utils, "_uninstall_local_packages",
+        lambda virtual_env, dependencies_pypi_name, dependencies_local_paths, pip_uninstall_call: calls.append(
+            ("uninstall", pip_uninstall_call(virtual_env.executable, "pkg", dependencies_local_paths[0]))))
+    monkeypatch.setattr(
+        pusimp.utils, "assert_has_package", lambda executable, package: calls.append(("check", package)))
+    (helper, arguments) = errors_with_local_packages_case("pusimp_package_one", ["pusimp_dependency_one"], [""])
+    quoting_arguments = (*arguments[:-1], lambda executable, dependency_pypi_name, _: (
+        f"{executable} -m pip uninstall '{dependency_pypi_name}'"))
+    assert run_scenario_matrix([
+        (helper, arguments), (helper, quoting_arguments), (helper, arguments)]) == [None, None, None]
+    assert [call[0] for call in calls if call[0] != "check"] == ["install", "uninstall", "install", "uninstall"]
+    assert [call[1] for call in calls if call[0] == "uninstall"] == [
+        "python -m pip uninstall pkg", "python -m pip uninstall 'pkg'"]
+    assert calls.count(("check", "pusimp_package_one")) == 3
+
+
+def test_run_scenario_matrix_unsupported_helper() -> None:
+    """Test that run_scenario_matrix rejects functions which are not scenario helpers."""
+    with pytest.raises(AssertionError) as excinfo:
+        run_scenario_matrix([(assert_has_package, (sys.executable, "pytest"))])
+    assert str(excinfo.value) == "Unsupported scenario helper assert_has_package"
@@ -0,0 +1,95 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test the verdict tokens defined in pusimp.verdict."""
+
+import importlib
+import multiprocessing
+import os
+import shutil
+import site
+import sys
+import tempfile
+import typing
+
+import pytest
+
+import pusimp
+from pusimp.utils import ImportSandbox
+from pusimp.verdict import compute_verdict_token, verdict_environment_variable
+
+import pusimp_golden_source  # isort: skip
+
+
+def test_compute_verdict_token(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the verdict token changes with the check configuration, sys.path and the user site."""
+    user_site = tempfile.mkdtemp()
+    try:
+        monkeypatch.setattr(site, "USER_SITE", user_site)
+        token = compute_verdict_token(["prefix", ["dependency"]])
+        assert len(token) == 32
+        assert compute_verdict_token(["prefix", ["dependency"]]) == token
+        assert compute_verdict_token(["prefix", ["other_dependency"]]) != token
+        with ImportSandbox():
+            sys.path.append(user_site)
+            assert compute_verdict_token(["prefix", ["dependency"]]) != token
+        os.makedirs(os.path.join(user_site, "dependency"))
+        os.utime(user_site, ns=(0, 0))
+        assert compute_verdict_token(["prefix", ["dependency"]]) != token
+        token = compute_verdict_token(["prefix", ["dependency"]])
+        os.makedirs(os.path.join(user_site, "dependency-1.0.dist-info"))
+        os.utime(user_site, ns=(0, 0))
+        assert compute_verdict_token(["prefix", ["dependency"]]) != token
+        monkeypatch.setattr(site, "USER_SITE", os.path.join(user_site, "not_existing"))
+        assert compute_verdict_token(["prefix", ["dependency"]]) != token
+        monkeypatch.setattr(site, "USER_SITE", None)
+        assert compute_verdict_token(["prefix", ["dependency"]]) != token
+    finally:
+        shutil.rmtree(user_site, ignore_errors=True)
+
+
+def test_compute_verdict_token_spawned_child() -> None:
+    """Test that a spawned child process, which inherits sys.path from its parent, computes the same token."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        assert pool.apply(compute_verdict_token, (["prefix", ["dependency"]], )) == compute_verdict_token(
+            ["prefix", ["dependency"]])
+
+
+def test_prevent_user_site_imports_inherit_verdict(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that pusimp.prevent_user_site_imports publishes a verdict on success, and then skips the check."""
+    guard_arguments = (
+        "pusimp_verdict_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        pusimp_golden_source.system_path, ["pusimp_dependency_one"], ["pusimp-dependency-one"], [False], [""],
+        pusimp_golden_source.pip_uninstall_call
+    )
+    verdict_env_name = verdict_environment_variable("pusimp_verdict_package")
+    assert verdict_env_name == "PUSIMP_VERDICT_PACKAGE_USER_SITE_IMPORTS_VERDICT"
+    monkeypatch.delenv(verdict_env_name, raising=False)
+    classified: typing.List[typing.List[str]] = []
+    guard_module = importlib.import_module("pusimp.prevent_user_site_imports")
+    original_classify_dependencies = guard_module._classify_dependencies
+
+    def _(*args: typing.Any) -> typing.Any:  # noqa: ANN401
+        classified.append(args[1])
+        return original_classify_dependencies(*args)
+
+    monkeypatch.setattr(guard_module, "_classify_dependencies", _)
+    with ImportSandbox():
+        pusimp.prevent_user_site_imports(*guard_arguments)
+        assert verdict_env_name not in os.environ
+        pusimp.clear_verdicts()
+        pusimp.prevent_user_site_imports(*guard_arguments, inherit_verdict=True)
+        assert len(classified) == 2
+        assert verdict_env_name in os.environ
+        pusimp.prevent_user_site_imports(*guard_arguments, inherit_verdict=True)
+        assert len(classified) == 2
+        pusimp.prevent_user_site_imports(*guard_arguments, check_tier="spec", inherit_verdict=True)
+        assert len(classified) == 3
+        sys.path.append(tempfile.gettempdir())
+        with pytest.raises(ImportError, match="pusimp_dependency_missing is missing"):
+            pusimp.prevent_user_site_imports(
+                *guard_arguments[:4], ["pusimp_dependency_missing"], *guard_arguments[5:], inherit_verdict=True)
+        assert len(classified) == 4
+    assert verdict_env_name not in os.environ
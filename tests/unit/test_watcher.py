@@ -0,0 +1,161 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.watcher on a mock user site."""
+
+import ctypes
+import importlib
+import os
+import pathlib
+import queue
+import site
+import sys
+import typing
+import warnings
+
+import pytest
+
+import pusimp
+import pusimp.watcher
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+DEPENDENCIES_IMPORT_NAME = ["pusimp_dependency_one", "pusimp_dependency_two"]
+
+
+def create_guard(**kwargs: typing.Any) -> pusimp.Guard:  # noqa: ANN401
+    """Create a guard on mock packages installed in the system path."""
+    return pusimp.Guard(
+        "pusimp_watcher_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        pusimp_golden_source.system_path, DEPENDENCIES_IMPORT_NAME,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in DEPENDENCIES_IMPORT_NAME],
+        [False] * len(DEPENDENCIES_IMPORT_NAME), [""] * len(DEPENDENCIES_IMPORT_NAME),
+        pusimp_golden_source.pip_uninstall_call, check_tier="spec", **kwargs)
+
+
+@pytest.fixture
+def user_site(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> typing.Iterator[pathlib.Path]:
+    """Prepare an import sandbox with a mock user site in front of the system path."""
+    user_site_path = tmp_path / "user_site"
+    user_site_path.mkdir()
+    monkeypatch.setattr(site, "USER_SITE", str(user_site_path))
+    with ImportSandbox():
+        sys.path[:] = [str(user_site_path), pusimp_golden_source.system_path]
+        for module_name in [module_name for module_name in sys.modules if module_name.startswith("pusimp_dependency")]:
+            del sys.modules[module_name]
+        yield user_site_path
+
+
+def record_revalidations(monkeypatch: pytest.MonkeyPatch) -> "queue.Queue[typing.List[str]]":
+    """Record the dependencies which are checked again on every revalidation."""
+    revalidations: queue.Queue[typing.List[str]] = queue.Queue()
+    original_find_problems = importlib.import_module("pusimp.prevent_user_site_imports")._find_problems
+
+    def _(guard: pusimp.Guard, *args: typing.Any) -> typing.Optional[str]:  # noqa: ANN401
+        import_error: typing.Optional[str] = original_find_problems(guard, *args)
+        revalidations.put(list(guard.dependencies_import_name))
+        return import_error
+
+    monkeypatch.setattr(pusimp.watcher, "_find_problems", _)
+    return revalidations
+
+
+def install(site_path: pathlib.Path, entry_name: str) -> None:
+    """Install a mock package, or a file, in a site directory."""
+    if "." in entry_name:
+        (site_path / entry_name).write_text("")
+    else:
+        (site_path / entry_name).mkdir()
+        (site_path / entry_name / "__init__.py").write_text("")
+
+
+def test_watcher(monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path) -> None:
+    """Test that a user-site installation is reported, and that only affected dependencies are checked again."""
+    revalidations = record_revalidations(monkeypatch)
+    problems: queue.Queue[str] = queue.Queue()
+    with pusimp.watcher.GuardWatcher(create_guard(), problems.put, settle_time=0.05) as watcher:
+        assert str(user_site) in watcher.watched_directories()
+        assert pusimp_golden_source.system_path in watcher.watched_directories()
+        install(user_site, "unrelated.py")
+        install(user_site, "pusimp_dependency_two")
+        assert revalidations.get(timeout=10) == ["pusimp_dependency_two"]
+        import_error = problems.get(timeout=10)
+        assert (
+            "* pusimp_dependency_two was imported from a local path: expected in "
+            f"{pusimp_golden_source.system_path}/pusimp_dependency_two/__init__.py, but imported from "
+            f"{user_site}/pusimp_dependency_two/__init__.py."
+        ) in import_error
+        assert "pusimp_dependency_one" not in import_error
+        install(user_site, "pusimp_dependency_one-1.0.dist-info")
+        assert revalidations.get(timeout=10) == ["pusimp_dependency_one"]
+        install(user_site, "distutils-precedence.pth")
+        assert revalidations.get(timeout=10) == DEPENDENCIES_IMPORT_NAME
+    assert watcher.watched_directories() == []
+
+
+def test_watcher_default_report(monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path) -> None:
+    """Test that problems are reported as warnings by default, even with the raise failure policy."""
+    problems: queue.Queue[str] = queue.Queue()
+    monkeypatch.setattr(warnings, "warn", lambda message, *args, **kwargs: problems.put(message))
+    with pusimp.watcher.GuardWatcher(create_guard(failure_policy="raise")):
+        install(user_site, "pusimp_dependency_one")
+        assert "pusimp_dependency_one was imported from a local path" in problems.get(timeout=10)
+
+
+def test_watcher_user_site_created(
+    monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    """Test that the closest ancestor of a missing user site is watched, and that its creation is noticed."""
+    revalidations = record_revalidations(monkeypatch)
+    missing_user_site = tmp_path / "missing" / "user_site"
+    monkeypatch.setattr(site, "USER_SITE", str(missing_user_site))
+    sys.path.insert(0, str(missing_user_site))
+    with pusimp.watcher.GuardWatcher(create_guard(), lambda import_error: None, settle_time=0.05) as watcher:
+        assert str(tmp_path) in watcher.watched_directories()
+        (tmp_path / "missing").mkdir()
+        assert revalidations.get(timeout=10) == DEPENDENCIES_IMPORT_NAME
+        missing_user_site.mkdir()
+        assert revalidations.get(timeout=10) == DEPENDENCIES_IMPORT_NAME
+        assert str(missing_user_site) in watcher.watched_directories()
+        install(missing_user_site, "pusimp_dependency_one")
+        assert revalidations.get(timeout=10) == ["pusimp_dependency_one"]
+
+
+def test_watcher_directory_removed(monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path) -> None:
+    """Test that removing a watched directory affects every dependency."""
+    revalidations = record_revalidations(monkeypatch)
+    with pusimp.watcher.GuardWatcher(create_guard(), lambda import_error: None, settle_time=0.05) as watcher:
+        os.rmdir(user_site)
+        assert revalidations.get(timeout=10) == DEPENDENCIES_IMPORT_NAME
+        assert str(user_site) not in watcher.watched_directories()
+
+
+def test_watcher_allow_user_site_imports(monkeypatch: pytest.MonkeyPatch, user_site: pathlib.Path) -> None:
+    """Test that nothing is checked again when the check is disabled by the environment variable."""
+    revalidations = record_revalidations(monkeypatch)
+    monkeypatch.setenv("PUSIMP_WATCHER_PACKAGE_ALLOW_USER_SITE_IMPORTS", "1")
+    guard = create_guard(dependencies_integrity_manifest=[None, None], dependencies_version_constraint=[None, None])
+    watcher = pusimp.watcher.GuardWatcher(guard, lambda import_error: None, settle_time=0.05)
+    watcher._revalidate([0])
+    assert revalidations.empty()
+    monkeypatch.delenv("PUSIMP_WATCHER_PACKAGE_ALLOW_USER_SITE_IMPORTS")
+    watcher._revalidate([1])
+    assert revalidations.get(timeout=10) == ["pusimp_dependency_two"]
+
+
+def test_watcher_unavailable(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a clear error is raised when inotify is not available, or cannot be initialized."""
+    class Libc:
+        """A mock C library, which may lack inotify."""
+
+        def __init__(self, has_inotify: bool) -> None:
+            if has_inotify:
+                self.inotify_init1 = lambda flags: -1
+
+    for has_inotify in (False, True):
+        monkeypatch.setattr(ctypes, "CDLL", lambda name, use_errno, has_inotify=has_inotify: Libc(has_inotify))
+        with pytest.raises(OSError):
+            pusimp.watcher.GuardWatcher(create_guard()).start()
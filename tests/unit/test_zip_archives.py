@@ -0,0 +1,139 @@
+# Copyright (C) 2023-2025 by the pusimp authors
+#
+# This file is part of pusimp.
+#
+# SPDX-License-Identifier: MIT
+"""Test pusimp.prevent_user_site_imports on dependencies bundled in zip archives created on the fly."""
+
+import importlib
+import pathlib
+import sys
+import typing
+import zipfile
+
+import pytest
+
+import pusimp
+import pusimp.lazy
+from pusimp.utils import ImportSandbox
+
+import pusimp_golden_source  # isort: skip
+
+prevent_user_site_imports_module = importlib.import_module("pusimp.prevent_user_site_imports")
+
+
+def create_archive(archive_path: pathlib.Path, members: typing.Dict[str, str]) -> None:
+    """Create a zip archive with the given members, without entries for directories."""
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        for (member_name, member_content) in members.items():
+            archive.writestr(member_name, member_content)
+
+
+@pytest.fixture
+def zipapp(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> typing.Iterator[pathlib.Path]:
+    """Prepare a zipapp bundling two dependencies in its lib directory, and add it to sys.path by a relative path."""
+    create_archive(tmp_path / "tool.pyz", {
+        "__main__.py": "",
+        "lib/pusimp_zip_one/__init__.py": "",
+        "lib/pusimp_zip_one/submodule.py": "",
+        "lib/pusimp_zip_two.py": "value = 2"
+    })
+    monkeypatch.chdir(tmp_path)
+    pusimp.clear_verdicts()
+    with ImportSandbox():
+        # zipimport reports locations relative to the archive path as found in sys.path
+        sys.path.insert(0, "tool.pyz/lib")
+        yield tmp_path / "tool.pyz" / "lib"
+
+
+def guard(
+    dependencies_expected_prefix: pathlib.Path, dependencies_import_name: typing.List[str],
+    **kwargs: typing.Any  # noqa: ANN401
+) -> pusimp.Guard:
+    """Create a guard on mandatory dependencies bundled in a zip archive."""
+    return pusimp.Guard(
+        "pusimp_zip_package", pusimp_golden_source.system_package_manager, pusimp_golden_source.contact_url,
+        str(dependencies_expected_prefix), dependencies_import_name,
+        [dependency_import_name.replace("_", "-") for dependency_import_name in dependencies_import_name],
+        [False] * len(dependencies_import_name), [""] * len(dependencies_import_name),
+        pusimp_golden_source.pip_uninstall_call, **kwargs)
+
+
+@pytest.mark.parametrize("check_tier", ["static", "spec", "import"])
+def test_zip_archive(zipapp: pathlib.Path, check_tier: str) -> None:
+    """Test that dependencies are found in the archive, and that their zipimport locations are matched."""
+    guard(zipapp, ["pusimp_zip_one"], check_tier=check_tier).check()
+    with pytest.raises(ImportError) as excinfo:
+        guard(zipapp, ["pusimp_zip_one", "pusimp_zip_missing"], check_tier=check_tier).check()
+    assert (
+        f"* pusimp_zip_missing is missing. Its expected path was {zipapp}/pusimp_zip_missing/__init__.py."
+        in str(excinfo.value))
+    assert "pusimp_zip_one" not in str(excinfo.value).split("\n\n")[0]
+
+
+def test_zip_archive_shadowed(zipapp: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    """Test that a dependency which shadows the one in the archive is reported."""
+    (tmp_path / "user_site" / "pusimp_zip_one").mkdir(parents=True)
+    (tmp_path / "user_site" / "pusimp_zip_one" / "__init__.py").write_text("")
+    sys.path.insert(0, str(tmp_path / "user_site"))
+    with pytest.raises(ImportError) as excinfo:
+        guard(zipapp, ["pusimp_zip_one"]).check()
+    assert (
+        f"* pusimp_zip_one was imported from a local path: expected in {zipapp}/pusimp_zip_one/__init__.py, "
+        f"but imported from {tmp_path}/user_site/pusimp_zip_one/__init__.py." in str(excinfo.value))
+
+
+def test_zip_archive_lazy_import_and_monitor(zipapp: pathlib.Path) -> None:
+    """Test that dependencies in the archive are imported lazily, and that their submodules pass the monitor."""
+    lazy_modules = pusimp.lazy.lazy_import(guard(zipapp, ["pusimp_zip_one"], check_tier="spec", monitor_imports=True))
+    importlib.import_module("pusimp_zip_one.submodule")
+    assert lazy_modules["pusimp_zip_one"].__file__ == "tool.pyz/lib/pusimp_zip_one/__init__.py"
+
+
+def test_zip_archive_memoized_verdict(zipapp: pathlib.Path) -> None:
+    """Test that the memoized verdict of a guard is invalidated when the archive is replaced."""
+    environment_fingerprint = prevent_user_site_imports_module._environment_fingerprint(str(zipapp), [])
+    assert environment_fingerprint[1][0] is not None
+    guard(zipapp, ["pusimp_zip_one"], check_tier="static").check()
+    create_archive(zipapp.parent.with_suffix(".new"), {"lib/pusimp_zip_two.py": ""})
+    zipapp.parent.with_suffix(".new").replace(zipapp.parent)
+    assert prevent_user_site_imports_module._environment_fingerprint(str(zipapp), []) != environment_fingerprint
+    with pytest.raises(ImportError, match="pusimp_zip_one is missing"):
+        guard(zipapp, ["pusimp_zip_one"], check_tier="static").check()
+
+
+def test_archive_members(tmp_path: pathlib.Path) -> None:
+    """Test that the central directory of an archive is read once, and read again when the archive changes."""
+    create_archive(tmp_path / "archive.zip", {"package/module.py": ""})
+    archive_members = prevent_user_site_imports_module._read_archive_members(str(tmp_path / "archive.zip"))
+    assert archive_members == {"package", "package/module.py"}
+    assert prevent_user_site_imports_module._read_archive_members(str(tmp_path / "archive.zip")) is archive_members
+    create_archive(tmp_path / "archive.zip", {"package/module.py": "", "other.py": ""})
+    assert prevent_user_site_imports_module._read_archive_members(str(tmp_path / "archive.zip")) == {
+        "package", "package/module.py", "other.py"}
+    (tmp_path / "not_an_archive.zip").write_text("")
+    assert prevent_user_site_imports_module._read_archive_members(str(tmp_path / "not_an_archive.zip")) is None
+    assert prevent_user_site_imports_module._read_archive_members(str(tmp_path / "missing.zip")) is None
+
+
+@pytest.mark.parametrize("location,names", [
+    (".", ["archive.zip", "not_an_archive.zip"]),
+    ("archive.zip", ["package"]),
+    ("archive.zip/package", ["module.py"]),
+    ("archive.zip/missing", []),
+    ("not_an_archive.zip", None),
+    ("not_an_archive.zip/package", None),
+    ("missing/package", []),
+    ("x" * 1000, None)
+])
+def test_list_location(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path, location: str,
+    names: typing.Optional[typing.List[str]]
+) -> None:
+    """Test that directories are listed from the filesystem or from zip archives, by relative or absolute paths."""
+    create_archive(tmp_path / "archive.zip", {"package/module.py": ""})
+    (tmp_path / "not_an_archive.zip").write_text("")
+    monkeypatch.chdir(tmp_path)
+    for path in (location, str(tmp_path / location)):
+        location_names = prevent_user_site_imports_module._list_location(path)
+        assert (sorted(location_names) if location_names is not None else None) == names